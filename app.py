@@ -1,24 +1,62 @@
-import streamlit as st
-import pandas as pd
-import altair as alt
 import time
+_BOOT_T0 = time.perf_counter()
+import streamlit as st
 import json
-import mysql.connector
 import requests
-import yfinance as yf
 from datetime import datetime, timedelta, timezone
 import streamlit.components.v1 as components
 import os
 import uuid
 import re
+import importlib.util
+import threading
+import random
+import copy
+from contextlib import nullcontext
+from worker.metrics import RunMetrics
+from worker.rules import parse_rule_line, format_rule
+from worker.digest import digest_always
+from worker.portfolio import value_portfolio
+from worker.changes import row_fingerprint, mark_checked
+from worker import mirror, blocklist, global_config, earnings
+from worker.throttle import FetchController, yf_download, all_no_data, batch_misses
+from worker.pipeline import Stage, run_pipeline
+from worker.markets import needs_refresh, db_timezone
+from worker.scanner import request_scan, recent_runs
+from worker.migrations import migrate
 
 # --- IMPORTS FOR NEWS & AI ---
-try:
-    import feedparser
-    import openai
-    NEWS_LIB_READY = True
-except ImportError:
-    NEWS_LIB_READY = False
+# pandas, altair, yfinance, mysql.connector, feedparser and openai are imported
+# inside the functions that use them, so the login page never pays for them.
+NEWS_LIB_READY = all(importlib.util.find_spec(m) is not None for m in ("feedparser", "openai"))
+
+# --- STARTUP TIMING ---
+# Enable with PP_STARTUP_TIMING=1 or ?timing=1 in the URL
+_TIMINGS = []
+
+def mark(label):
+    _TIMINGS.append((label, (time.perf_counter() - _BOOT_T0) * 1000))
+
+@st.cache_resource
+def _process_boot():
+    return {"started": time.time(), "reruns": 0}
+
+# --- RERUN PROFILER ---
+# Admins can switch this on from the sidebar; it times data calls and render
+# sections and counts DB connections / round-trips for the current rerun.
+PROF = RunMetrics("rerun") if st.session_state.get("profile_reruns") else None
+
+def prof(label):
+    return PROF.stage(label) if PROF else nullcontext()
+
+def render_profile_panel():
+    if not PROF: return
+    s = PROF.summary()
+    rows = [{"section": k, "ms": v} for k, v in sorted(s["stages_ms"].items(), key=lambda kv: kv[1], reverse=True)]
+    with st.expander(f"⏱️ Rerun Profile ({PROF.job}): {s['duration_ms']:,.0f}ms | DB connections: {s['counts'].get('db_connections', 0)} | DB round-trips: {s['counts'].get('db_roundtrips', 0)}"):
+        st.table(rows)
+        st.caption(f"Counts: {s['counts']} — sections include the data calls made inside them.")
+    PROF.job = "done"
 
 # --- CONFIG ---
 try:
@@ -40,109 +78,119 @@ DB_CONFIG = {
 
 # --- DATABASE ENGINE ---
 def get_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+    import mysql.connector
+    conn = mysql.connector.connect(**DB_CONFIG)
+    if PROF:
+        PROF.incr("db_connections")
+        return PROF.track(conn)
+    return conn
+
+# Schema changes live in worker/migrations.py and run once per server process
+# (a failed attempt is not cached, so the next rerun retries).
+@st.cache_resource
+def _migrate_once():
+    conn = get_connection()
+    migrate(conn)
+    conn.close()
+    return True
 
 def init_db():
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS user_profiles (username VARCHAR(255) PRIMARY KEY, user_data TEXT, pin VARCHAR(50))")
-        cursor.execute("CREATE TABLE IF NOT EXISTS user_sessions (token VARCHAR(255) PRIMARY KEY, username VARCHAR(255), created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stock_cache (
-                ticker VARCHAR(20) PRIMARY KEY,
-                current_price DECIMAL(20, 4),
-                day_change DECIMAL(10, 2),
-                rsi DECIMAL(10, 2),
-                volume_status VARCHAR(20),
-                trend_status VARCHAR(20),
-                rating VARCHAR(50),
-                next_earnings VARCHAR(20),
-                pre_post_price DECIMAL(20, 4),
-                pre_post_pct DECIMAL(10, 2),
-                price_history JSON,
-                company_name VARCHAR(255),
-                day_high DECIMAL(20, 4),
-                day_low DECIMAL(20, 4),
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-            )
-        """)
-        cursor.execute("CREATE TABLE IF NOT EXISTS daily_briefing (date DATE PRIMARY KEY, picks JSON, sent TINYINT DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-        try: cursor.execute("ALTER TABLE daily_briefing ADD COLUMN sent TINYINT DEFAULT 0"); 
-        except: pass
-        for col in ['day_high', 'day_low', 'company_name', 'pre_post_price', 'rating', 'next_earnings']:
-            try:
-                dtype = "DECIMAL(20,4)" if "day" in col or "price" in col else "VARCHAR(255)"
-                cursor.execute(f"ALTER TABLE stock_cache ADD COLUMN {col} {dtype}")
-            except: pass
-        conn.close()
-        return True
-    except Exception:
-        return False
+    try: return _migrate_once()
+    except Exception: return False
 
 # --- BACKEND UPDATE ENGINE ---
+@st.cache_resource
+def get_fetch_controller():
+    return FetchController()
+
+# Every rerun of every session runs this, so only a sample of runs is logged to the
+# metrics file: 10% by default (APP_METRICS_SAMPLE=1 logs all of them, 0 none).
+APP_METRICS_SAMPLE = float(os.environ.get("APP_METRICS_SAMPLE") or 0.1)
+
+def _finish_metrics(m):
+    if APP_METRICS_SAMPLE and random.random() < APP_METRICS_SAMPLE: m.finish(ok=not m.counts.get("aborted"))
+
 def run_backend_update():
+    m = RunMetrics("run_backend_update")
     try:
-        conn = get_connection()
+        import pandas as pd
+        import yfinance as yf
+        conn = m.track(get_connection())
         cursor = conn.cursor(dictionary=True, buffered=True)
-        cursor.execute("SELECT user_data FROM user_profiles")
-        users = cursor.fetchall()
-        
-        def clean_list(raw_str):
-            if not raw_str: return []
-            cleaned = []
-            for t in raw_str.split(","):
-                symbol = t.split(":")[0].strip().upper()
-                if symbol: cleaned.append(symbol)
-            return cleaned
-
-        all_tickers = set(["^DJI", "^IXIC", "^GSPTSE", "GC=F"]) 
-        for r in users:
-            try:
-                data = json.loads(r['user_data'])
-                if 'w_input' in data: all_tickers.update(clean_list(data['w_input']))
-                if 'portfolio' in data: all_tickers.update(data['portfolio'].keys())
-                if 'tape_input' in data: all_tickers.update(clean_list(data['tape_input']))
-            except: pass
-
-        if not all_tickers: conn.close(); return
-
-        format_strings = ','.join(['%s'] * len(all_tickers))
-        cursor.execute(f"SELECT ticker, last_updated, rating, next_earnings FROM stock_cache WHERE ticker IN ({format_strings})", tuple(all_tickers))
-        existing_rows = {row['ticker']: row for row in cursor.fetchall()}
-        
-        to_fetch_price = []
-        to_fetch_meta = []
-        now = datetime.now()
-        
-        for t in all_tickers:
-            row = existing_rows.get(t)
-            if not row or not row['last_updated'] or (now - row['last_updated']).total_seconds() > 120:
-                to_fetch_price.append(t)
-            if not row or row.get('rating') == 'N/A' or row.get('next_earnings') == 'N/A':
-                to_fetch_meta.append(t)
+        with m.stage("universe"):
+            cursor.execute("SELECT user_data FROM user_profiles")
+            users = cursor.fetchall()
+            
+            def clean_list(raw_str):
+                if not raw_str: return []
+                cleaned = []
+                for t in raw_str.split(","):
+                    symbol = t.split(":")[0].strip().upper()
+                    if symbol: cleaned.append(symbol)
+                return cleaned
+
+            all_tickers = set(["^DJI", "^IXIC", "^GSPTSE", "GC=F"]) 
+            for r in users:
+                try:
+                    data = json.loads(r['user_data'])
+                    if 'w_input' in data: all_tickers.update(clean_list(data['w_input']))
+                    if 'portfolio' in data: all_tickers.update(data['portfolio'].keys())
+                    if 'tape_input' in data: all_tickers.update(clean_list(data['tape_input']))
+                except: m.incr("bad_profiles")
+        m.incr("tickers", len(all_tickers))
+
+        if not all_tickers: conn.close(); _finish_metrics(m); return
+
+        with m.stage("freshness"):
+            format_strings = ','.join(['%s'] * len(all_tickers))
+            cursor.execute(f"SELECT ticker, last_updated, checked_at, app_hash, rating FROM stock_cache WHERE ticker IN ({format_strings})", tuple(all_tickers))
+            existing_rows = {row['ticker']: row for row in cursor.fetchall()}
+            
+            to_fetch_price = []
+            to_fetch_meta = []
+            now, db_tz = datetime.now().astimezone(), db_timezone(cursor)
+            
+            for t in all_tickers:
+                row = existing_rows.get(t)
+                checked = (row.get('checked_at') or row.get('last_updated')) if row else None
+                # Open venues go stale after 120s; closed ones get one post-close fetch, then wait for the open
+                if needs_refresh(t, checked, now, ttl=120, db_tz=db_tz):
+                    to_fetch_price.append(t)
+                if not row or row.get('rating') == 'N/A':
+                    to_fetch_meta.append(t)
+            # Symbols Yahoo keeps returning nothing for wait out their backoff
+            to_fetch_price, known_bad = blocklist.screen(cursor, to_fetch_price, m)
+            to_fetch_meta = [t for t in to_fetch_meta if t not in known_bad]  # meta waits for a good price fetch
+        m.incr("fresh", len(all_tickers) - len(to_fetch_price))
+        returned, misses = [], []
         
         if to_fetch_price:
-            batch_size = 15
-            ticker_list = list(to_fetch_price)
-            for i in range(0, len(ticker_list), batch_size):
-                batch = ticker_list[i:i + batch_size]
+            def download(batch):
                 tickers_str = " ".join(batch)
-                
-                try:
-                    # FIX: prepost=False for OFFICIAL CLOSE accuracy
-                    live_data = yf.download(tickers_str, period="5d", interval="1m", prepost=False, group_by='ticker', threads=True, progress=False)
-                    hist_data = yf.download(tickers_str, period="1mo", interval="1d", group_by='ticker', threads=True, progress=False)
-
-                    for t in batch:
-                        try:
+                # FIX: prepost=False for OFFICIAL CLOSE accuracy
+                # Serialized per process (worker/throttle.py): yf.download keeps results in module globals
+                live_data, errors = yf_download(tickers_str, period="5d", interval="1m", prepost=False, group_by='ticker', threads=True, progress=False)
+                hist_data, _ = yf_download(tickers_str, period="1mo", interval="1d", group_by='ticker', threads=True, progress=False)
+                return live_data, hist_data, batch, errors
+
+            # An empty batch (even of one symbol) is an outage/throttle, unless Yahoo said every
+            # symbol in it is unknown/delisted
+            batch_failed = lambda r: r[0] is None or r[0].empty
+            batch_invalid = lambda r: all_no_data(r[2], r[3])
+
+            def compute(item):
+                batch, (live_data, hist_data, _, errors) = item
+                rows, unchanged, empty = [], [], []
+                for t in batch:
+                    try:
+                        with m.stage("indicators"):
                             if len(batch) == 1: df_live = live_data
                             else: 
-                                if t not in live_data.columns.levels[0]: continue
+                                if live_data.empty or t not in live_data.columns.levels[0]: m.incr("skipped"); empty.append(t); continue
                                 df_live = live_data[t]
                             
-                            df_live = df_live.dropna(subset=['Close'])
-                            if df_live.empty: continue
+                            if not df_live.empty: df_live = df_live.dropna(subset=['Close'])
+                            if df_live.empty: m.incr("skipped"); empty.append(t); continue
                             
                             live_price = float(df_live['Close'].iloc[-1])
                             last_time = df_live.index[-1]
@@ -196,98 +244,81 @@ def run_backend_update():
                                 
                                 chart_json = json.dumps(df_hist['Close'].tail(20).tolist())
 
-                            sql = """INSERT INTO stock_cache (ticker, current_price, day_change, rsi, volume_status, trend_status, price_history, day_high, day_low, last_updated) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW()) ON DUPLICATE KEY UPDATE current_price=%s, day_change=%s, rsi=%s, volume_status=%s, trend_status=%s, price_history=%s, day_high=%s, day_low=%s, last_updated=NOW()"""
-                            v = (t, final_price, day_change, rsi, vol_stat, trend, chart_json, day_h, day_l, final_price, day_change, rsi, vol_stat, trend, chart_json, day_h, day_l)
-                            cursor.execute(sql, v)
-                            conn.commit()
-                        except: pass
-                except: pass
+                        m.incr("fetched"); returned.append(t)
+                        # --- CHANGE DETECTION: skip the write if nothing moved ---
+                        fp = row_fingerprint(final_price, day_change, rsi, vol_stat, trend, chart_json, day_h, day_l)
+                        old = existing_rows.get(t)
+                        if old and old.get('app_hash') == fp:
+                            unchanged.append(t); m.incr("unchanged"); continue
+
+                        rows.append((t, final_price, day_change, rsi, vol_stat, trend, chart_json, day_h, day_l, fp))
+                    except: m.incr("failed")
+                # Only symbols Yahoo had no data for count as misses, not throttled/timed-out ones
+                misses.extend(batch_misses(batch, [t for t in batch if t not in empty], errors))
+                return rows, unchanged
+
+            def write(item):
+                rows, unchanged = item
+                with m.stage("db_write"):
+                    if rows:
+                        sql = """INSERT INTO stock_cache (ticker, current_price, day_change, rsi, volume_status, trend_status, price_history, day_high, day_low, app_hash, checked_at, last_updated) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW()) ON DUPLICATE KEY UPDATE current_price=VALUES(current_price), day_change=VALUES(day_change), rsi=VALUES(rsi), volume_status=VALUES(volume_status), trend_status=VALUES(trend_status), price_history=VALUES(price_history), day_high=VALUES(day_high), day_low=VALUES(day_low), app_hash=VALUES(app_hash), checked_at=NOW(), last_updated=NOW()"""
+                        cursor.executemany(sql, rows)
+                    if unchanged: mark_checked(cursor, unchanged)
+                    conn.commit()
+                m.incr("changed", len(rows))
+
+            # Batch size / concurrency / backoff come from the shared adaptive controller. The next
+            # download wave runs while this one's indicators are computed and written (worker/pipeline.py).
+            run_pipeline(get_fetch_controller().run(to_fetch_price, download, m, empty=batch_failed, invalid=batch_invalid), [
+                Stage("indicators", compute, workers=2),
+                Stage("db_write", write),
+            ], m, on_error=lambda stage, item, e: m.incr("failed_batches"))
+            try:
+                blocklist.settle(cursor, misses, returned, known_bad)
+                conn.commit()
+            except: m.incr("blocklist_failed")
 
         if to_fetch_meta:
+            # Earnings dates come from the bulk calendar (worker/earnings.py), not per-ticker calls
+            try: upcoming = earnings.next_dates(cursor, to_fetch_meta[:3])
+            except: upcoming = {}
             for t in to_fetch_meta[:3]: 
                 try:
-                    time.sleep(0.5) 
-                    tk = yf.Ticker(t)
-                    info = tk.info
-                    r_val = info.get('recommendationKey', 'N/A').replace('_', ' ').upper()
-                    n_val = info.get('shortName') or info.get('longName') or t
-                    e_val = "N/A"
-                    try:
-                        cal = tk.calendar
-                        dates = []
-                        if isinstance(cal, dict) and 'Earnings Date' in cal: dates = cal['Earnings Date']
-                        elif hasattr(cal, 'iloc'): dates = [v for v in cal.values.flatten() if isinstance(v, (datetime, pd.Timestamp))]
-                        future_dates = [d for d in dates if pd.to_datetime(d).date() >= datetime.now().date()]
-                        if future_dates: e_val = min(future_dates).strftime('%b %d')
-                    except: pass
-                    sql = "UPDATE stock_cache SET rating=%s, next_earnings=%s, company_name=%s WHERE ticker=%s"
-                    cursor.execute(sql, (r_val, e_val, n_val, t))
-                    conn.commit()
-                except: pass
+                    with m.stage("metadata"):
+                        time.sleep(0.5) 
+                        tk = yf.Ticker(t)
+                        info = tk.info
+                        r_val = info.get('recommendationKey', 'N/A').replace('_', ' ').upper()
+                        n_val = info.get('shortName') or info.get('longName') or t
+                        e_val = earnings.label(upcoming.get(t))
+                    with m.stage("db_write"):
+                        sql = "UPDATE stock_cache SET rating=%s, next_earnings=%s, company_name=%s WHERE ticker=%s"
+                        cursor.execute(sql, (r_val, e_val, n_val, t))
+                        conn.commit()
+                    m.incr("meta_fetched")
+                except: m.incr("meta_failed")
         conn.close()
-    except Exception: pass
+    except Exception: m.incr("aborted")
+    if m.counts.get("changed") or m.counts.get("meta_fetched"): mirror.expire()
+    _finish_metrics(m)
 
 # --- SCANNER ENGINE ---
-@st.cache_data(ttl=900)
-def run_gap_scanner(api_key):
-    fh_key = st.secrets.get("FINNHUB_API_KEY")
-    candidates = []
-    discovery_tickers = set()
+# The gap scanner runs as a worker job (worker/scanner.py): pre-market, open and
+# post-market on the cron, plus any run queued from the admin panel.
+def queue_scan():
     try:
-        feeds = ["https://finance.yahoo.com/rss/most-active", "https://finance.yahoo.com/news/rssindex"]
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        for url in feeds:
-            try:
-                resp = requests.get(url, headers=headers, timeout=5)
-                if resp.status_code == 200:
-                    f = feedparser.parse(resp.content)
-                    for entry in f.entries[:25]:
-                        match = re.search(r'\b[A-Z]{2,5}\b', entry.title)
-                        if match: 
-                            t = match.group(0)
-                            if t not in ["ETF", "THE", "FOR", "AND", "NEW", "CEO"]: discovery_tickers.add(t)
-            except: continue
-    except: pass
-    staples = []
-    discovery_tickers.update(staples)
-    scan_list = list(discovery_tickers)
-    
+        conn = get_connection()
+        run_id = request_scan(conn, st.session_state.get("username", "admin"))
+        conn.close()
+        return run_id
+    except: return None
+
+def get_scan_runs():
     try:
-        data = yf.download(" ".join(scan_list), period="5d", interval="1d", group_by='ticker', threads=True, progress=False)
-        for t in scan_list:
-            try:
-                if len(scan_list) > 1:
-                    if t not in data.columns.levels[0]: continue
-                    df = data[t]
-                else: df = data
-                if df.empty or len(df) < 2: continue
-                prev_close = float(df['Close'].iloc[-2])
-                curr_price = float(df['Close'].iloc[-1]) 
-                try:
-                    r = requests.get(f"https://finnhub.io/api/v1/quote?symbol={t}&token={fh_key}", timeout=1).json()
-                    if 'c' in r and r['c'] != 0: curr_price = float(r['c'])
-                except: pass
-                gap_pct = ((curr_price - prev_close) / prev_close) * 100
-                avg_vol = df['Volume'].mean()
-                atr = (df['High'] - df['Low']).mean()
-                if abs(gap_pct) >= 0.5 and avg_vol > 50000:
-                    candidates.append({"ticker": t, "gap": gap_pct, "atr": atr})
-            except: continue
+        conn = get_connection(); rows = recent_runs(conn); conn.close()
+        return rows
     except: return []
 
-    if api_key and candidates:
-        try:
-            candidates.sort(key=lambda x: abs(x['gap']), reverse=True)
-            top_10 = candidates[:10]
-            client = openai.OpenAI(api_key=api_key)
-            prompt = f"Pick Top 3 for day trading. Return JSON: {{'picks': ['TICKER', 'TICKER', 'TICKER']}}\nData: {str(top_10)}"
-            resp = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": prompt}], response_format={"type": "json_object"})
-            picks = json.loads(resp.choices[0].message.content).get("picks", [])
-            return picks if picks else [c['ticker'] for c in top_10[:3]]
-        except: return [c['ticker'] for c in candidates[:3]]
-    candidates.sort(key=lambda x: abs(x['gap']), reverse=True)
-    return [c['ticker'] for c in candidates[:3]]
-
 # --- AUTH & HELPERS ---
 def check_user_exists(username):
     try:
@@ -347,20 +378,20 @@ def save_user_profile(username, data, pin=None):
     except: pass
 
 def load_global_config():
-    try:
-        conn = get_connection(); cursor = conn.cursor()
-        cursor.execute("SELECT user_data FROM user_profiles WHERE username = 'GLOBAL_CONFIG'")
-        res = cursor.fetchone(); conn.close()
-        return json.loads(res[0]) if res else {"portfolio": {}, "openai_key": "", "rss_feeds": ["https://finance.yahoo.com/news/rssindex"], "tape_input": "^DJI, ^IXIC, ^GSPTSE, GC=F"}
-    except: return {}
+    """
+    This session's editable copy of GLOBAL_CONFIG. The parsed blob lives once per
+    process (worker/global_config.py); the session copy is only replaced when the
+    shared version moves, so reruns never touch MySQL or json.loads for it.
+    """
+    version, data = global_config.current(get_connection)
+    if "global_data" not in st.session_state or st.session_state.get("global_version") != version:
+        st.session_state["global_version"] = version
+        st.session_state["global_data"] = copy.deepcopy(data)
+    return st.session_state["global_data"]
 
 def save_global_config(data):
     try:
-        conn = get_connection(); cursor = conn.cursor()
-        j_str = json.dumps(data)
-        sql = "INSERT INTO user_profiles (username, user_data) VALUES ('GLOBAL_CONFIG', %s) ON DUPLICATE KEY UPDATE user_data = %s"
-        cursor.execute(sql, (j_str, j_str))
-        conn.commit(); conn.close()
+        st.session_state["global_version"] = global_config.save(get_connection, data)
     except: pass
 
 def get_global_config_data():
@@ -386,6 +417,8 @@ def relative_time(date_str):
 @st.cache_data(ttl=600)
 def fetch_news(feeds, tickers, api_key):
     if not NEWS_LIB_READY: return []
+    import feedparser
+    import openai
     all_feeds = feeds.copy()
     if tickers:
         for t in tickers: all_feeds.append(f"https://finance.yahoo.com/rss/headline?s={t}")
@@ -422,59 +455,107 @@ def fetch_news(feeds, tickers, api_key):
     return articles
 
 # --- DATA ENGINE ---
-@st.cache_data(ttl=600)
-def get_fundamentals(s):
+# Dashboard reads come from the local stock_cache mirror (worker/mirror.py);
+# MySQL only sees one delta query per sync interval per process.
+def _market_label():
+    now = datetime.now(timezone.utc) - timedelta(hours=5)
+    lbl = "POST" if now.hour >= 16 else "PRE" if now.hour < 9 else "LIVE"
+    if now.weekday() > 4: lbl = "POST" 
+    return lbl
+
+def _card_entry(row):
+    """One stock_cache row -> the dict a dashboard card is drawn from."""
+    import pandas as pd
+    s = row['ticker']
+    price = float(row['current_price']); change = float(row['day_change'])
+    rsi_val = float(row['rsi']); trend = row['trend_status']
+    vol_stat = row['volume_status']; display_name = row.get('company_name') or s
+
+    # --- PRE/POST DATA (label is applied at draw time) ---
+    pp_p = pp_c = None
+    if row.get('pre_post_price') and float(row['pre_post_price']) > 0:
+        pp_p = float(row['pre_post_price'])
+        pp_c = float(row['pre_post_pct'])
+
+    vol_pct = 150 if vol_stat == "HEAVY" else (50 if vol_stat == "LIGHT" else 100)
+    day_h = float(row.get('day_high') or price); day_l = float(row.get('day_low') or price)
+    range_pos = 50
+    if day_h > day_l: range_pos = max(0, min(100, ((price - day_l) / (day_h - day_l)) * 100))
+    raw_hist = row.get('price_history')
+    points = json.loads(raw_hist) if raw_hist else [price] * 20
+    chart_data = pd.DataFrame({'Idx': range(len(points)), 'Stock': points})
+    base = chart_data['Stock'].iloc[0] if chart_data['Stock'].iloc[0] != 0 else 1
+    chart_data['Stock'] = ((chart_data['Stock'] - base) / base) * 100
+    fundamentals = {"rating": row.get('rating') or "N/A", "earn": row.get('next_earnings') or "N/A"}
+    return {"p": price, "d": change, "hist": points, "name": display_name, "rsi": rsi_val, "vol_pct": vol_pct, "vol_label": vol_stat, "range_pos": range_pos, "h": day_h, "l": day_l, "ai": "BULLISH" if trend == "UPTREND" else "BEARISH", "trend": trend, "pp_p": pp_p, "pp_c": pp_c, "f": fundamentals, "chart": chart_data, "stamp": row.get('last_updated')}
+
+def get_dashboard_data(view, tickers_list):
+    """
+    Card data for fragment ticks, refreshed incrementally. Each session (and view) remembers the
+    mirror version it last saw and only rebuilds entries for rows changed since then;
+    unchanged tickers keep the same dict object, so their cards are not rebuilt either.
+    """
+    cache = st.session_state.setdefault(f"dash_data_{view}", {"since": None, "data": {}})
+    data = cache["data"]
+    for t in [t for t in data if t not in tickers_list]: del data[t]
+    try:
+        mirror.ensure_fresh(get_connection)
+        stamp = mirror.version()
+        new = [t for t in tickers_list if t not in data]
+        known = [t for t in tickers_list if t in data]
+        rows = mirror.read_rows(new, get_connection) if new else []
+        if known: rows += mirror.read_rows(known, get_connection, since=cache["since"])
+        for row in rows:
+            t = row['ticker']
+            if t in data and data[t]["stamp"] == row.get('last_updated'): continue
+            try: data[t] = _card_entry(row)
+            except: pass
+            if PROF: PROF.incr("cards_rebuilt")
+        cache["since"] = stamp
+    except: pass
+    return data
+
+@st.cache_data(ttl=60)
+def get_latest_briefing():
     try:
         conn = get_connection(); cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT rating, next_earnings FROM stock_cache WHERE ticker = %s", (s,))
+        # FIX: ORDER BY DESC LIMIT 1 ensures we get the latest picks regardless of timezone rollover
+        cursor.execute("SELECT picks, created_at, candidates, scan_meta FROM daily_briefing ORDER BY date DESC LIMIT 1")
         row = cursor.fetchone(); conn.close()
-        return {"rating": row['rating'] or "N/A", "earn": row['next_earnings'] or "N/A"} if row else {"rating": "N/A", "earn": "N/A"}
-    except: return {"rating": "N/A", "earn": "N/A"}
+        return row
+    except: return None
 
-def get_batch_data(tickers_list):
-    if not tickers_list: return {}
-    results = {}
+@st.cache_data(ttl=300)
+def get_bad_symbols():
+    """Blocklisted symbols (worker/blocklist.py) -> short status label, shared by all sessions."""
     try:
         conn = get_connection(); cursor = conn.cursor(dictionary=True)
-        format_strings = ','.join(['%s'] * len(tickers_list))
-        cursor.execute(f"SELECT * FROM stock_cache WHERE ticker IN ({format_strings})", tuple(tickers_list))
-        rows = cursor.fetchall(); conn.close()
-        for row in rows:
-            s = row['ticker']
-            price = float(row['current_price']); change = float(row['day_change'])
-            rsi_val = float(row['rsi']); trend = row['trend_status']
-            vol_stat = row['volume_status']; display_name = row.get('company_name') or s
-            pp_html = ""
-            
-            # --- SHOW PRE/POST IF DATA EXISTS ---
-            if row.get('pre_post_price') and float(row['pre_post_price']) > 0:
-                pp_p = float(row['pre_post_price'])
-                pp_c = float(row['pre_post_pct'])
-                
-                now = datetime.now(timezone.utc) - timedelta(hours=5)
-                lbl = "POST" if now.hour >= 16 else "PRE" if now.hour < 9 else "LIVE"
-                if now.weekday() > 4: lbl = "POST" 
-                col = "#4caf50" if pp_c >= 0 else "#ff4b4b"
-                pp_html = f"<div style='font-size:11px; color:#888; margin-top:2px;'>{lbl}: <span style='color:{col}; font-weight:bold;'>${pp_p:,.2f} ({pp_c:+.2f}%)</span></div>"
-            # ------------------------------------
-
-            vol_pct = 150 if vol_stat == "HEAVY" else (50 if vol_stat == "LIGHT" else 100)
-            day_h = float(row.get('day_high') or price); day_l = float(row.get('day_low') or price)
-            range_pos = 50
-            if day_h > day_l: range_pos = max(0, min(100, ((price - day_l) / (day_h - day_l)) * 100))
-            raw_hist = row.get('price_history')
-            points = json.loads(raw_hist) if raw_hist else [price] * 20
-            chart_data = pd.DataFrame({'Idx': range(len(points)), 'Stock': points})
-            base = chart_data['Stock'].iloc[0] if chart_data['Stock'].iloc[0] != 0 else 1
-            chart_data['Stock'] = ((chart_data['Stock'] - base) / base) * 100
-            results[s] = {"p": price, "d": change, "name": display_name, "rsi": rsi_val, "vol_pct": vol_pct, "vol_label": vol_stat, "range_pos": range_pos, "h": day_h, "l": day_l, "ai": "BULLISH" if trend == "UPTREND" else "BEARISH", "trend": trend, "pp": pp_html, "chart": chart_data}
-    except: pass
-    return results
+        rows = blocklist.load(cursor); conn.close()
+        return {t: blocklist.describe(r) for t, r in rows.items()}
+    except: return {}
+
+@st.cache_data(ttl=600)
+def get_earnings_week(tickers):
+    """Watchlist earnings from today through Sunday, from the earnings_calendar index."""
+    try:
+        conn = get_connection(); cursor = conn.cursor(dictionary=True)
+        rows = earnings.this_week(cursor, tickers); conn.close()
+        return rows
+    except: return []
 
 # --- SCROLLER RENDERER (NICKNAME SUPPORT) ---
-@st.cache_data(ttl=60)
-def get_tape_data(symbol_string, nickname_string=""):
-    items = []; symbols = []
+# The tape config is global, so the tape is built once per process and shared by
+# every session. Only the numeric payload is re-read (at most every TAPE_REFRESH_SECONDS,
+# by one session at a time); the iframe document is rebuilt only when those numbers change.
+TAPE_REFRESH_SECONDS = 30
+TAPE_DOC = """<!DOCTYPE html><html><head><style>body{{margin:0;padding:0;background:transparent;overflow:hidden;font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,Helvetica,Arial,sans-serif}}.ticker-container{{width:100%;height:45px;background:#111;display:flex;align-items:center;border-bottom:1px solid #333;border-radius:0 0 15px 15px;box-shadow:0 4px 10px rgba(0,0,0,0.3)}}.ticker-wrap{{width:100%;overflow:hidden;white-space:nowrap}}.ticker-move{{display:inline-block;animation:ticker 15s linear infinite}}@keyframes ticker{{0%{{transform:translate3d(0,0,0)}}100%{{transform:translate3d(-25%,0,0)}}}}.ticker-item{{display:inline-block;color:white;font-weight:900;font-size:16px;padding:0 20px}}</style></head><body><div class="ticker-container"><div class="ticker-wrap"><div class="ticker-move"><span class="ticker-item">{c}&nbsp;|&nbsp;{c}&nbsp;|&nbsp;{c}&nbsp;|&nbsp;{c}</span></div></div></div></body></html>"""
+
+@st.cache_resource
+def _tape_store():
+    return {"key": None, "version": None, "doc": "", "checked": 0.0, "lock": threading.Lock()}
+
+def _tape_layout(symbol_string, nickname_string=""):
+    symbols = []
     
     # 1. Clean the Symbol List (Remove any old "BTC:BTC" mess if present)
     for x in symbol_string.split(","):
@@ -494,45 +575,75 @@ def get_tape_data(symbol_string, nickname_string=""):
     # 3. Default "Nice Names"
     defaults = {"^DJI": "DOW", "^IXIC": "NASDAQ", "^GSPTSE": "TSX", "GC=F": "GOLD", "BTC-USD": "BTC", "CADUSD=X": "CAD/USD"}
     final_map = defaults.copy(); final_map.update(nick_map)
-
-    if not symbols: return ""
-    
-    try:
-        conn = get_connection(); cursor = conn.cursor(dictionary=True)
-        cursor.execute(f"SELECT * FROM stock_cache WHERE ticker IN ({','.join(['%s']*len(symbols))})", tuple(symbols))
-        rows = cursor.fetchall(); conn.close()
-        data_map = {row['ticker']: row for row in rows}
+    return symbols, final_map
+
+def _tape_payload(symbols):
+    """Numeric payload only: {ticker: (price, change, company_name)}."""
+    rows = mirror.read_rows(symbols, get_connection)
+    return {row['ticker']: (float(row['current_price']), float(row['day_change']), row.get('company_name')) for row in rows}
+
+def _tape_items(symbols, final_map, payload):
+    items = []
+    for s in symbols:
+        # Check Nickname Map First, then Defaults, then Symbol
+        disp = final_map.get(s, s)
         
-        for s in symbols:
-            # Check Nickname Map First, then Defaults, then Symbol
-            disp = final_map.get(s, s)
+        if s in payload:
+            px, chg, comp = payload[s]
             
-            if s in data_map:
-                row = data_map[s]; px = float(row['current_price']); chg = float(row['day_change'])
-                
-                # If no custom nickname, try company name (shortened)
-                if s not in final_map and row.get('company_name'):
-                    disp = row['company_name'].split(",")[0][:15]
-                
-                col, arrow = ("#4caf50", "▲") if chg >= 0 else ("#ff4b4b", "▼")
-                items.append(f"<span style='color:#ccc; margin-left:20px;'>{disp}</span> <span style='color:{col}'>{arrow} {px:,.2f} ({chg:+.2f}%)</span>")
-            else:
-                # Fallback so it doesn't disappear while loading
-                items.append(f"<span style='color:#ccc; margin-left:20px;'>{disp}</span> <span style='color:#888; font-size:14px;'>(Loading...)</span>")
-    except: pass
+            # If no custom nickname, try company name (shortened)
+            if s not in final_map and comp:
+                disp = comp.split(",")[0][:15]
+            
+            col, arrow = ("#4caf50", "▲") if chg >= 0 else ("#ff4b4b", "▼")
+            items.append(f"<span style='color:#ccc; margin-left:20px;'>{disp}</span> <span style='color:{col}'>{arrow} {px:,.2f} ({chg:+.2f}%)</span>")
+        else:
+            # Fallback so it doesn't disappear while loading
+            items.append(f"<span style='color:#ccc; margin-left:20px;'>{disp}</span> <span style='color:#888; font-size:14px;'>(Loading...)</span>")
     return "    ".join(items)
 
+def get_tape_doc(symbol_string, nickname_string=""):
+    """Returns the shared, ready-to-embed tape document."""
+    store = _tape_store()
+    key = (symbol_string, nickname_string)
+    if store["key"] == key and time.time() - store["checked"] < TAPE_REFRESH_SECONDS:
+        return store["doc"]
+    # Another session is already refreshing: serve the current tape instead of waiting
+    if not store["lock"].acquire(blocking=not store["doc"]):
+        return store["doc"]
+    try:
+        symbols, final_map = _tape_layout(symbol_string, nickname_string)
+        payload = _tape_payload(symbols) if symbols else {}
+        version = (key, tuple(sorted(payload.items())))
+        if version != store["version"]:
+            store["doc"] = TAPE_DOC.format(c=_tape_items(symbols, final_map, payload)) if symbols else ""
+            store["version"] = version
+        store["key"] = key
+    except: pass
+    finally:
+        store["checked"] = time.time()
+        store["lock"].release()
+    return store["doc"]
+
+def render_timing_report():
+    boot = _process_boot()
+    boot["reruns"] += 1
+    phase = "COLD START" if boot["reruns"] == 1 else f"RERUN #{boot['reruns']}"
+    mark("script end")
+    report = " | ".join(f"{label}: {ms:,.0f}ms" for label, ms in _TIMINGS)
+    print(f"⏱️ [{phase}] {report}")
+    if os.environ.get("PP_STARTUP_TIMING") == "1" or st.query_params.get("timing") == "1":
+        st.caption(f"⏱️ {phase} — {report}")
+
 # --- UI LOGIC ---
-init_db()
-run_backend_update()
-ACTIVE_KEY, SHARED_FEEDS, _ = get_global_config_data()
+mark("imports")
 
 if "init" not in st.session_state:
     st.session_state["init"] = True
     st.session_state["logged_in"] = False
     url_token = st.query_params.get("token", None)
     if url_token:
-        user = validate_session(url_token)
+        with prof("validate_session"): user = validate_session(url_token)
         if user:
             st.session_state["username"] = user
             st.session_state["user_data"] = load_user_profile(user)
@@ -565,6 +676,7 @@ if not st.session_state["logged_in"]:
             user = st.text_input("Username", placeholder="e.g. Dave")
             pin = st.text_input("4-Digit PIN", type="password", max_chars=4, help="Create a PIN if you are new. Enter your PIN if you are returning.")
             if st.form_submit_button("🚀 Login / Start", type="primary"):
+                init_db()
                 exists, stored_pin = check_user_exists(user.strip())
                 if exists and stored_pin == pin:
                     st.success("Welcome back!")
@@ -583,15 +695,20 @@ if not st.session_state["logged_in"]:
                     st.session_state["global_data"] = load_global_config()
                     st.session_state["logged_in"] = True
                     st.rerun()
+    mark("login page")
 else:
+    with prof("init_db"): init_db()
+    mark("init_db")
+    with prof("run_backend_update"): run_backend_update()
+    mark("backend update")
     def push_user(): save_user_profile(st.session_state["username"], st.session_state["user_data"])
     def push_global(): save_global_config(st.session_state["global_data"])
-    GLOBAL = st.session_state["global_data"]
+    GLOBAL = load_global_config()
     USER = st.session_state["user_data"]
-    ACTIVE_KEY, SHARED_FEEDS, _ = get_global_config_data()
+    with prof("get_global_config_data"): ACTIVE_KEY, SHARED_FEEDS, _ = get_global_config_data()
 
-    tape_content = get_tape_data(GLOBAL.get("tape_input", "^DJI, ^IXIC, ^GSPTSE, GC=F"), GLOBAL.get("tape_nicknames", ""))
-    components.html(f"""<!DOCTYPE html><html><head><style>body{{margin:0;padding:0;background:transparent;overflow:hidden;font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,Helvetica,Arial,sans-serif}}.ticker-container{{width:100%;height:45px;background:#111;display:flex;align-items:center;border-bottom:1px solid #333;border-radius:0 0 15px 15px;box-shadow:0 4px 10px rgba(0,0,0,0.3)}}.ticker-wrap{{width:100%;overflow:hidden;white-space:nowrap}}.ticker-move{{display:inline-block;animation:ticker 15s linear infinite}}@keyframes ticker{{0%{{transform:translate3d(0,0,0)}}100%{{transform:translate3d(-25%,0,0)}}}}.ticker-item{{display:inline-block;color:white;font-weight:900;font-size:16px;padding:0 20px}}</style></head><body><div class="ticker-container"><div class="ticker-wrap"><div class="ticker-move"><span class="ticker-item">{tape_content}&nbsp;|&nbsp;{tape_content}&nbsp;|&nbsp;{tape_content}&nbsp;|&nbsp;{tape_content}</span></div></div></div></body></html>""", height=50)
+    with prof("tape"): tape_doc = get_tape_doc(GLOBAL.get("tape_input", "^DJI, ^IXIC, ^GSPTSE, GC=F"), GLOBAL.get("tape_nicknames", ""))
+    if tape_doc: components.html(tape_doc, height=50)
 
     with st.sidebar:
         st.markdown(f"<div style='background:#f0f2f6; padding:10px; border-radius:5px; margin-bottom:10px; text-align:center;'>👤 <b>{st.session_state['username']}</b></div>", unsafe_allow_html=True)
@@ -600,6 +717,9 @@ else:
         new_w = st.text_area("Edit Tickers", value=USER.get("w_input", ""), height=100)
         if new_w != USER.get("w_input"):
             USER["w_input"] = new_w; push_user(); st.info("Updated!"); time.sleep(1); st.rerun()
+        bad = get_bad_symbols()
+        flagged = [t for t in (x.strip().upper() for x in USER.get("w_input", "").split(",")) if t in bad]
+        if flagged: st.warning("No data from Yahoo for: " + ", ".join(f"{t} ({bad[t]})" for t in flagged))
 
         st.divider()
         with st.expander("🔔 Alert Settings"):
@@ -613,6 +733,16 @@ else:
             a_pre = st.checkbox("AI Daily Picks", value=USER.get("alert_pre", True))
             if (a_price != USER.get("alert_price", True) or a_trend != USER.get("alert_trend", True) or a_pre != USER.get("alert_pre", True)):
                 USER["alert_price"] = a_price; USER["alert_trend"] = a_trend; USER["alert_pre"] = a_pre; push_user(); st.rerun()
+            # Several alerts from one refresh always arrive as one digest (worker/digest.py)
+            curr_digest = digest_always(USER)
+            new_digest = st.checkbox("Digest format for single alerts too", value=curr_digest, help="Several alerts from one refresh always arrive as one digest message.")
+            if new_digest != curr_digest: USER["digest_always"] = new_digest; USER.pop("digest_min", None); push_user(); st.rerun()
+            curr_rules = "\n".join(format_rule(r) for r in USER.get("alert_rules", []))
+            new_rules = st.text_area("Custom Rules", value=curr_rules, height=80, help="One per line: TICKER|* FIELD OP VALUE [COOLDOWNh]\nFields: price, change, pp, rsi, volume, trend, rating\nOps: > >= < <= == abs>= crosses_above crosses_below changed\nExample: NKE price crosses_above 100 6h")
+            if new_rules != curr_rules:
+                parsed = [parse_rule_line(l) for l in new_rules.split("\n") if l.strip()]
+                if None in parsed: st.error("❌ Invalid rule line.")
+                else: USER["alert_rules"] = parsed; push_user(); st.success("Saved!"); time.sleep(1); st.rerun()
 
         # --- ADMIN SECTION (FIXED WITH NICKNAMES) ---
         with st.expander("🔐 Admin"):
@@ -621,21 +751,19 @@ else:
                 # --- SCANNER ---
                 st.markdown("### ⚡ AI Scanner")
                 if st.button("🔎 Scan Market"):
-                    with st.spinner("Hunting for setups..."):
-                        picks = run_gap_scanner(ACTIVE_KEY)
-                        if not picks: st.warning("No matches today.")
-                        else:
-                            try:
-                                conn = get_connection(); cursor = conn.cursor()
-                                today_str = datetime.now().strftime('%Y-%m-%d')
-                                # SURGICAL ADD: THE RESET
-                                cursor.execute("DELETE FROM daily_briefing WHERE date = %s", (today_str,))
-                                cursor.execute("INSERT INTO daily_briefing (date, picks, sent) VALUES (%s, %s, 0)", (today_str, json.dumps(picks)))
-                                conn.commit(); conn.close()
-                                for p in picks: st.markdown(f"**{p.get('ticker', p) if isinstance(p, dict) else p}**")
-                                st.info("Status reset to 0. Dispatching now...")
-                                st.divider()
-                            except: st.error("Database Error")
+                    if queue_scan(): st.success("Scan queued. The worker picks it up on its next run (≤5 min).")
+                    else: st.info("A scan was already queued this minute.")
+                runs = get_scan_runs()
+                if runs:
+                    st.caption(" | ".join(f"#{r['id']} {r['slot']}: {r['status']}" + (f" ({r['duration_ms'] / 1000:.0f}s)" if r['duration_ms'] else "") for r in runs[:3]))
+                brief = get_latest_briefing()
+                if brief:
+                    meta = json.loads(brief['scan_meta']) if brief.get('scan_meta') else {}
+                    picks = json.loads(brief['picks']) if brief.get('picks') else []
+                    st.markdown(f"**Picks:** {', '.join(p.get('ticker', p) if isinstance(p, dict) else p for p in picks) or '—'}")
+                    if meta: st.caption(f"Slot {meta.get('slot')} | scanned {meta.get('started_utc')} UTC in {meta.get('duration_ms', 0) / 1000:.1f}s | {meta.get('counts', {})}")
+                    if brief.get('candidates'):
+                        st.dataframe(json.loads(brief['candidates'])[:10], hide_index=True, use_container_width=True)
                 
                 # --- PORTFOLIO ---
                 st.divider()
@@ -704,32 +832,41 @@ else:
                 st.divider()
                 st.markdown("### 🛠️ Data Force")
                 if st.button("🔴 Generate Test Picks"):
-                    with st.spinner("Generating Picks & Resetting DB..."):
-                        test_picks = run_gap_scanner(ACTIVE_KEY)
-                        try:
-                            conn = get_connection(); cursor = conn.cursor()
-                            today_str = datetime.now().strftime('%Y-%m-%d')
-                            cursor.execute("DELETE FROM daily_briefing WHERE date = %s", (today_str,))
-                            cursor.execute("INSERT INTO daily_briefing (date, picks, sent) VALUES (%s, %s, 0)", (today_str, json.dumps(test_picks)))
-                            conn.commit(); conn.close()
-                            st.success(f"Generated! Picks: {[p.get('ticker', p) if isinstance(p,dict) else p for p in test_picks]}")
-                            st.info("👉 Now click 'Dispatch Telegram Alerts' above.")
-                        except Exception as e:
-                            st.error(f"Error: {e}")
+                    # Same job as Scan Market: it rewrites today's briefing with sent=0
+                    if queue_scan(): st.success("Scan queued. Today's picks are reset when it finishes.")
+                    else: st.info("A scan was already queued this minute.")
+                    st.info("👉 Then click 'Dispatch Telegram Alerts' above.")
+
+                # --- PROFILER ---
+                st.divider()
+                st.markdown("### ⏱️ Diagnostics")
+                prof_on = st.checkbox("Profile Reruns", value=st.session_state.get("profile_reruns", False), help="Shows a timing / DB breakdown under the dashboard on every rerun and fragment tick.")
+                if prof_on != st.session_state.get("profile_reruns", False): st.session_state["profile_reruns"] = prof_on; st.rerun()
 
         if st.button("Logout"): logout_session(st.query_params.get("token")); st.query_params.clear(); st.session_state["logged_in"] = False; st.rerun()
     
     @st.fragment(run_every=60)
     def render_dashboard():
-        t1, t2, t3, t4 = st.tabs(["📊 Live Market", "🚀 My Picks", "📰 My News", "🌎 Discovery"])
+        global PROF
+        # Fragment ticks rerun only this function: give each tick its own profile
+        if PROF and PROF.job == "done": PROF = RunMetrics("fragment tick")
+        import altair as alt
+        import pandas as pd
+        # Only the selected view runs on a tick (st.tabs executes every tab body)
+        VIEWS = ["📊 Live Market", "🚀 My Picks", "📰 My News", "🌎 Discovery"]
+        view = st.radio("View", VIEWS, horizontal=True, key="dash_view", label_visibility="collapsed")
         w_tickers = [x.strip().upper() for x in USER.get("w_input", "").split(",") if x.strip()]
         port = GLOBAL.get("portfolio", {}); p_tickers = list(port.keys())
-        batch_data = get_batch_data(list(set(w_tickers + p_tickers)))
+        batch_data = {}
+        with prof("get_dashboard_data"):
+            if view == VIEWS[0]: batch_data = get_dashboard_data("live", w_tickers)
+            elif view == VIEWS[1]: batch_data = get_dashboard_data("picks", p_tickers)
 
-        def draw_card(t, port_item=None):
-            d = batch_data.get(t)
-            if not d: st.markdown(f"<div style='padding:15px; border:1px dashed #ccc; border-radius:10px; color:#888; font-size:12px;'>⚠️ <b>{t}</b>: Processing...</div>", unsafe_allow_html=True); return
-            f = get_fundamentals(t)
+        # Rendered card parts, rebuilt only when a ticker's entry (or the PRE/POST label) changes
+        card_parts = st.session_state.setdefault("card_parts", {})
+
+        def build_card(t, d, lbl):
+            f = d["f"]
             b_col, arrow = ("#4caf50", "▲") if d["d"] >= 0 else ("#ff4b4b", "▼")
             r_up = f["rating"].upper()
             r_col = "#4caf50" if "BUY" in r_up or "OUT" in r_up else "#ff4b4b" if "SELL" in r_up or "UNDER" in r_up else "#f1c40f"
@@ -737,64 +874,84 @@ else:
             pills = f'<span class="info-pill" style="border-left: 3px solid {ai_col}">AI: {d["ai"]}</span><span class="info-pill" style="border-left: 3px solid {tr_col}">{d["trend"]}</span>'
             if f["rating"] != "N/A": pills += f'<span class="info-pill" style="border-left: 3px solid {r_col}">RATING: {f["rating"]}</span>'
             if f["earn"] != "N/A": pills += f'<span class="info-pill" style="border-left: 3px solid #333">EARN: {f["earn"]}</span>'
-            with st.container():
-                st.markdown(f"<div style='height:4px; width:100%; background-color:{b_col}; border-radius: 4px 4px 0 0;'></div><div style='display:flex; justify-content:space-between; align-items:flex-start; margin-bottom:15px;'><div><div style='font-size:22px; font-weight:bold; margin-right:8px; color:#2c3e50;'>{t}</div><div style='font-size:12px; color:#888; margin-top:-2px;'>{d['name'][:25]}...</div></div><div style='text-align:right;'><div style='font-size:22px; font-weight:bold; color:#2c3e50;'>${d['p']:,.2f}</div><div style='font-size:13px; font-weight:bold; color:{b_col}; margin-top:-4px;'>{arrow} {d['d']:.2f}%</div>{d['pp']}</div></div><div style='margin-bottom:10px; display:flex; flex-wrap:wrap; gap:4px;'>{pills}</div>", unsafe_allow_html=True)
-                st.altair_chart(alt.Chart(d["chart"]).mark_area(line={"color": b_col}, color=alt.Gradient(gradient="linear", stops=[alt.GradientStop(color=b_col, offset=0), alt.GradientStop(color="white", offset=1)], x1=1, x2=1, y1=1, y2=0)).encode(x=alt.X("Idx", axis=None), y=alt.Y("Stock", axis=None), tooltip=[]).configure_view(strokeWidth=0).properties(height=45), use_container_width=True)
-                rsi_bg = "#ff4b4b" if d["rsi"] > 70 else "#4caf50" if d["rsi"] < 30 else "#999"
-                st.markdown(f"<div class='metric-label'><span>Day Range</span><span style='color:#555'>${d['l']:,.2f} - ${d['h']:,.2f}</span></div><div class='bar-bg'><div class='bar-fill' style='width:{d['range_pos']}%; background: linear-gradient(90deg, #ff4b4b, #f1c40f, #4caf50);'></div></div><div class='metric-label'><span>RSI ({int(d['rsi'])})</span><span class='tag' style='background:{rsi_bg}'>{'HOT' if d['rsi']>70 else 'COLD' if d['rsi']<30 else 'NEUTRAL'}</span></div><div class='bar-bg'><div class='bar-fill' style='width:{d['rsi']}%; background:{rsi_bg};'></div></div>", unsafe_allow_html=True)
-                
-                st.markdown(f"""
+            pp_html = ""
+            if d["pp_p"]:
+                col = "#4caf50" if d["pp_c"] >= 0 else "#ff4b4b"
+                pp_html = f"<div style='font-size:11px; color:#888; margin-top:2px;'>{lbl}: <span style='color:{col}; font-weight:bold;'>${d['pp_p']:,.2f} ({d['pp_c']:+.2f}%)</span></div>"
+            head = f"<div style='height:4px; width:100%; background-color:{b_col}; border-radius: 4px 4px 0 0;'></div><div style='display:flex; justify-content:space-between; align-items:flex-start; margin-bottom:15px;'><div><div style='font-size:22px; font-weight:bold; margin-right:8px; color:#2c3e50;'>{t}</div><div style='font-size:12px; color:#888; margin-top:-2px;'>{d['name'][:25]}...</div></div><div style='text-align:right;'><div style='font-size:22px; font-weight:bold; color:#2c3e50;'>${d['p']:,.2f}</div><div style='font-size:13px; font-weight:bold; color:{b_col}; margin-top:-4px;'>{arrow} {d['d']:.2f}%</div>{pp_html}</div></div><div style='margin-bottom:10px; display:flex; flex-wrap:wrap; gap:4px;'>{pills}</div>"
+            chart = alt.Chart(d["chart"]).mark_area(line={"color": b_col}, color=alt.Gradient(gradient="linear", stops=[alt.GradientStop(color=b_col, offset=0), alt.GradientStop(color="white", offset=1)], x1=1, x2=1, y1=1, y2=0)).encode(x=alt.X("Idx", axis=None), y=alt.Y("Stock", axis=None), tooltip=[]).configure_view(strokeWidth=0).properties(height=45)
+            rsi_bg = "#ff4b4b" if d["rsi"] > 70 else "#4caf50" if d["rsi"] < 30 else "#999"
+            bars = f"<div class='metric-label'><span>Day Range</span><span style='color:#555'>${d['l']:,.2f} - ${d['h']:,.2f}</span></div><div class='bar-bg'><div class='bar-fill' style='width:{d['range_pos']}%; background: linear-gradient(90deg, #ff4b4b, #f1c40f, #4caf50);'></div></div><div class='metric-label'><span>RSI ({int(d['rsi'])})</span><span class='tag' style='background:{rsi_bg}'>{'HOT' if d['rsi']>70 else 'COLD' if d['rsi']<30 else 'NEUTRAL'}</span></div><div class='bar-bg'><div class='bar-fill' style='width:{d['rsi']}%; background:{rsi_bg};'></div></div>"
+            vol = f"""
                     <div class='metric-label'><span>Volume Status</span><span class='tag' style='background:#00d4ff'>{d['vol_label']}</span></div>
                     <div class='bar-bg'>
                         <div class='bar-fill' style='width:{d['vol_pct']}%; background:#00d4ff;'></div>
                     </div>
-                """, unsafe_allow_html=True)
+                """
+            return (d, lbl, head, chart, bars, vol)
+
+        def draw_card(t, port_item=None):
+            d = batch_data.get(t)
+            if not d:
+                status = get_bad_symbols().get(t, "Processing...")
+                st.markdown(f"<div style='padding:15px; border:1px dashed #ccc; border-radius:10px; color:#888; font-size:12px;'>⚠️ <b>{t}</b>: {status}</div>", unsafe_allow_html=True); return
+            lbl = _market_label()
+            parts = card_parts.get(t)
+            if not parts or parts[0] is not d or parts[1] != lbl:
+                with prof("build_card"): parts = card_parts[t] = build_card(t, d, lbl)
+            _, _, head, chart, bars, vol = parts
+            with st.container():
+                st.markdown(head, unsafe_allow_html=True)
+                with prof("draw_card: altair"): st.altair_chart(chart, use_container_width=True)
+                st.markdown(bars, unsafe_allow_html=True)
+                st.markdown(vol, unsafe_allow_html=True)
 
                 if port_item:
                     gain = (d["p"] - port_item["e"]) * port_item["q"]
                     st.markdown(f"<div style='background:#f9f9f9; padding:5px; margin-top:10px; border-radius:5px; display:flex; justify-content:space-between; font-size:12px;'><span>Qty: <b>{port_item['q']}</b></span><span>Avg: <b>${port_item['e']}</b></span><span style='color:{'#4caf50' if gain>=0 else '#ff4b4b'}; font-weight:bold;'>${gain:+,.0f}</span></div>", unsafe_allow_html=True)
                 st.divider()
 
-        with t1:
-            try:
-                conn = get_connection(); cursor = conn.cursor(dictionary=True)
-                # FIX: ORDER BY DESC LIMIT 1 ensures we get the latest picks regardless of timezone rollover
-                cursor.execute("SELECT picks, created_at FROM daily_briefing ORDER BY date DESC LIMIT 1")
-                row = cursor.fetchone(); conn.close()
-                if row:
-                    picks_list = json.loads(row['picks'])
-                    display_tickers = [p.get('ticker', p) if isinstance(p, dict) else p for p in picks_list]
-                    ts_dt = row['created_at']
-                    ts_str = ts_dt.strftime('%I:%M %p')
-                    total_minutes = (ts_dt.hour * 60) + ts_dt.minute
-                    if total_minutes < 600: label = "PRE-MARKET PICKS"
-                    elif total_minutes < 960: label = "DAILY PICKS"
-                    else: label = "POST-MARKET PICKS"
-                    st.success(f"📌 **{label}:** {', '.join(display_tickers)} | _Updated at {ts_str}_")
-            except: pass
+        if view == VIEWS[0]:
+            with prof("tab: live market"):
+                try:
+                    with prof("get_latest_briefing"): row = get_latest_briefing()
+                    if row:
+                        picks_list = json.loads(row['picks'])
+                        display_tickers = [p.get('ticker', p) if isinstance(p, dict) else p for p in picks_list]
+                        ts_dt = row['created_at']
+                        ts_str = ts_dt.strftime('%I:%M %p')
+                        total_minutes = (ts_dt.hour * 60) + ts_dt.minute
+                        if total_minutes < 600: label = "PRE-MARKET PICKS"
+                        elif total_minutes < 960: label = "DAILY PICKS"
+                        else: label = "POST-MARKET PICKS"
+                        st.success(f"📌 **{label}:** {', '.join(display_tickers)} | _Updated at {ts_str}_")
+                except: pass
+                with prof("get_earnings_week"): week = get_earnings_week(tuple(sorted(set(w_tickers + p_tickers))))
+                if week:
+                    st.info("📅 **EARNINGS THIS WEEK:** " + " | ".join(f"{e['ticker']} {e['report_date'].strftime('%a %b %d')}" + (f" ({e['hour'].upper()})" if e.get('hour') else "") for e in week))
             
-            cols = st.columns(3)
-            for i, t in enumerate(w_tickers):
-                with cols[i % 3]: draw_card(t)
-
-        with t2:
-            port = GLOBAL.get("portfolio", {})
-            if not port: st.info("No Picks Published.")
-            else:
-                total_val, total_cost, day_pl_sum = 0.0, 0.0, 0.0
-                for k, v in port.items():
-                    d = batch_data.get(k)
-                    if d:
-                        total_val += d["p"] * v["q"]; total_cost += v["e"] * v["q"]
-                        if d["d"] != 0: day_pl_sum += (d["p"] - (d["p"] / (1 + (d["d"] / 100)))) * v["q"]
-                day_col = "#4caf50" if day_pl_sum >= 0 else "#ff4b4b"
-                tot_col = "#4caf50" if (total_val - total_cost) >= 0 else "#ff4b4b"
-                day_pct = (day_pl_sum / (total_val - day_pl_sum) * 100) if (total_val - day_pl_sum) > 0 else 0
-                tot_pct = ((total_val - total_cost) / total_cost * 100) if total_cost > 0 else 0
-                st.markdown(f"<div style='background-color:white; border-radius:12px; padding:15px; box-shadow:0 4px 10px rgba(0,0,0,0.05); border:1px solid #f0f0f0; margin-bottom:20px;'><div style='display:flex; justify-content:space-between; margin-bottom:10px;'><div><div style='font-size:11px; color:#888; font-weight:bold;'>NET ASSETS</div><div style='font-size:24px; font-weight:900; color:#333;'>${total_val:,.2f}</div></div><div style='text-align:right;'><div style='font-size:11px; color:#888; font-weight:bold;'>INVESTED</div><div style='font-size:24px; font-weight:900; color:#555;'>${total_cost:,.2f}</div></div></div><div style='height:1px; background:#eee; margin:10px 0;'></div><div style='display:flex; justify-content:space-between;'><div><div style='font-size:11px; color:#888; font-weight:bold;'>DAY P/L</div><div style='font-size:16px; font-weight:bold; color:{day_col};'>${day_pl_sum:+,.2f} ({day_pct:+.2f}%)</div></div><div style='text-align:right;'><div style='font-size:11px; color:#888; font-weight:bold;'>TOTAL P/L</div><div style='font-size:16px; font-weight:bold; color:{tot_col};'>${total_val - total_cost:+,.2f} ({tot_pct:+.2f}%)</div></div></div></div>", unsafe_allow_html=True)
                 cols = st.columns(3)
-                for i, (k, v) in enumerate(port.items()):
-                    with cols[i % 3]: draw_card(k, v)
+                for i, t in enumerate(w_tickers):
+                    with cols[i % 3]: draw_card(t)
+
+        if view == VIEWS[1]:
+            with prof("tab: my picks"):
+                port = GLOBAL.get("portfolio", {})
+                if not port: st.info("No Picks Published.")
+                else:
+                    with prof("value_portfolio"): pv = value_portfolio(port, batch_data)
+                    total_val, total_cost, day_pl_sum = pv["value"], pv["cost"], pv["day_pl"]
+                    day_pct, tot_pct = pv["day_pct"], pv["total_pct"]
+                    day_col = "#4caf50" if day_pl_sum >= 0 else "#ff4b4b"
+                    tot_col = "#4caf50" if (total_val - total_cost) >= 0 else "#ff4b4b"
+                    st.markdown(f"<div style='background-color:white; border-radius:12px; padding:15px; box-shadow:0 4px 10px rgba(0,0,0,0.05); border:1px solid #f0f0f0; margin-bottom:20px;'><div style='display:flex; justify-content:space-between; margin-bottom:10px;'><div><div style='font-size:11px; color:#888; font-weight:bold;'>NET ASSETS</div><div style='font-size:24px; font-weight:900; color:#333;'>${total_val:,.2f}</div></div><div style='text-align:right;'><div style='font-size:11px; color:#888; font-weight:bold;'>INVESTED</div><div style='font-size:24px; font-weight:900; color:#555;'>${total_cost:,.2f}</div></div></div><div style='height:1px; background:#eee; margin:10px 0;'></div><div style='display:flex; justify-content:space-between;'><div><div style='font-size:11px; color:#888; font-weight:bold;'>DAY P/L</div><div style='font-size:16px; font-weight:bold; color:{day_col};'>${day_pl_sum:+,.2f} ({day_pct:+.2f}%)</div></div><div style='text-align:right;'><div style='font-size:11px; color:#888; font-weight:bold;'>TOTAL P/L</div><div style='font-size:16px; font-weight:bold; color:{tot_col};'>${total_val - total_cost:+,.2f} ({tot_pct:+.2f}%)</div></div></div></div>", unsafe_allow_html=True)
+                    if len(pv["curve"]) > 1:
+                        curve_col = "#4caf50" if pv["curve"][-1] >= pv["curve"][0] else "#ff4b4b"
+                        curve_df = pd.DataFrame({"Day": range(len(pv["curve"])), "Value": pv["curve"]})
+                        st.altair_chart(alt.Chart(curve_df).mark_line(color=curve_col).encode(x=alt.X("Day", axis=None), y=alt.Y("Value", scale=alt.Scale(zero=False), axis=alt.Axis(format="$,.0f", title=None)), tooltip=[alt.Tooltip("Value", format="$,.2f")]).configure_view(strokeWidth=0).properties(height=120, title="Equity Curve (last 20 sessions)"), use_container_width=True)
+                    cols = st.columns(3)
+                    for i, (k, v) in enumerate(port.items()):
+                        with cols[i % 3]: draw_card(k, v)
 
         def render_news(n):
             s_val = n["sentiment"].upper()
@@ -804,24 +961,31 @@ else:
             disp = n["ticker"] if n["ticker"] else "MARKET"
             st.markdown(f"<div class='news-card' style='border-left-color: {col};'><div style='display:flex; align-items:center;'><span class='ticker-badge' style='background-color:{col}'>{disp}</span><a href='{n['link']}' target='_blank' class='news-title'>{n['title']}</a></div><div class='news-meta'>{n['published']} | Sentiment: <b>{n['sentiment']}</b></div></div>", unsafe_allow_html=True)
 
-        with t3:
-            c_head, c_btn = st.columns([4, 1]); c_head.subheader("Portfolio News")
-            if c_btn.button("🔄 Refresh", key=f"btn_n1_{int(time.time()/60)}"):
-                with st.spinner("Analyzing..."): fetch_news.clear(); fetch_news([], list(set(w_tickers + p_tickers)), ACTIVE_KEY); st.rerun()
-            if NEWS_LIB_READY:
-                news_items = fetch_news([], list(set(w_tickers + p_tickers)), ACTIVE_KEY)
-                if not news_items: st.info("No news.")
-                else:
-                    for n in news_items: render_news(n)
+        if view == VIEWS[2]:
+            with prof("tab: my news"):
+                c_head, c_btn = st.columns([4, 1]); c_head.subheader("Portfolio News")
+                if c_btn.button("🔄 Refresh", key=f"btn_n1_{int(time.time()/60)}"):
+                    with st.spinner("Analyzing..."): fetch_news.clear(); fetch_news([], list(set(w_tickers + p_tickers)), ACTIVE_KEY); st.rerun()
+                if NEWS_LIB_READY:
+                    with prof("fetch_news"): news_items = fetch_news([], list(set(w_tickers + p_tickers)), ACTIVE_KEY)
+                    if not news_items: st.info("No news.")
+                    else:
+                        for n in news_items: render_news(n)
         
-        with t4:
-            c_head, c_btn = st.columns([4, 1]); c_head.subheader("Market Discovery")
-            if c_btn.button("🔄 Refresh", key=f"btn_n2_{int(time.time()/60)}"):
-                with st.spinner("Analyzing..."): fetch_news.clear(); fetch_news(GLOBAL.get("rss_feeds", ["https://finance.yahoo.com/news/rssindex"]), [], ACTIVE_KEY); st.rerun()
-            if NEWS_LIB_READY:
-                news_items = fetch_news(GLOBAL.get("rss_feeds", ["https://finance.yahoo.com/news/rssindex"]), [], ACTIVE_KEY)
-                if not news_items: st.info("No news.")
-                else:
-                    for n in news_items: render_news(n)
+        if view == VIEWS[3]:
+            with prof("tab: discovery"):
+                c_head, c_btn = st.columns([4, 1]); c_head.subheader("Market Discovery")
+                if c_btn.button("🔄 Refresh", key=f"btn_n2_{int(time.time()/60)}"):
+                    with st.spinner("Analyzing..."): fetch_news.clear(); fetch_news(GLOBAL.get("rss_feeds", ["https://finance.yahoo.com/news/rssindex"]), [], ACTIVE_KEY); st.rerun()
+                if NEWS_LIB_READY:
+                    with prof("fetch_news"): news_items = fetch_news(GLOBAL.get("rss_feeds", ["https://finance.yahoo.com/news/rssindex"]), [], ACTIVE_KEY)
+                    if not news_items: st.info("No news.")
+                    else:
+                        for n in news_items: render_news(n)
+
+        render_profile_panel()
 
     render_dashboard()
+    mark("dashboard")
+
+render_timing_report()
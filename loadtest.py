@@ -0,0 +1,430 @@
+"""
+Concurrent-session load test for the Streamlit dashboard.
+
+    python loadtest.py --sessions 50 --ticks 5
+    python loadtest.py --sessions 50 --ticks 5 --concurrency 50   # all sessions at once
+
+Drives N simulated sessions of app.py through login, a watchlist edit, dashboard
+ticks and a view switch with Streamlit's app-testing API (AppTest). MySQL and
+yfinance are replaced by in-process stand-ins (FakeDB / fake_yfinance below), so the
+run needs no network and measures only the app's own behaviour:
+
+  - rerun latency percentiles per action
+  - DB queries and connections opened per rerun (and connections never closed)
+  - peak DB connections open at once, and peak sessions rerunning at once
+  - memory per session (tracemalloc): what each session frees when it is torn down
+
+Sessions share one process, like a single Streamlit server, so process-wide caches
+(st.cache_resource, the stock_cache mirror, the tape) are shared exactly as in
+production. By default reruns are driven round-robin, one at a time, so counters can
+be attributed to a single rerun. With --concurrency N each phase runs on N threads,
+so up to N sessions rerun at the same moment (the load that exhausts connections);
+per-rerun query/connection counts are then phase averages. AppTest cannot fire a
+fragment on its own, so a "tick" is a full script rerun (an upper bound for the 60s
+fragment).
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+UNIVERSE = ["TD.TO", "SPY", "NKE", "AAPL", "MSFT", "AMD", "TSLA", "SHOP.TO", "BB.TO", "PLTR", "SOFI", "GME", "^DJI", "^IXIC", "^GSPTSE", "GC=F", "BTC-USD", "CADUSD=X"]
+
+# --- LOCAL DATABASE STAND-IN ---
+# A tiny dict-backed interpreter for the statements app.py issues. Anything it does
+# not understand is counted under "unhandled" (and DDL is accepted as a no-op).
+TABLE_KEYS = {"user_profiles": "username", "user_sessions": "token", "stock_cache": "ticker", "daily_briefing": "date", "alert_log": "id", "symbol_blocklist": "ticker"}
+DEFAULTED = ("created_at", "last_updated", "checked_at")
+ON_UPDATE_NOW = {"stock_cache": "last_updated"}  # ... ON UPDATE CURRENT_TIMESTAMP
+
+_SELECT = re.compile(r"^SELECT (.+?) FROM (\w+)(?: WHERE (.+?))?(?: ORDER BY (\w+)(?: (DESC|ASC))?)?(?: LIMIT (\d+))?(?: FOR UPDATE)?$", re.I)
+_INSERT = re.compile(r"^INSERT (IGNORE )?INTO (\w+) ?\((.+?)\) VALUES ?\((.+?)\)(?: ON DUPLICATE KEY UPDATE (.+))?$", re.I)
+_UPDATE = re.compile(r"^UPDATE (\w+) SET (.+?)(?: WHERE (.+))?$", re.I)
+_DELETE = re.compile(r"^DELETE FROM (\w+)(?: WHERE (.+))?$", re.I)
+_COND_IN = re.compile(r"^(\w+) IN \((.*)\)$", re.I)
+_COND_CMP = re.compile(r"^(\w+) ?(>=|<=|!=|=|>|<) ?(.+)$")
+
+
+class FakeDB:
+    def __init__(self):
+        self.tables = defaultdict(dict)
+        self.lock = threading.RLock()
+        self.stats = defaultdict(int)  # connections, open, queries, unhandled
+        self.unhandled = defaultdict(int)
+
+    # --- value helpers ---
+    @staticmethod
+    def _value(expr, params, row=None, new=None):
+        expr = expr.strip()
+        if expr.startswith("?"): return params[int(expr[1:])]
+        if expr.upper() in ("NOW()", "CURRENT_TIMESTAMP"): return datetime.now()
+        if expr.upper() == "NULL": return None
+        if expr.startswith("'") and expr.endswith("'"): return expr[1:-1]
+        m = re.match(r"^VALUES\((\w+)\)$", expr, re.I)
+        if m: return (new or {}).get(m.group(1))
+        try: return float(expr) if "." in expr else int(expr)
+        except ValueError: return (row or {}).get(expr)
+
+    @staticmethod
+    def _cmp(a, op, b):
+        if isinstance(a, datetime) and isinstance(b, str): b = datetime.fromisoformat(b)
+        if isinstance(b, datetime) and isinstance(a, str): a = datetime.fromisoformat(a)
+        if a is None or b is None: return op == "!=" and a is not b
+        try:
+            return {"=": a == b, "!=": a != b, ">=": a >= b, "<=": a <= b, ">": a > b, "<": a < b}[op]
+        except TypeError:
+            return False
+
+    def _where(self, clause, params):
+        if not clause: return lambda row: True
+        tests = []
+        for cond in re.split(r" AND ", clause, flags=re.I):
+            m = _COND_IN.match(cond.strip())
+            if m:
+                col, vals = m.group(1), {self._value(v, params) for v in m.group(2).split(",")}
+                tests.append(lambda row, c=col, v=vals: row.get(c) in v)
+                continue
+            m = _COND_CMP.match(cond.strip())
+            if not m: raise ValueError(cond)
+            col, op, rhs = m.groups()
+            val = self._value(rhs, params)
+            tests.append(lambda row, c=col, o=op, v=val: self._cmp(row.get(c), o, v))
+        return lambda row: all(t(row) for t in tests)
+
+    @staticmethod
+    def _assignments(text):
+        return [(a.split("=", 1)[0].strip(), a.split("=", 1)[1].strip()) for a in re.split(r",(?![^()]*\))", text)]
+
+    # --- statements ---
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        params = list(params or ())
+        counter = iter(range(len(params)))
+        sql = re.sub(r"%s", lambda _: f"?{next(counter)}", sql)
+        with self.lock:
+            self.stats["queries"] += 1
+            head = sql.split(" ", 1)[0].upper()
+            try:
+                if head == "SELECT": return self._select(sql, params)
+                if head == "INSERT": return self._insert(sql, params)
+                if head == "UPDATE": return self._update(sql, params)
+                if head == "DELETE": return self._delete(sql, params)
+            except ValueError:
+                pass
+            if head in ("CREATE", "ALTER", "SET", "SHOW", "DROP"): return [], []
+            self.stats["unhandled"] += 1
+            self.unhandled[sql[:80]] += 1
+            return [], []
+
+    def _select(self, sql, params):
+        m = _SELECT.match(sql)
+        if not m:
+            if "GET_LOCK" in sql.upper() or "RELEASE_LOCK" in sql.upper(): return ["lock"], [(1,)]
+            if "INFORMATION_SCHEMA" in sql.upper(): return ["1"], []  # migrations: every column/index looks missing
+            if "UTC_TIMESTAMP()" in sql.upper(): return ["tz_offset"], [(round(datetime.now().astimezone().utcoffset().total_seconds()),)]  # NOW() is local time
+            raise ValueError(sql)
+        cols, table, where, order, direction, limit = m.groups()
+        rows = [r for r in self.tables[table].values() if self._where(where, params)(r)]
+        if order: rows.sort(key=lambda r: (r.get(order) is None, r.get(order)), reverse=(direction or "").upper() == "DESC")
+        if limit: rows = rows[:int(limit)]
+        names = sorted({k for r in self.tables[table].values() for k in r}) if cols.strip() == "*" else [c.strip() for c in cols.split(",")]
+        return names, [tuple(r.get(c) for c in names) for r in rows]
+
+    def _insert(self, sql, params):
+        m = _INSERT.match(sql)
+        if not m: raise ValueError(sql)
+        ignore, table, cols, vals, dup = m.groups()
+        key = TABLE_KEYS.get(table, "id")
+        new = {c.strip(): self._value(v, params) for c, v in zip(cols.split(","), re.split(r",(?![^()]*\))", vals))}
+        if key == "id" and "id" not in new: new["id"] = len(self.tables[table]) + 1
+        old = self.tables[table].get(new.get(key))
+        if old is not None:
+            if dup:
+                before, stamp = dict(old), ON_UPDATE_NOW.get(table)
+                for col, expr in self._assignments(dup): old[col] = self._value(expr, params, before, new)
+                if stamp and old != before and old.get(stamp) == before.get(stamp): old[stamp] = datetime.now()
+            return [], []
+        for c in DEFAULTED: new.setdefault(c, datetime.now())
+        self.tables[table][new.get(key)] = new
+        return [], []
+
+    def _update(self, sql, params):
+        m = _UPDATE.match(sql)
+        if not m: raise ValueError(sql)
+        table, sets, where = m.groups()
+        match = self._where(where, params)
+        stamp = ON_UPDATE_NOW.get(table)
+        for row in self.tables[table].values():
+            if match(row):
+                before = dict(row)
+                for col, expr in self._assignments(sets): row[col] = self._value(expr, params, before)
+                if stamp and row != before and row.get(stamp) == before.get(stamp): row[stamp] = datetime.now()
+        return [], []
+
+    def _delete(self, sql, params):
+        m = _DELETE.match(sql)
+        if not m: raise ValueError(sql)
+        table, where = m.groups()
+        match = self._where(where, params)
+        for k in [k for k, r in self.tables[table].items() if match(r)]: del self.tables[table][k]
+        return [], []
+
+
+class FakeCursor:
+    def __init__(self, db, dictionary=False):
+        self.db, self.dictionary = db, dictionary
+        self._rows, self.rowcount = [], 0
+
+    def execute(self, sql, params=()):
+        names, rows = self.db.execute(sql, params)
+        self._rows = [dict(zip(names, r)) for r in rows] if self.dictionary else list(rows)
+        self.rowcount = len(self._rows)
+
+    def executemany(self, sql, seq):
+        for params in seq: self.execute(sql, params)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self): pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.open = True
+        with db.lock:
+            db.stats["connections"] += 1; db.stats["open"] += 1
+            db.stats["peak_open"] = max(db.stats["peak_open"], db.stats["open"])
+
+    def cursor(self, dictionary=False, buffered=False, **_):
+        return FakeCursor(self.db, dictionary)
+
+    def commit(self): pass
+    def rollback(self): pass
+    def is_connected(self): return self.open
+    def reconnect(self, *a, **k): pass
+
+    def close(self):
+        if self.open:
+            self.open = False
+            with self.db.lock: self.db.stats["open"] -= 1
+
+
+def fake_mysql(db):
+    connector = types.ModuleType("mysql.connector")
+    connector.connect = lambda **_: FakeConnection(db)
+    connector.Error = Exception
+    mysql = types.ModuleType("mysql")
+    mysql.connector = connector
+    return mysql, connector
+
+
+# --- FAKE MARKET-DATA SOURCE ---
+def fake_yfinance(latency=0.0, move_rate=0.3, seed=7):
+    """yfinance look-alike: random-walk frames in yf.download's group_by='ticker' shape."""
+    import numpy as np
+    import pandas as pd
+    rng = random.Random(seed)
+    base = {}
+    yf = types.ModuleType("yfinance")
+
+    def frame(t, rows, step):
+        p = base.setdefault(t, rng.uniform(5, 300))
+        if rng.random() < move_rate: base[t] = p = p * (1 + rng.gauss(0, 0.01))
+        r = np.random.default_rng(rng.randrange(2 ** 32))
+        walk = np.cumprod(1 + r.normal(0, 0.002, rows))
+        close = p * walk / walk[-1]
+        idx = pd.date_range(end=pd.Timestamp.now().floor(step), periods=rows, freq=step)
+        return pd.DataFrame({"Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close, "Volume": r.integers(100_000, 1_000_000, rows)}, index=idx)
+
+    def download(tickers, period="5d", interval="1d", group_by="ticker", **_):
+        time.sleep(latency)
+        names = tickers.split() if isinstance(tickers, str) else list(tickers)
+        rows, step = (60, "min") if interval == "1m" else (22, "D")
+        frames = {t: frame(t, rows, step) for t in names if not t.startswith("BAD")}
+        if not frames: return pd.DataFrame()
+        if len(names) == 1: return next(iter(frames.values()))
+        return pd.concat(frames, axis=1)
+
+    class Ticker:
+        def __init__(self, t):
+            self.ticker = t
+            self.info = {"recommendationKey": rng.choice(["buy", "hold", "strong_buy"]), "shortName": f"{t} Corp"}
+            self.calendar = {"Earnings Date": [(datetime.now() + timedelta(days=rng.randint(1, 60))).date()]}
+
+        def history(self, period="1mo", interval="1d", **_):
+            return download(self.ticker, period=period, interval=interval)
+
+    yf.download, yf.Ticker = download, Ticker
+    return yf
+
+
+def seed(db):
+    portfolio = {t: {"e": 10.0, "q": 100} for t in ["NKE", "AMD", "SOFI"]}
+    g = {"portfolio": portfolio, "openai_key": "", "rss_feeds": [], "tape_input": "^DJI, ^IXIC, ^GSPTSE, GC=F, BTC-USD"}
+    db.tables["user_profiles"]["GLOBAL_CONFIG"] = {"username": "GLOBAL_CONFIG", "user_data": json.dumps(g), "pin": None}
+    today = datetime.now().strftime("%Y-%m-%d")
+    db.tables["daily_briefing"][today] = {"date": today, "picks": json.dumps(["AMD", "PLTR"]), "sent": 1, "created_at": datetime.now()}
+
+
+# --- DRIVER ---
+def percentile(xs, p):
+    if not xs: return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+class Recorder:
+    def __init__(self, db, concurrency=1):
+        self.db = db
+        self.concurrency = concurrency
+        self.samples = defaultdict(list)  # action -> [(ms, queries, connections, exceptions)]
+        self.active = self.peak_active = 0
+        self._lock = threading.Lock()
+
+    def run(self, action, at_call):
+        q0, c0 = self.db.stats["queries"], self.db.stats["connections"]
+        t = time.perf_counter()
+        at = at_call()
+        ms = (time.perf_counter() - t) * 1000
+        self.samples[action].append((ms, self.db.stats["queries"] - q0, self.db.stats["connections"] - c0, len(at.exception)))
+        return at
+
+    def phase(self, action, calls):
+        """Runs one rerun per call: one at a time, or on `concurrency` threads. Returns the AppTests."""
+        if self.concurrency <= 1: return [self.run(action, c) for c in calls]
+
+        def timed(call):
+            with self._lock:
+                self.active += 1; self.peak_active = max(self.peak_active, self.active)
+            t = time.perf_counter()
+            try: at = call()
+            finally:
+                with self._lock: self.active -= 1
+            return (time.perf_counter() - t) * 1000, at
+
+        q0, c0 = self.db.stats["queries"], self.db.stats["connections"]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as ex:
+            done = list(ex.map(timed, calls))
+        # Reruns overlap, so DB counters can only be averaged over the phase
+        dq = (self.db.stats["queries"] - q0) / max(1, len(done))
+        dc = (self.db.stats["connections"] - c0) / max(1, len(done))
+        for ms, at in done: self.samples[action].append((ms, dq, dc, len(at.exception)))
+        return [at for _, at in done]
+
+    def report(self):
+        out = {}
+        for action, rows in self.samples.items():
+            ms = [r[0] for r in rows]
+            out[action] = {
+                "reruns": len(rows),
+                "p50_ms": round(percentile(ms, 50), 1), "p90_ms": round(percentile(ms, 90), 1), "p99_ms": round(percentile(ms, 99), 1),
+                "queries_per_rerun": round(sum(r[1] for r in rows) / len(rows), 1),
+                "connections_per_rerun": round(sum(r[2] for r in rows) / len(rows), 1),
+                "exceptions": sum(r[3] for r in rows),
+            }
+        return out
+
+
+def widget(items, label):
+    return next(w for w in items if w.label == label)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--sessions", type=int, default=50)
+    ap.add_argument("--ticks", type=int, default=5, help="dashboard reruns per session")
+    ap.add_argument("--market-latency", type=float, default=0.2, help="seconds per fake yf.download call")
+    ap.add_argument("--move-rate", type=float, default=0.3, help="chance a symbol's price moves between downloads")
+    ap.add_argument("--concurrency", type=int, default=1, help="sessions rerunning at the same time (1 = round-robin)")
+    ap.add_argument("--app", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"))
+    ap.add_argument("--json", help="also write the report here")
+    args = ap.parse_args()
+
+    # Keep the app's local side effects out of the working tree
+    work = tempfile.mkdtemp(prefix="pp-loadtest-")
+    os.environ["MIRROR_PATH"] = os.path.join(work, "mirror.db")
+    os.environ["WORKER_METRICS_FILE"] = os.path.join(work, "metrics.jsonl")
+    sys.path.insert(0, os.path.dirname(args.app))
+
+    db = FakeDB(); seed(db)
+    sys.modules["mysql"], sys.modules["mysql.connector"] = fake_mysql(db)
+    sys.modules["yfinance"] = fake_yfinance(args.market_latency, args.move_rate)
+    from streamlit.testing.v1 import AppTest
+
+    rec = Recorder(db, args.concurrency)
+    rng = random.Random(1)
+    tracemalloc.start()
+
+    def new_session():
+        at = AppTest.from_file(args.app, default_timeout=120)
+        at.secrets["ADMIN_PASSWORD"] = "loadtest-admin"
+        return at.run()
+
+    def login(at, i):
+        widget(at.text_input, "Username").set_value(f"load{i}")
+        widget(at.text_input, "4-Digit PIN").set_value("1234")
+        return widget(at.button, "🚀 Login / Start").click().run()
+
+    mode = "round-robin" if args.concurrency <= 1 else f"{args.concurrency} at a time"
+    print(f"▶ {args.sessions} sessions x {args.ticks} ticks ({mode}) against {args.app}")
+    sessions = rec.phase("login page", [new_session] * args.sessions)
+    sessions = rec.phase("login", [lambda at=at, i=i: login(at, i) for i, at in enumerate(sessions)])
+
+    picks = [", ".join(rng.sample(UNIVERSE[:12], rng.randint(3, 8))) for _ in sessions]
+    sessions = rec.phase("watchlist edit", [lambda at=at, p=p: widget(at.text_area, "Edit Tickers").set_value(p).run() for at, p in zip(sessions, picks)])
+
+    for _ in range(args.ticks):
+        sessions = rec.phase("dashboard tick", [at.run for at in sessions])
+
+    sessions = rec.phase("view switch", [lambda at=at: at.radio(key="dash_view").set_value("🚀 My Picks").run() for at in sessions])
+
+    # Memory per session, measured directly: what the heap gives back when each session is dropped
+    freed = []
+    while sessions:
+        gc.collect(); before = tracemalloc.get_traced_memory()[0]
+        sessions.pop()
+        gc.collect(); freed.append(max(0, before - tracemalloc.get_traced_memory()[0]) / 1024)
+    tracemalloc.stop()
+
+    report = {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "actions": rec.report(),
+        "connections_total": db.stats["connections"],
+        "connections_left_open": db.stats["open"],
+        "peak_open_connections": db.stats["peak_open"],
+        "peak_active_sessions": rec.peak_active if args.concurrency > 1 else 1,
+        "memory_per_session_kb": {"p50": round(percentile(freed, 50), 1), "max": round(max(freed or [0]), 1)},
+        "unhandled_sql": dict(db.unhandled),
+    }
+
+    print(f"{'action':<16}{'reruns':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'queries':>10}{'conns':>8}{'errors':>8}")
+    for action, r in report["actions"].items():
+        print(f"{action:<16}{r['reruns']:>8}{r['p50_ms']:>10,.0f}{r['p90_ms']:>10,.0f}{r['p99_ms']:>10,.0f}{r['queries_per_rerun']:>10}{r['connections_per_rerun']:>8}{r['exceptions']:>8}")
+    mem = report["memory_per_session_kb"]
+    print(f"connections: {report['connections_total']} opened, {report['connections_left_open']} never closed, peak {report['peak_open_connections']} open at once ({report['peak_active_sessions']} sessions active)")
+    print(f"memory/session: p50 {mem['p50']:,} KB, max {mem['max']:,} KB")
+    if db.unhandled: print(f"⚠️ {sum(db.unhandled.values())} statements not understood by the stand-in: {list(db.unhandled)[:5]}")
+    if args.json:
+        with open(args.json, "w") as f: json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
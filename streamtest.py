@@ -0,0 +1,137 @@
+"""
+Stand-in quote stream for worker/stream.py.
+
+    python streamtest.py --seconds 20 --rate 2000
+
+Serves the stream protocol on localhost (subscribe / unsubscribe in, one JSON quote
+per message out) with random-walk prices for whatever is subscribed. It then runs a
+QuoteStream against it with loadtest's FakeDB standing in for MySQL (and its fake
+yfinance, so the worker's universe code imports), edits a watchlist mid-run to exercise
+re-subscription, and reports:
+
+  - ticks sent / received vs rows written (coalescing)
+  - tick -> committed latency percentiles
+  - DB round-trips and bytes received per minute, next to the round-trips the app's
+    polling refresh spends on the same universe (one cycle per 120s)
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from loadtest import UNIVERSE, FakeDB, FakeConnection, fake_mysql, fake_yfinance, seed
+
+
+class StandInServer:
+    """Random-walk quotes for the union of every client's subscriptions."""
+
+    def __init__(self, rate, move_rate=0.5, seed=7):
+        self.rate, self.move_rate = rate, move_rate
+        self.rng = random.Random(seed)
+        self.prices = {}
+        self.stats = defaultdict(int)
+        self.subscriptions = []  # (seconds since start, sorted symbols) per change
+
+    def quote(self, t):
+        p = self.prices.setdefault(t, [self.rng.uniform(5, 300)] * 3)  # [price, open, high/low seed]
+        if self.rng.random() < self.move_rate: p[0] = round(p[0] * (1 + self.rng.gauss(0, 0.002)), 4)
+        return {"id": t, "price": p[0], "change_percent": (p[0] - p[1]) / p[1] * 100, "day_high": max(p[0], p[1]), "day_low": min(p[0], p[1]), "time": int(time.time() * 1000)}
+
+    async def handler(self, ws, path=None):
+        subs, t0 = set(), time.monotonic()
+
+        async def reader():
+            async for raw in ws:
+                msg = json.loads(raw)
+                subs.update(msg.get("subscribe", [])); subs.difference_update(msg.get("unsubscribe", []))
+                self.stats["control_msgs"] += 1
+                self.subscriptions.append((round(time.monotonic() - t0, 2), sorted(subs)))
+
+        task = asyncio.ensure_future(reader())
+        burst = max(1, self.rate // 100)  # send in 10ms bursts
+        try:
+            while not task.done():
+                if subs:
+                    symbols = sorted(subs)
+                    for _ in range(burst):
+                        await ws.send(json.dumps(self.quote(self.rng.choice(symbols))))
+                        self.stats["ticks_sent"] += 1
+                await asyncio.sleep(0.01)
+        except Exception:
+            pass
+        finally: task.cancel()
+
+
+async def drive(args, db):
+    import websockets
+    from worker.stream import QuoteStream
+
+    server = StandInServer(args.rate)
+    async with websockets.serve(server.handler, "127.0.0.1", args.port):
+        stream = QuoteStream(lambda: FakeConnection(db), f"ws://127.0.0.1:{args.port}",
+                             flush_seconds=args.flush, universe_seconds=args.universe_seconds, report_seconds=10 ** 9)  # one window for the whole run
+
+        async def edit_watchlist():
+            # Halfway through: a user swaps their watchlist, the stream must follow
+            await asyncio.sleep(args.seconds / 2)
+            u = db.tables["user_profiles"]["stream_user"]
+            u["user_data"] = json.dumps({"w_input": ", ".join(UNIVERSE[len(UNIVERSE) // 2:] + ["NEWCO"])})
+
+        editor = asyncio.ensure_future(edit_watchlist())
+        summary = await stream.run(args.seconds)
+        editor.cancel()
+
+    counts = summary["counts"]
+    symbols = len(server.subscriptions[-1][1]) if server.subscriptions else 0
+    poll_cycle = 1 + 2 * symbols  # app refresh: freshness SELECT + upsert and commit per moved symbol
+    return {
+        "seconds": args.seconds,
+        "ticks_sent": server.stats["ticks_sent"],
+        "ticks_received": counts.get("ticks", 0),
+        "rows_written": counts.get("rows_written", 0),
+        "flushes": counts.get("flushes", 0),
+        "coalescing": round(counts.get("ticks", 0) / max(1, counts.get("rows_written", 0)), 1),
+        "lag_p50_ms": summary["gauges"].get("lag_p50_ms"),
+        "lag_p95_ms": summary["gauges"].get("lag_p95_ms"),
+        "db_roundtrips_per_min": round(counts.get("db_roundtrips", 0) / args.seconds * 60, 1),
+        "polling_roundtrips_per_min": round(poll_cycle / 2, 1),
+        "kb_in_per_min": round(counts.get("bytes_in", 0) / 1024 / args.seconds * 60, 1),
+        "subscription_changes": [(at, len(symbols)) for at, symbols in server.subscriptions],
+        "final_subscription": server.subscriptions[-1][1] if server.subscriptions else [],
+        "unhandled_sql": dict(db.unhandled),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--seconds", type=float, default=20)
+    ap.add_argument("--rate", type=int, default=2000, help="ticks per second from the stand-in server")
+    ap.add_argument("--flush", type=float, default=None, help="stream flush interval (seconds, default: worker/stream.py's)")
+    ap.add_argument("--universe-seconds", type=float, default=2, help="how often the stream re-reads the universe")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--json", help="also write the report here")
+    args = ap.parse_args()
+    if args.flush is None:
+        from worker.stream import FLUSH_SECONDS
+        args.flush = FLUSH_SECONDS
+
+    work = tempfile.mkdtemp(prefix="pp-streamtest-")
+    os.environ["WORKER_METRICS_FILE"] = os.path.join(work, "metrics.jsonl")
+    db = FakeDB(); seed(db)
+    db.tables["user_profiles"]["stream_user"] = {"username": "stream_user", "user_data": json.dumps({"w_input": ", ".join(UNIVERSE[:len(UNIVERSE) // 2])}), "pin": "1"}
+    sys.modules["mysql"], sys.modules["mysql.connector"] = fake_mysql(db)
+    sys.modules["yfinance"] = fake_yfinance()
+
+    out = asyncio.run(drive(args, db))
+    print(json.dumps(out, indent=2, default=str))
+    if args.json:
+        with open(args.json, "w") as f: json.dump(out, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import pandas as pd
+
+from worker.rules import compile_rules, evaluate
+
+
+def _snapshot():
+    return pd.DataFrame([
+        {"ticker": "NKE", "name": "Nike", "price": 105.0, "prev_price": 98.0, "change": 4.0, "pp": 0.0, "pp_price": 105.0,
+         "rsi": 55.0, "pick": 0.0, "volume": "NORMAL", "trend": "UPTREND", "prev_trend": "DOWNTREND", "rating": "BUY", "prev_rating": "HOLD"},
+        {"ticker": "AMD", "name": "AMD", "price": 150.0, "prev_price": 150.0, "change": 0.0, "pp": 0.0, "pp_price": 150.0,
+         "rsi": 50.0, "pick": 0.0, "volume": "NORMAL", "trend": "UPTREND", "prev_trend": "UPTREND", "rating": "BUY", "prev_rating": "BUY"},
+    ]).set_index("ticker")
+
+
+def test_one_hit_per_user_ticker_rule():
+    prefs = {
+        "telegram_id": "1", "w_input": "NKE, AMD", "alert_pre": False,
+        "alert_rules": [
+            {"ticker": "*", "field": "trend", "op": "==", "value": "UPTREND"},
+            {"ticker": "NKE", "field": "price", "op": "crosses_above", "value": 100},
+            {"ticker": "*", "field": "rating", "op": "changed"},
+        ],
+    }
+    fired = evaluate(compile_rules([("alice", prefs)]), _snapshot())
+
+    assert not fired.duplicated(["user", "ticker", "rule_id"]).any()
+    hits = set(zip(fired["ticker"], fired["alert_type"]))
+    assert ("NKE", "PRICE_SPIKE") in hits and ("NKE", "TREND_CHANGE") in hits and ("NKE", "RATING_CHANGE") in hits
+    assert ("AMD", "TREND_CHANGE") not in hits and ("AMD", "RATING_CHANGE") not in hits
+    assert len(fired[fired["kind"] == "CUSTOM"]) == 4  # trend == UPTREND x2, NKE crosses_above 100, NKE rating changed
+
+
+def test_crossing_uses_previous_price():
+    prefs = {"telegram_id": "1", "w_input": "AMD", "alert_pre": False, "alert_price": False, "alert_pm": False,
+             "alert_rating": False, "alert_trend": False,
+             "alert_rules": [{"ticker": "AMD", "field": "price", "op": "crosses_above", "value": 120}]}
+    assert evaluate(compile_rules([("bob", prefs)]), _snapshot()).empty
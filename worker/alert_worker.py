@@ -1,54 +1,78 @@
 import os
+import time
+import socket
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import mysql.connector
 import yfinance as yf
 import pandas as pd
 import json
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from worker.metrics import RunMetrics
+from worker.changes import row_fingerprint, mark_checked
+from worker.rules import compile_rules, evaluate, apply_cooldowns, rule_tickers
+from worker.digest import plan_messages
+from worker.outbox import enqueue
+from worker.shards import partition, cycle_start, acquire_lease, renew_lease, complete_lease
+from worker.migrations import migrate
+from worker.markets import stale_tickers
+from worker import blocklist
+from worker.pipeline import Stage, run_pipeline
+from worker.throttle import is_no_data_error
+from worker.earnings import next_dates as next_earnings, label as earnings_label
 
 # --- CONFIG ---
 DB_HOST = os.environ.get("DB_HOST") or "72.55.168.16"
 DB_USER = os.environ.get("DB_USER") or "penny_user"
 DB_PASS = os.environ.get("DB_PASS") or "123456"
 DB_NAME = os.environ.get("DB_NAME") or "penny_pulse"
-TG_TOKEN = os.environ.get("TELEGRAM_TOKEN") 
 
 DB_CONFIG = {"host": DB_HOST, "user": DB_USER, "password": DB_PASS, "database": DB_NAME, "connect_timeout": 30}
 
+# --- DAEMON CADENCE (seconds between ticks) ---
+TICK_REGULAR = int(os.environ.get("WORKER_TICK_REGULAR") or 60)
+TICK_EXTENDED = int(os.environ.get("WORKER_TICK_EXTENDED") or 120)
+TICK_OVERNIGHT = int(os.environ.get("WORKER_TICK_OVERNIGHT") or 900)
+TICK_WEEKEND = int(os.environ.get("WORKER_TICK_WEEKEND") or 3600)
+
+# --- SHARDING ---
+CYCLE_SECONDS = int(os.environ.get("WORKER_CYCLE_SECONDS") or 300)   # one lease cycle (matches the cron cadence)
+LEASE_TTL = int(os.environ.get("WORKER_LEASE_TTL") or 120)           # renewed while the shard is still working
+SHARD_THREADS = int(os.environ.get("WORKER_SHARD_THREADS") or 4)     # concurrent tickers inside one shard
+# --- REFRESH PIPELINE (update_stock_cache) ---
+FETCH_WORKERS = int(os.environ.get("WORKER_FETCH_WORKERS") or 8)       # concurrent Yahoo requests
+COMPUTE_WORKERS = int(os.environ.get("WORKER_COMPUTE_WORKERS") or 2)   # indicator math
+WRITE_BATCH = int(os.environ.get("WORKER_WRITE_BATCH") or 25)          # max records per executemany/commit
+WRITE_LINGER = float(os.environ.get("WORKER_WRITE_LINGER") or 1.0)     # seconds the writer waits for a batch to fill
+MARKET_TZ = ZoneInfo("America/New_York")
+META_TTL = int(os.environ.get("WORKER_META_TTL") or 3600)              # seconds a rating / company name is reused
+
+# Warm state kept between daemon ticks (empty on every cron run)
+_STATE = {"meta": {}}  # ticker -> (expires_at, rating, company name)
+
 def get_db():
     return mysql.connector.connect(**DB_CONFIG)
 
-def send_telegram(chat_id, msg):
-    if not TG_TOKEN or not chat_id: return
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
+def ensure_db(conn):
+    """Reuses a live connection, reconnecting (or reopening) if it dropped."""
+    if conn is None: return get_db()
     try:
-        requests.post(url, json={"chat_id": chat_id, "text": msg, "parse_mode": "HTML"})
-    except: pass
+        if not conn.is_connected(): conn.reconnect(attempts=3, delay=2)
+        return conn
+    except Exception:
+        return get_db()
 
-def check_cooldown(cursor, user, ticker, alert_type, cooldown_hours=6):
-    try:
-        cursor.execute(
-            "SELECT last_sent FROM alert_log WHERE user_id=%s AND ticker=%s AND alert_type=%s",
-            (user, ticker, alert_type)
-        )
-        row = cursor.fetchone()
-        if row:
-            last = row['last_sent']
-            if datetime.now() < (last + timedelta(hours=cooldown_hours)):
-                return False 
-    except: pass
-    return True
-
-def log_alert(conn, cursor, user, ticker, alert_type):
-    try:
-        sql = """
-        INSERT INTO alert_log (user_id, ticker, alert_type, last_sent)
-        VALUES (%s, %s, %s, NOW())
-        ON DUPLICATE KEY UPDATE last_sent=NOW()
-        """
-        cursor.execute(sql, (user, ticker, alert_type))
-        conn.commit()
-    except: pass
+def log_alerts(cursor, hits):
+    """Starts the cooldown for a batch of alerts in one round-trip (caller commits)."""
+    sql = """
+    INSERT INTO alert_log (user_id, ticker, alert_type, last_sent)
+    VALUES (%s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE last_sent=NOW()
+    """
+    cursor.executemany(sql, [(h["user"], h["ticker"], h["alert_type"]) for h in hits])
 
 def calculate_rsi(series, window=14):
     delta = series.diff()
@@ -57,159 +81,411 @@ def calculate_rsi(series, window=14):
     rs = gain / loss
     return 100 - (100 / (1 + rs))
 
-def get_earnings_date(tk):
-    try:
-        now = datetime.now().date()
-        cal = tk.calendar
-        if isinstance(cal, dict) and 'Earnings Date' in cal:
-            dates = cal['Earnings Date']
-            for d in dates:
-                if d.date() >= now: return d.strftime('%b %d')
-        elif hasattr(cal, 'iloc') and not cal.empty:
-            vals = cal.values.flatten()
-            for v in vals:
-                if isinstance(v, (datetime, pd.Timestamp)):
-                    if v.date() >= now: return v.strftime('%b %d')
-    except: pass
-    return "N/A"
-
-def update_stock_cache():
-    print("🚀 Starting DATA + ALERTS Worker...")
-    conn = get_db()
-    cursor = conn.cursor(dictionary=True)
-    
-    # 1. Get Users & Prefs
-    cursor.execute("SELECT username, user_data FROM user_profiles")
-    users = cursor.fetchall()
-    
-    # 2. Build Master Ticker List
-    all_tickers = set(["^DJI", "^IXIC", "^GSPTSE", "GC=F"]) 
-    user_map = [] 
+def get_meta(t, tk, m):
+    """(rating, company name), reused for META_TTL. yf.Ticker memoizes .info, so the Ticker itself is never kept."""
+    hit = _STATE["meta"].get(t)
+    if hit and hit[0] > time.time(): return hit[1], hit[2]
+    info = tk.info
+    rating = info.get('recommendationKey', 'N/A').replace('_', ' ').upper()
+    if rating == "NONE": rating = "N/A"
+    comp_name = info.get('shortName') or info.get('longName') or t
+    _STATE["meta"][t] = (time.time() + META_TTL, rating, comp_name)
+    m.incr("meta_fetched")
+    return rating, comp_name
+
+def prune_meta():
+    """Drops expired metadata, so symbols that left the universe do not stay in memory."""
+    now = time.time()
+    for t in [t for t, hit in _STATE["meta"].items() if hit[0] <= now]: _STATE["meta"].pop(t, None)
+
+def load_universe(cursor, m):
+    """Returns (all_tickers, user_map, todays_picks) from user_profiles / daily_briefing."""
+    with m.stage("universe"):
+        # 1. Get Users & Prefs
+        cursor.execute("SELECT username, user_data FROM user_profiles")
+        users = cursor.fetchall()
+        
+        # 2. Build Master Ticker List
+        all_tickers = set(["^DJI", "^IXIC", "^GSPTSE", "GC=F"]) 
+        user_map = [] 
 
-    for r in users:
+        for r in users:
+            try:
+                data = json.loads(r['user_data'])
+                user_map.append((r['username'], data))
+                if 'w_input' in data: all_tickers.update([t.strip().upper() for t in data['w_input'].split(",") if t.strip()])
+                if 'portfolio' in data: all_tickers.update(data['portfolio'].keys())
+                if r['username'] == 'GLOBAL_CONFIG' and 'tape_input' in data:
+                     all_tickers.update([t.strip().upper() for t in data['tape_input'].split(",") if t.strip()])
+            except Exception:
+                m.incr("bad_profiles")
+
+        # 3. Tickers only named by custom alert rules or today's AI picks
+        all_tickers.update(rule_tickers(user_map))
+        picks = load_todays_picks(cursor)
+        all_tickers.update(picks)
+    m.incr("tickers", len(all_tickers))
+    return all_tickers, user_map, picks
+
+def load_old_rows(cursor, tickers):
+    """Previous rating / hash / trend / price per ticker (for change detection and crossings), in one query."""
+    tickers = list(tickers)
+    if not tickers: return {}
+    fmt = ",".join(["%s"] * len(tickers))
+    cursor.execute(f"SELECT ticker, rating, worker_hash, trend_status, current_price FROM stock_cache WHERE ticker IN ({fmt})", tuple(tickers))
+    return {r["ticker"]: r for r in cursor.fetchall()}
+
+def fetch_ticker(t, m):
+    """
+    Network half of a refresh: daily history, metadata and the pre/post print. None if Yahoo
+    has no data for the symbol (a blocklist miss); request errors such as 429s raise instead,
+    so a throttled run does not blocklist good symbols.
+    """
+    with m.stage("download"):
+        tk = yf.Ticker(t)
         try:
-            data = json.loads(r['user_data'])
-            user_map.append((r['username'], data))
-            if 'w_input' in data: all_tickers.update([t.strip().upper() for t in data['w_input'].split(",") if t.strip()])
-            if 'portfolio' in data: all_tickers.update(data['portfolio'].keys())
-            if r['username'] == 'GLOBAL_CONFIG' and 'tape_input' in data:
-                 all_tickers.update([t.strip().upper() for t in data['tape_input'].split(",") if t.strip()])
-        except: pass
-    
-    # 3. Process Stocks
-    for t in all_tickers:
+            # raise_errors: without it yfinance logs and returns an empty frame for throttles too
+            hist = tk.history(period="1mo", interval="1d", raise_errors=True)
+        except Exception as e:
+            if not is_no_data_error(e): raise
+            hist = None
+
+    if hist is None or hist.empty:
+        m.incr("skipped")
+        return
+    m.incr("fetched")
+
+    with m.stage("metadata"):
+        rating = "N/A"
+        comp_name = t 
         try:
-            # --- FETCH OLD DATA (For Rating Changes) ---
-            old_rating = "N/A"
-            cursor.execute("SELECT rating FROM stock_cache WHERE ticker=%s", (t,))
-            row = cursor.fetchone()
-            if row: old_rating = row['rating']
-
-            # --- FETCH NEW DATA ---
-            tk = yf.Ticker(t)
-            hist = tk.history(period="1mo", interval="1d") 
-            
-            if not hist.empty:
-                curr = float(hist['Close'].iloc[-1])
-                prev = float(hist['Close'].iloc[-2]) if len(hist) > 1 else curr
-                change = ((curr - prev) / prev) * 100
-                
-                rsi = 50.0
-                try:
-                    rsi_series = calculate_rsi(hist['Close'])
-                    if not rsi_series.empty: rsi = rsi_series.iloc[-1]
-                except: pass
-                
-                vol_stat = "NORMAL"
-                if not hist['Volume'].empty:
-                    vol_avg = hist['Volume'].mean()
-                    if hist['Volume'].iloc[-1] > vol_avg * 1.5: vol_stat = "HEAVY"
-                    elif hist['Volume'].iloc[-1] < vol_avg * 0.5: vol_stat = "LIGHT"
-
-                trend = "UPTREND" if curr > hist['Close'].tail(20).mean() else "DOWNTREND"
-                
-                rating = "N/A"
-                comp_name = t 
-                try:
-                    info = tk.info
-                    rating = info.get('recommendationKey', 'N/A').replace('_', ' ').upper()
-                    if rating == "NONE": rating = "N/A"
-                    comp_name = info.get('shortName') or info.get('longName') or t
-                except: pass
-                
-                earn_str = get_earnings_date(tk)
-
-                # Pre/Post Logic
-                pp_price = 0.0
-                pp_pct = 0.0
-                try:
-                    live = tk.history(period="1d", interval="1m", prepost=True)
-                    if not live.empty:
-                        last_price = live['Close'].iloc[-1]
-                        if abs(last_price - curr) > 0.01:
-                            pp_price = float(last_price)
-                            pp_pct = float(((last_price - curr) / curr) * 100)
-                except: pass
-
-                # History
-                chart_points = hist['Close'].tail(20).tolist()
-                chart_json = json.dumps(chart_points)
-
-                # Save to DB
-                sql = """
-                INSERT INTO stock_cache 
-                (ticker, current_price, day_change, rsi, volume_status, trend_status, rating, next_earnings, pre_post_price, pre_post_pct, price_history, company_name)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                current_price=%s, day_change=%s, rsi=%s, volume_status=%s, trend_status=%s, rating=%s, next_earnings=%s,
-                pre_post_price=%s, pre_post_pct=%s, price_history=%s, company_name=%s
-                """
-                vals = (t, curr, change, rsi, vol_stat, trend, rating, earn_str, pp_price, pp_pct, chart_json, comp_name,
-                        curr, change, rsi, vol_stat, trend, rating, earn_str, pp_price, pp_pct, chart_json, comp_name)
-                cursor.execute(sql, vals)
-                conn.commit()
-
-                # --- ALERT LOGIC ---
-                for username, prefs in user_map:
-                    tg_id = prefs.get('telegram_id')
-                    user_tickers = []
-                    if 'w_input' in prefs: user_tickers += [x.strip().upper() for x in prefs['w_input'].split(",")]
-                    if 'portfolio' in prefs: user_tickers += list(prefs['portfolio'].keys())
-                    
-                    if not tg_id or t not in user_tickers: 
-                        continue
-
-                    # 1. PRICE ALERT (> 3%)
-                    if prefs.get('alert_price', True) and abs(change) >= 3.0:
-                        alert_type = "PRICE_SPIKE" if change > 0 else "PRICE_DROP"
-                        if check_cooldown(cursor, username, t, alert_type, 6): 
-                            emoji = "🚀" if change > 0 else "🔻"
-                            msg = f"{emoji} <b>{comp_name} ({t})</b> Alert!\nPrice: ${curr:.2f}\nMove: {change:+.2f}%"
-                            send_telegram(tg_id, msg)
-                            log_alert(conn, cursor, username, t, alert_type)
-
-                    # 2. EXTENDED HOURS ALERT (> 1.5%)
-                    if prefs.get('alert_pm', True) and abs(pp_pct) >= 1.5:
-                         alert_type = "EXTENDED_MOVE"
-                         if check_cooldown(cursor, username, t, alert_type, 4):
-                            msg = f"🌙 <b>{comp_name}</b> Extended Hours!\nPrice: ${pp_price:.2f}\nChange: {pp_pct:+.2f}%"
-                            send_telegram(tg_id, msg)
-                            log_alert(conn, cursor, username, t, alert_type)
-                    
-                    # 3. ANALYST RATING CHANGE
-                    if prefs.get('alert_rating', True):
-                        if old_rating != "N/A" and rating != "N/A" and old_rating != rating:
-                             alert_type = "RATING_CHANGE"
-                             if check_cooldown(cursor, username, t, alert_type, 24):
-                                 msg = f"📢 <b>{comp_name}</b> Analyst Update!\nOld: {old_rating}\nNew: <b>{rating}</b>"
-                                 send_telegram(tg_id, msg)
-                                 log_alert(conn, cursor, username, t, alert_type)
+            rating, comp_name = get_meta(t, tk, m)
+        except Exception:
+            m.incr("meta_failed")
+
+    # Pre/Post Logic
+    with m.stage("download"):
+        live = None
+        try:
+            live = tk.history(period="1d", interval="1m", prepost=True)
+        except Exception:
+            m.incr("prepost_failed")
+
+    return {"ticker": t, "hist": hist, "live": live, "rating": rating, "name": comp_name}
+
+def compute_ticker(raw, old, m, next_earn=None):
+    """CPU half: indicators and the change fingerprint. Returns the snapshot record for the rules engine."""
+    t, hist = raw["ticker"], raw["hist"]
+    old_rating = old['rating'] if old else "N/A"
+    old = old or {}
+    old_hash = old.get('worker_hash'); old_trend = old.get('trend_status')
+    old_price = float(old['current_price']) if old.get('current_price') is not None else None
+
+    with m.stage("indicators"):
+        curr = float(hist['Close'].iloc[-1])
+        prev = float(hist['Close'].iloc[-2]) if len(hist) > 1 else curr
+        change = ((curr - prev) / prev) * 100
+        
+        rsi = 50.0
+        try:
+            rsi_series = calculate_rsi(hist['Close'])
+            if not rsi_series.empty: rsi = rsi_series.iloc[-1]
+        except: pass
+        
+        vol_stat = "NORMAL"
+        if not hist['Volume'].empty:
+            vol_avg = hist['Volume'].mean()
+            if hist['Volume'].iloc[-1] > vol_avg * 1.5: vol_stat = "HEAVY"
+            elif hist['Volume'].iloc[-1] < vol_avg * 0.5: vol_stat = "LIGHT"
+
+        trend = "UPTREND" if curr > hist['Close'].tail(20).mean() else "DOWNTREND"
+
+        pp_price = 0.0
+        pp_pct = 0.0
+        live = raw["live"]
+        if live is not None and not live.empty:
+            last_price = live['Close'].iloc[-1]
+            if abs(last_price - curr) > 0.01:
+                pp_price = float(last_price)
+                pp_pct = float(((last_price - curr) / curr) * 100)
 
+        # History
+        chart_points = hist['Close'].tail(20).tolist()
+        chart_json = json.dumps(chart_points)
+
+    rating, comp_name, earn_str = raw["rating"], raw["name"], earnings_label(next_earn)  # dates come from worker/earnings.py
+    fp = row_fingerprint(curr, change, float(rsi), vol_stat, trend, rating, earn_str, pp_price, pp_pct, chart_json, comp_name)
+    return {
+        "ticker": t, "name": comp_name, "price": curr, "prev_price": old_price, "change": change,
+        "pp": pp_pct, "pp_price": pp_price, "rsi": float(rsi), "volume": vol_stat,
+        "trend": trend, "prev_trend": old_trend, "rating": rating, "prev_rating": old_rating,
+        "changed": fp != old_hash,
+        "_row": (t, curr, change, float(rsi), vol_stat, trend, rating, earn_str, pp_price, pp_pct, chart_json, comp_name, fp),
+    }
+
+UPSERT_SQL = """
+INSERT INTO stock_cache 
+(ticker, current_price, day_change, rsi, volume_status, trend_status, rating, next_earnings, pre_post_price, pre_post_pct, price_history, company_name, worker_hash, checked_at)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+ON DUPLICATE KEY UPDATE
+current_price=VALUES(current_price), day_change=VALUES(day_change), rsi=VALUES(rsi), volume_status=VALUES(volume_status),
+trend_status=VALUES(trend_status), rating=VALUES(rating), next_earnings=VALUES(next_earnings), pre_post_price=VALUES(pre_post_price),
+pre_post_pct=VALUES(pre_post_pct), price_history=VALUES(price_history), company_name=VALUES(company_name), worker_hash=VALUES(worker_hash), checked_at=NOW()
+"""
+
+def write_records(records, db, cursor, m, mark_unchanged=True):
+    """Saves a batch: one executemany for changed rows, one checked_at bump for the rest, one commit."""
+    changed = [r.pop("_row") for r in records if r["changed"]]
+    for r in records: r.pop("_row", None)
+    with m.stage("db_write"):
+        if changed: cursor.executemany(UPSERT_SQL, changed)
+        if mark_unchanged:
+            unchanged = [r["ticker"] for r in records if not r["changed"]]
+            if unchanged: mark_checked(cursor, unchanged)
+        db.commit()
+    m.incr("changed", len(changed))
+    m.incr("unchanged", len(records) - len(changed))
+    return records
+
+def process_ticker(t, db, cursor, m, next_earn=None):
+    """Fetch, compute and save one symbol. Returns its snapshot record for the rules engine (None if no data)."""
+    with m.stage("db_read"): old = load_old_rows(cursor, [t]).get(t)
+    raw = fetch_ticker(t, m)
+    if raw is None: return
+    return write_records([compute_ticker(raw, old, m, next_earn)], db, cursor, m, mark_unchanged=False)[0]
+
+def prepare_schema(conn):
+    """Once per process: apply pending schema migrations (worker/migrations.py)."""
+    if _STATE.get("schema_ready"): return
+    migrate(conn, verbose=True)
+    _STATE["schema_ready"] = True
+
+def flush_unchanged(db, cursor, records, m):
+    """One statement per run bumps checked_at for every re-fetched but unchanged row."""
+    tickers = [r["ticker"] for r in records if not r["changed"]]
+    if not tickers: return
+    with m.stage("db_write"):
+        mark_checked(cursor, tickers)
+        db.commit()
+
+def load_todays_picks(cursor):
+    try:
+        cursor.execute("SELECT picks FROM daily_briefing WHERE date = CURDATE()")
+        row = cursor.fetchone()
+        if not row or not row['picks']: return []
+        return [str(p.get('ticker', '') if isinstance(p, dict) else p).upper() for p in json.loads(row['picks'])]
+    except Exception:
+        return []
+
+def run_alerts(records, user_map, picks, db, cursor, m):
+    """Evaluates every user's rules against the refreshed universe in one vectorized pass."""
+    if not records: return
+    with m.stage("alerts"):
+        snapshot = pd.DataFrame(records).set_index("ticker")
+        snapshot["pick"] = snapshot.index.isin(picks).astype(float)
+        rules = compile_rules(user_map, picks)
+        m.incr("rules", len(rules))
+        fired = apply_cooldowns(evaluate(rules, snapshot), cursor)
+        if fired.empty: return
+        m.incr("alerts_fired", len(fired))
+        messages = plan_messages(fired, user_map)
+        # Outbox rows and cooldowns commit together: a crash here loses neither or both.
+        # worker/dispatcher.py does the actual sending.
+        try:
+            queued = enqueue(cursor, messages)
+            log_alerts(cursor, [h for _, _, hits in messages for h in hits])
+            db.commit()
+            m.incr("messages_queued", queued)
         except Exception as e:
-            print(f"❌ {t}: {e}")
+            db.rollback()
+            m.incr("alerts_failed", len(fired))
+            print(f"❌ Alert enqueue failed: {e}")
+
+def settle_blocklist(db, cursor, misses, records, known_bad, m):
+    """Backs off symbols that came back empty; clears the ones that recovered."""
+    try:
+        with m.stage("db_write"):
+            blocklist.settle(cursor, misses, [r["ticker"] for r in records], known_bad)
+            db.commit()
+        if misses: print(f"🚫 No data for {len(misses)} symbol(s): {', '.join(sorted(misses)[:10])}")
+    except Exception as e:
+        print(f"⚠️ Blocklist update failed: {e}")
+
+def update_stock_cache(conn=None):
+    """
+    One full refresh + alert pass.
+    Pass a live connection to keep it open afterwards (daemon mode);
+    without one a fresh connection is opened and closed (cron mode).
+    """
+    print("🚀 Starting DATA + ALERTS Worker...")
+    m = RunMetrics("update_stock_cache")
+    own_conn = conn is None
+    conn = ensure_db(conn)
+    conn.commit()  # close any snapshot left from the last tick so new users/watchlists show up
+    prepare_schema(conn)
+    db = m.track(conn)
+    cursor = db.cursor(dictionary=True)
+    prune_meta()
+    all_tickers, user_map, picks = load_universe(cursor, m)
+    # Closed venues are fetched once after their close, then skipped until they reopen
+    with m.stage("freshness"):
+        all_tickers = stale_tickers(cursor, all_tickers, m=m)
+        # Symbols Yahoo keeps returning nothing for wait out their backoff
+        all_tickers, known_bad = blocklist.screen(cursor, all_tickers, m)
+    
+    # 3. Process Stocks: downloads, indicators and DB writes overlap (worker/pipeline.py)
+    with m.stage("db_read"):
+        old_rows = load_old_rows(cursor, all_tickers)
+        next_earn = next_earnings(cursor, all_tickers)
+    misses = []
 
-    conn.close()
+    def fetch(t):
+        raw = fetch_ticker(t, m)
+        if raw is None: misses.append(t)
+        return raw
+
+    def failed(stage, item, e):
+        m.incr("failed")
+        print(f"❌ {item if isinstance(item, str) else stage}: {e}")
+
+    records = run_pipeline(all_tickers, [
+        Stage("download", fetch, workers=FETCH_WORKERS),
+        Stage("indicators", lambda raw: compute_ticker(raw, old_rows.get(raw["ticker"]), m, next_earn.get(raw["ticker"])), workers=COMPUTE_WORKERS),
+        Stage("db_write", lambda recs: write_records(recs, db, cursor, m), batch=WRITE_BATCH, linger=WRITE_LINGER),
+    ], m, on_error=failed)
+    settle_blocklist(db, cursor, misses, records, known_bad, m)
+
+    # 4. Alerts
+    run_alerts(records, user_map, picks, db, cursor, m)
+
+    cursor.close()
+    if own_conn: conn.close()
+    m.finish()
     print("🏁 Update Complete.")
+    return conn
+
+# --- SHARDED MODE ---
+def run_sharded(total_shards, conn=None, cycle_seconds=CYCLE_SECONDS):
+    """
+    Splits the universe into `total_shards` by consistent hashing and processes every
+    shard this process can lease. Run the same command on N hosts/processes: each
+    claims free shards, so throughput scales and no ticker is handled twice per cycle.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    cycle = cycle_start(cycle_seconds)
+    print(f"🚀 Sharded worker {owner} (cycle {cycle}, {total_shards} shards)")
+    m = RunMetrics("update_stock_cache_sharded")
+    own_conn = conn is None
+    conn = ensure_db(conn)
+    conn.commit()
+    prepare_schema(conn)
+    db = m.track(conn)
+    cursor = db.cursor(dictionary=True)
+    prune_meta()
+    all_tickers, user_map, picks = load_universe(cursor, m)
+    with m.stage("freshness"):
+        all_tickers = stale_tickers(cursor, all_tickers, m=m)
+        all_tickers, known_bad = blocklist.screen(cursor, all_tickers, m)
+    with m.stage("db_read"): next_earn = next_earnings(cursor, all_tickers)
+    shards = partition(sorted(all_tickers), total_shards)
+
+    # Start at a different shard per owner so concurrent workers don't all race for shard 0
+    start = hash(owner) % total_shards
+    for shard in [(start + i) % total_shards for i in range(total_shards)]:
+        if not acquire_lease(conn, shard, owner, cycle, LEASE_TTL):
+            m.incr("shards_skipped")
+            continue
+        m.incr("shards_processed")
+        print(f"🔒 Shard {shard}: {len(shards[shard])} tickers")
+
+        local = threading.local()
+        thread_conns = []
+
+        def work(t):
+            if not hasattr(local, "db"):
+                local.raw = get_db()
+                thread_conns.append(local.raw)
+                local.db = m.track(local.raw)
+                local.cursor = local.db.cursor(dictionary=True)
+            return process_ticker(t, local.db, local.cursor, m, next_earn.get(t))
+
+        records = []
+        misses = []
+        lost = False
+        with ThreadPoolExecutor(max_workers=SHARD_THREADS) as ex:
+            futures = {ex.submit(work, t): t for t in shards[shard]}
+            for i, fut in enumerate(as_completed(futures), 1):
+                try:
+                    rec = fut.result()
+                    if rec: records.append(rec)
+                    else: misses.append(futures[fut])
+                except Exception as e:
+                    m.incr("failed")
+                    print(f"❌ {futures[fut]}: {e}")
+                if i % 10 == 0 and not renew_lease(conn, shard, owner, LEASE_TTL):
+                    # Someone else owns the shard now: stop, so its tickers are not worked twice
+                    print(f"⚠️ Lost lease on shard {shard}, stopping it")
+                    m.incr("leases_lost")
+                    lost = True
+                    ex.shutdown(wait=True, cancel_futures=True)
+                    break
+        for c in thread_conns:
+            try: c.close()
+            except: pass
+        if lost: continue  # the new owner reprocesses the shard, alerts included
+        flush_unchanged(db, cursor, records, m)
+        settle_blocklist(db, cursor, misses, records, known_bad, m)
+        run_alerts(records, user_map, picks, db, cursor, m)
+        complete_lease(conn, shard, owner, cycle)
+
+    cursor.close()
+    if own_conn: conn.close()
+    m.finish()
+    print("🏁 Sharded Update Complete.")
+    return conn
+
+# --- DAEMON MODE ---
+def market_phase(now=None):
+    """REGULAR / EXTENDED / OVERNIGHT / WEEKEND for US equities, in New York time."""
+    now = now or datetime.now(MARKET_TZ)
+    if now.weekday() > 4: return "WEEKEND"
+    minutes = now.hour * 60 + now.minute
+    if 570 <= minutes < 960: return "REGULAR"      # 09:30 - 16:00
+    if 240 <= minutes < 1200: return "EXTENDED"    # 04:00 - 09:30, 16:00 - 20:00
+    return "OVERNIGHT"
+
+def next_tick_delay(now=None):
+    phase = market_phase(now)
+    delay = {"REGULAR": TICK_REGULAR, "EXTENDED": TICK_EXTENDED, "OVERNIGHT": TICK_OVERNIGHT, "WEEKEND": TICK_WEEKEND}[phase]
+    return phase, delay
+
+def run_daemon(shards=0):
+    """
+    Long-running worker: one process, one DB connection, warm metadata (META_TTL).
+    Tick cadence tightens during market hours and backs off overnight and on weekends.
+    """
+    print("👷 Worker daemon started.")
+    conn = None
+    while True:
+        started = time.time()
+        try:
+            conn = run_sharded(shards, conn, next_tick_delay()[1]) if shards else update_stock_cache(conn)
+        except Exception as e:
+            print(f"❌ Tick failed: {e}")
+            try: conn.close()
+            except: pass
+            conn = None
+        phase, delay = next_tick_delay()
+        wait = max(0, delay - (time.time() - started))
+        print(f"⏱️ {phase}: next tick in {int(wait)}s")
+        time.sleep(wait)
 
+# Run from the repo root: python -m worker.alert_worker [--daemon] [--shards N]
 if __name__ == "__main__":
-    update_stock_cache()
+    parser = argparse.ArgumentParser(description="Penny Pulse data + alerts worker")
+    parser.add_argument("--daemon", action="store_true", help="keep running with a market-hours-aware cadence")
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("WORKER_SHARDS") or 0), help="split the universe into N leased shards")
+    args = parser.parse_args()
+    if args.daemon: run_daemon(args.shards)
+    elif args.shards: run_sharded(args.shards)
+    else: update_stock_cache()
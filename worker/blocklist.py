@@ -0,0 +1,86 @@
+from datetime import datetime
+
+# --- NEGATIVE CACHE FOR DEAD SYMBOLS ---
+# Symbols Yahoo returns nothing for (typos, delistings) are recorded here with a
+# failure count. Each failure doubles the wait before the next attempt, from
+# RETRY_BASE up to RETRY_MAX, and every fetch path skips symbols still waiting.
+# One good fetch removes the row.
+#
+# Callers only record failures for runs where other symbols did come back, so an
+# upstream outage or throttle never blocklists the whole universe.
+RETRY_BASE = 15 * 60          # seconds
+RETRY_MAX = 7 * 24 * 3600
+INVALID_AFTER = 3             # failures before the UI calls a symbol invalid
+
+BLOCKLIST_DDL = """
+CREATE TABLE IF NOT EXISTS symbol_blocklist (
+    ticker VARCHAR(20) PRIMARY KEY,
+    failures INT NOT NULL DEFAULT 1,
+    first_failed DATETIME NOT NULL,
+    last_failed DATETIME NOT NULL,
+    retry_after DATETIME NOT NULL,
+    reason VARCHAR(255),
+    KEY idx_retry (retry_after)
+)
+"""
+
+def load(cursor, tickers=None):
+    """{ticker: row} for the given tickers (or all), from a dictionary cursor."""
+    if tickers is not None and not tickers: return {}
+    sql = "SELECT ticker, failures, last_failed, retry_after, reason, retry_after > NOW() AS blocked FROM symbol_blocklist"
+    if tickers is None:
+        cursor.execute(sql)
+    else:
+        tickers = list(tickers)
+        cursor.execute(sql + f" WHERE ticker IN ({','.join(['%s'] * len(tickers))})", tuple(tickers))
+    return {r["ticker"]: r for r in cursor.fetchall()}
+
+def blocked(entries):
+    """Tickers from load() that are still inside their backoff window."""
+    return {t for t, r in entries.items() if r.get("blocked")}
+
+def screen(cursor, tickers, m=None):
+    """
+    Drops blocklisted tickers before a fetch. Returns (allowed, known) where `known`
+    is every blocklist row for these tickers, waiting or not, for settle().
+    """
+    tickers = list(tickers)
+    known = load(cursor, tickers)
+    waiting = blocked(known)
+    if m: m.incr("blocklisted", len(waiting))
+    return [t for t in tickers if t not in waiting], known
+
+def settle(cursor, failed, succeeded, known):
+    """
+    Records this run's misses and clears recovered symbols. Misses only count when
+    something else in the run came back, so an outage looks like an outage.
+    """
+    if succeeded: record_failures(cursor, sorted(set(failed)))
+    clear(cursor, [t for t in succeeded if t in known])
+
+def record_failures(cursor, tickers, reason="no data"):
+    """
+    One round-trip. retry_after is computed from the *old* failure count
+    (assignments run left to right), so waits go BASE, 2xBASE, 4xBASE, ...
+    """
+    if not tickers: return
+    cursor.executemany(
+        """INSERT INTO symbol_blocklist (ticker, failures, first_failed, last_failed, retry_after, reason)
+           VALUES (%s, 1, NOW(), NOW(), NOW() + INTERVAL %s SECOND, %s)
+           ON DUPLICATE KEY UPDATE retry_after = NOW() + INTERVAL LEAST(%s * POW(2, failures), %s) SECOND,
+                                   failures = failures + 1, last_failed = NOW(), reason = VALUES(reason)""",
+        [(t, RETRY_BASE, reason[:255], RETRY_BASE, RETRY_MAX) for t in tickers],
+    )
+
+def clear(cursor, tickers):
+    if not tickers: return
+    tickers = list(tickers)
+    cursor.execute(f"DELETE FROM symbol_blocklist WHERE ticker IN ({','.join(['%s'] * len(tickers))})", tuple(tickers))
+
+def describe(row, now=None):
+    """Short label for the UI, e.g. 'not found (4 tries), retry in 2h'."""
+    now = now or datetime.now()
+    wait = (row["retry_after"] - now).total_seconds() if row.get("retry_after") else 0
+    when = "retrying soon" if wait <= 0 else f"retry in {int(wait // 3600)}h" if wait >= 3600 else f"retry in {max(1, int(wait // 60))}m"
+    label = "invalid or delisted" if row["failures"] >= INVALID_AFTER else "no data"
+    return f"{label} ({row['failures']} tries), {when}"
@@ -0,0 +1,36 @@
+import hashlib
+import json
+
+# Change detection for stock_cache writers.
+#   app_hash / worker_hash - fingerprint of the values that writer last stored. Each writer
+#                compares against its own hash only: the app and the worker store different
+#                column sets, so a shared hash made each see the other's rows as changed.
+#                (row_hash, the original shared column, is no longer written.)
+#   checked_at - when the row was last verified against upstream (changed or not)
+#   last_updated keeps meaning "values last changed"
+CHANGE_COLUMNS = [
+    ("row_hash", "CHAR(32)"),
+    ("checked_at", "DATETIME"),
+]
+WRITER_HASH_COLUMNS = [
+    ("app_hash", "CHAR(32)"),
+    ("worker_hash", "CHAR(32)"),
+]
+
+def _norm(v):
+    if isinstance(v, float): return round(v, 4)
+    return v
+
+def row_fingerprint(*values):
+    """Compact md5 of the values a writer stores (kept in that writer's own hash column)."""
+    raw = json.dumps([_norm(v) for v in values], default=str)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+def mark_checked(cursor, tickers):
+    """
+    Bumps checked_at for rows that were re-fetched but did not change.
+    last_updated=last_updated stops ON UPDATE CURRENT_TIMESTAMP from firing.
+    """
+    if not tickers: return
+    fmt = ",".join(["%s"] * len(tickers))
+    cursor.execute(f"UPDATE stock_cache SET checked_at=NOW(), last_updated=last_updated WHERE ticker IN ({fmt})", tuple(tickers))
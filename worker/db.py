@@ -2,6 +2,8 @@ import mysql.connector
 import json
 import os
 
+from worker import global_config
+
 def _cfg():
     """
     Reads DB creds from environment variables.
@@ -48,22 +50,10 @@ def get_all_users():
 def get_global_picks():
     """
     Reads GLOBAL_CONFIG portfolio tickers so your My Picks always refresh too.
-    Your app stores GLOBAL_CONFIG in user_profiles.
+    Your app stores GLOBAL_CONFIG in user_profiles (cached per process, see global_config.py).
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_data FROM user_profiles WHERE username='GLOBAL_CONFIG'")
-        row = cursor.fetchone()
-        conn.close()
-        if not row or not row[0]:
-            return []
-
-        data = json.loads(row[0])
-        port = data.get("portfolio", {}) or {}
-        if isinstance(port, dict):
-            return [k.strip().upper() for k in port.keys() if k and k.strip()]
-        return []
+        return global_config.get_global_picks(get_connection)
     except Exception as e:
         print(f"Global picks read error: {e}")
         return []
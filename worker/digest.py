@@ -0,0 +1,70 @@
+import os
+
+from worker.rules import render_message, render_condition
+
+# --- ALERT DIGESTS ---
+# Each user gets at most one message per run, so sends per run are bounded by the
+# number of users. A lone alert goes out as its own message; anything more is grouped
+# into one digest. With ALERT_DIGEST_ALWAYS=1 (or user_data["digest_always"]) even a lone
+# alert uses the digest format. Hits that do not fit in a digest (TG_LIMIT) are not
+# covered by it: they get no cooldown and fire again next run.
+DIGEST_ALWAYS = os.environ.get("ALERT_DIGEST_ALWAYS") == "1"
+TG_LIMIT = 4000  # Telegram caps messages at 4096 chars
+
+KIND_TITLES = {
+    "PRICE": "🚀 Big Moves",
+    "EXTENDED": "🌙 Extended Hours",
+    "RATING": "📢 Analyst Updates",
+    "TREND": "📈 Trend Changes",
+    "PICK": "🤖 AI Daily Picks",
+    "CUSTOM": "🎯 Your Rules",
+}
+
+def render_line(hit):
+    t = hit["ticker"]; kind = hit["kind"]
+    if kind == "RATING": return f"<b>{t}</b> {hit['prev_rating']} → {hit['rating']}"
+    if kind == "TREND": return f"<b>{t}</b> now {hit['trend']} (${hit['price']:.2f})"
+    if kind == "EXTENDED": return f"<b>{t}</b> ${hit['pp_price']:.2f} ({hit['pp']:+.2f}%)"
+    if kind == "CUSTOM": return f"<b>{t}</b> {render_condition(hit)} (${hit['price']:.2f}, {hit['change']:+.2f}%)"
+    return f"<b>{t}</b> ${hit['price']:.2f} ({hit['change']:+.2f}%)"
+
+def render_digest(hits):
+    """hits: list of fired rows for one user -> (one grouped message, the hits it shows)."""
+    msg = f"📬 <b>Penny Pulse: {len(hits)} alerts</b>"
+    shown = []
+    for kind, title in KIND_TITLES.items():
+        group = [h for h in hits if h["kind"] == kind]
+        if not group: continue
+        if kind == "PRICE": group.sort(key=lambda h: abs(h["change"]), reverse=True)
+        block = f"\n\n<b>{title}</b>"
+        for h in group:
+            line = "\n• " + render_line(h)
+            if len(msg) + len(block) + len(line) > TG_LIMIT - 40:
+                return msg + block + f"\n…and {len(hits) - len(shown)} more", shown
+            block += line
+            shown.append(h)
+        msg += block
+    return msg, shown
+
+def digest_always(prefs):
+    """The user's choice, else the server default. Older profiles stored digest_min (1 = always)."""
+    if "digest_always" in prefs: return bool(prefs["digest_always"])
+    if prefs.get("digest_min") is not None: return int(prefs["digest_min"]) <= 1
+    return DIGEST_ALWAYS
+
+def plan_messages(fired, user_map):
+    """
+    Groups fired alerts per user: one message each, a digest when there is more than one hit.
+    Returns [(chat_id, message, [hits covered])]; only covered hits should get cooldowns.
+    """
+    prefs_by_user = dict(user_map)
+    out = []
+    for user, group in fired.groupby("user", sort=False):
+        hits = [h for _, h in group.iterrows()]
+        chat_id = hits[0]["chat_id"]
+        if len(hits) == 1 and not digest_always(prefs_by_user.get(user, {})):
+            out.append((chat_id, render_message(hits[0]), hits))
+        else:
+            msg, shown = render_digest(hits)
+            out.append((chat_id, msg, shown))
+    return out
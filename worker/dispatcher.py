@@ -0,0 +1,63 @@
+import argparse
+import os
+import socket
+import time
+
+from worker.db import get_connection
+from worker.notifier import send_telegram_html
+from worker.outbox import claim_batch, mark_sent, mark_retry
+from worker.migrations import migrate
+
+# --- OUTBOX DISPATCHER ---
+# Separate process: drains alert_outbox in batches so data refreshes never block on Telegram.
+BATCH_SIZE = int(os.environ.get("DISPATCH_BATCH") or 25)
+MAX_ATTEMPTS = int(os.environ.get("DISPATCH_MAX_ATTEMPTS") or 5)
+POLL_SECONDS = int(os.environ.get("DISPATCH_POLL") or 5)
+SEND_GAP = 0.05  # stay well under Telegram's ~30 msg/s bot limit
+
+def dispatch_once(conn, owner):
+    """Claims and sends one batch. Returns how many messages were claimed."""
+    batch = claim_batch(conn, owner, BATCH_SIZE)
+    sent = []
+    for i, row in enumerate(batch):
+        ok, retry_after, error = send_telegram_html(row["chat_id"], row["message"])
+        if ok:
+            # Marked right away: if anything later in the batch fails, this row is not
+            # left in SENDING for claim_batch to reclaim and send a second time
+            mark_sent(conn, [row["id"]])
+            sent.append(row["id"])
+        else:
+            attempts = row["attempts"] + 1
+            delay = retry_after or min(3600, 30 * (2 ** row["attempts"]))
+            mark_retry(conn, row["id"], attempts, delay, error, MAX_ATTEMPTS)
+            print(f"⚠️ Outbox #{row['id']} attempt {attempts} failed: {error}")
+            if retry_after:
+                # Rate limited: put the rest of the batch back and stop hammering the API
+                for rest in batch[i + 1:]:
+                    mark_retry(conn, rest["id"], rest["attempts"], retry_after, "rate limited", MAX_ATTEMPTS + 1)
+                break
+        time.sleep(SEND_GAP)
+    if batch: print(f"📤 Dispatched {len(sent)}/{len(batch)}")
+    return len(batch)
+
+def run_dispatcher(loop=False):
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    conn = get_connection()
+    migrate(conn)
+    while True:
+        try:
+            if not conn.is_connected(): conn.reconnect(attempts=3, delay=2)
+            claimed = dispatch_once(conn, owner)
+        except Exception as e:
+            print(f"❌ Dispatcher error: {e}")
+            claimed = 0
+        if claimed == BATCH_SIZE: continue  # more waiting, keep draining
+        if not loop: break
+        time.sleep(POLL_SECONDS)
+    conn.close()
+
+# Run from the repo root: python -m worker.dispatcher [--loop]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Penny Pulse alert outbox dispatcher")
+    parser.add_argument("--loop", action="store_true", help="keep polling instead of draining once")
+    run_dispatcher(parser.parse_args().loop)
@@ -0,0 +1,214 @@
+import argparse
+import os
+from datetime import date, datetime, timedelta
+
+from worker.metrics import RunMetrics
+
+# --- EARNINGS CALENDAR ---
+# Earnings events for the whole universe live in earnings_calendar, keyed by
+# (report_date, ticker) with real DATE values, instead of one tk.calendar call per
+# ticker per refresh. A daily job fills it:
+#
+#   1. Finnhub's bulk calendar (/calendar/earnings) for the next HORIZON_DAYS, one
+#      request for every US listing (FINNHUB_API_KEY)
+#   2. Yahoo per-ticker calendars, only for universe equities the bulk feed has no
+#      upcoming date for (TSX listings, no key), at most FALLBACK_MAX per run. Tickers
+#      whose Yahoo rows are older than FALLBACK_TTL_DAYS (or missing) are looked up
+#      again, oldest first, and each lookup replaces that ticker's Yahoo rows, so a
+#      rescheduled report does not keep its stale date
+#   3. stock_cache.next_earnings labels ("Jan 29") for the universe, so cards and
+#      refresh writers agree on the string
+#
+# Refresh loops read next_dates() in one query and never call Yahoo for earnings.
+#
+#   python -m worker.earnings           # once per day (no-op if already ingested today)
+#   python -m worker.earnings --force
+HORIZON_DAYS = int(os.environ.get("EARNINGS_HORIZON_DAYS") or 90)
+FALLBACK_MAX = int(os.environ.get("EARNINGS_FALLBACK_MAX") or 40)
+FALLBACK_TTL_DAYS = int(os.environ.get("EARNINGS_FALLBACK_TTL_DAYS") or 3)
+FINNHUB_URL = "https://finnhub.io/api/v1/calendar/earnings"
+
+EARNINGS_DDL = """
+CREATE TABLE IF NOT EXISTS earnings_calendar (
+    report_date DATE NOT NULL,
+    ticker VARCHAR(20) NOT NULL,
+    hour VARCHAR(8),
+    eps_estimate DECIMAL(12, 4),
+    source VARCHAR(16) NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (report_date, ticker),
+    KEY idx_earnings_ticker (ticker, report_date)
+)
+"""
+EARNINGS_RUNS_DDL = """
+CREATE TABLE IF NOT EXISTS earnings_runs (
+    run_date DATE PRIMARY KEY,
+    events INT,
+    finished_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+INSERT_SQL = """INSERT INTO earnings_calendar (report_date, ticker, hour, eps_estimate, source) VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE hour=VALUES(hour), eps_estimate=VALUES(eps_estimate), source=VALUES(source)"""
+
+def label(d):
+    """DATE -> the display string stored in stock_cache.next_earnings."""
+    return d.strftime('%b %d') if d else "N/A"
+
+# --- LOOKUPS ---
+def next_dates(cursor, tickers, source=None):
+    """{ticker: next report date} from today on (optionally from one source only), one indexed query."""
+    tickers = list(tickers)
+    if not tickers: return {}
+    fmt = ",".join(["%s"] * len(tickers))
+    by_source = " AND source = %s" if source else ""
+    cursor.execute(
+        f"SELECT ticker, MIN(report_date) AS next_date FROM earnings_calendar WHERE ticker IN ({fmt}) AND report_date >= CURDATE(){by_source} GROUP BY ticker",
+        tuple(tickers) + ((source,) if source else ()),
+    )
+    return {r["ticker"]: _as_date(r["next_date"]) for r in cursor.fetchall()}
+
+def between(cursor, start, end, tickers=None):
+    """Events with start <= report_date <= end (optionally only `tickers`), by date."""
+    sql, params = "SELECT report_date, ticker, hour, eps_estimate FROM earnings_calendar WHERE report_date >= %s AND report_date <= %s", [start, end]
+    if tickers is not None:
+        tickers = list(tickers)
+        if not tickers: return []
+        sql += f" AND ticker IN ({','.join(['%s'] * len(tickers))})"
+        params += tickers
+    cursor.execute(sql + " ORDER BY report_date, ticker", tuple(params))
+    return [dict(r, report_date=_as_date(r["report_date"])) for r in cursor.fetchall()]
+
+def this_week(cursor, tickers=None, today=None):
+    """Events from today through the coming Sunday."""
+    today = today or date.today()
+    return between(cursor, today, today + timedelta(days=6 - today.weekday()), tickers)
+
+def _as_date(v):
+    if isinstance(v, datetime): return v.date()
+    if isinstance(v, str): return date.fromisoformat(v[:10])
+    return v
+
+# --- INGESTION ---
+def fetch_finnhub(fh_key, start, end, m):
+    """Every US earnings event in [start, end] from Finnhub's bulk calendar."""
+    import requests
+    with m.stage("finnhub"):
+        r = requests.get(FINNHUB_URL, params={"from": start.isoformat(), "to": end.isoformat(), "token": fh_key}, timeout=30)
+        r.raise_for_status()
+        events = r.json().get("earningsCalendar") or []
+    rows = [(e["date"], e["symbol"].upper(), e.get("hour") or None, e.get("epsEstimate"), "finnhub") for e in events if e.get("date") and e.get("symbol")]
+    m.incr("finnhub_events", len(rows))
+    return rows
+
+def fetch_yahoo(tickers, m):
+    """Per-ticker fallback (tk.calendar) for symbols the bulk feed does not cover. Returns (rows, tickers looked up)."""
+    import yfinance as yf
+    rows, looked_up, today = [], [], date.today()
+    for t in tickers:
+        try:
+            with m.stage("yahoo"):
+                cal = yf.Ticker(t).calendar
+            dates = []
+            if isinstance(cal, dict): dates = cal.get('Earnings Date') or []
+            elif hasattr(cal, 'iloc') and not cal.empty: dates = [v for v in cal.values.flatten() if isinstance(v, (date, datetime))]
+            dates = sorted({_as_date(d) for d in dates if _as_date(d) >= today})
+            rows += [(d.isoformat(), t, None, None, "yahoo") for d in dates]
+            looked_up.append(t)
+            m.incr("yahoo_lookups")
+        except Exception:
+            m.incr("yahoo_errors")
+    return rows, looked_up
+
+def fallback_due(cursor, tickers, limit):
+    """
+    Up to `limit` of `tickers` whose Yahoo rows are missing or older than FALLBACK_TTL_DAYS.
+    Half the slots go to the stalest rows, the rest to tickers with no row (rotated daily,
+    since a ticker Yahoo has no date for stays rowless and would otherwise hog the cap).
+    """
+    tickers = list(tickers)
+    if not tickers or limit <= 0: return []
+    fmt = ",".join(["%s"] * len(tickers))
+    cursor.execute(f"SELECT ticker, MAX(updated_at) AS fetched FROM earnings_calendar WHERE source = 'yahoo' AND ticker IN ({fmt}) GROUP BY ticker", tuple(tickers))
+    fetched = {r["ticker"]: r["fetched"] for r in cursor.fetchall() if r.get("fetched")}
+    cutoff = datetime.now() - timedelta(days=FALLBACK_TTL_DAYS)
+    stale = sorted((t for t in tickers if t in fetched and fetched[t] < cutoff), key=fetched.get)
+    rowless = [t for t in tickers if t not in fetched]
+    if rowless:
+        k = date.today().toordinal() % len(rowless)
+        rowless = rowless[k:] + rowless[:k]
+    picked = stale[:limit // 2]
+    picked += rowless[:limit - len(picked)]
+    return picked + stale[limit // 2:][:limit - len(picked)]
+
+def _equities(tickers):
+    from worker.markets import venue_for
+    return [t for t in tickers if venue_for(t) in ("US", "TSX")]
+
+def already_ingested(cursor):
+    cursor.execute("SELECT run_date FROM earnings_runs WHERE run_date = CURDATE()")
+    return bool(cursor.fetchall())
+
+def ingest(conn, tickers, fh_key=None, m=None):
+    """Refreshes the calendar for the next HORIZON_DAYS and the universe's next_earnings labels."""
+    m = m or RunMetrics("earnings_ingest")
+    cursor = conn.cursor(dictionary=True)
+    start, end = date.today(), date.today() + timedelta(days=HORIZON_DAYS)
+
+    rows = []
+    if fh_key:
+        try:
+            rows = fetch_finnhub(fh_key, start, end, m)
+            # Rescheduled reports: drop the window's old bulk rows before writing the new ones
+            with m.stage("db_write"):
+                cursor.execute("DELETE FROM earnings_calendar WHERE source = 'finnhub' AND report_date >= %s AND report_date <= %s", (start, end))
+                for i in range(0, len(rows), 1000): cursor.executemany(INSERT_SQL, rows[i:i + 1000])
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            m.incr("finnhub_errors")
+            print(f"⚠️ Finnhub earnings calendar failed: {e}")
+
+    covered = next_dates(cursor, tickers, source="finnhub")
+    missing = fallback_due(cursor, [t for t in _equities(tickers) if t not in covered], FALLBACK_MAX)
+    if missing:
+        fallback, looked_up = fetch_yahoo(missing, m)
+        with m.stage("db_write"):
+            # A lookup replaces the ticker's Yahoo rows (a failed one keeps them)
+            if looked_up:
+                fmt = ",".join(["%s"] * len(looked_up))
+                cursor.execute(f"DELETE FROM earnings_calendar WHERE source = 'yahoo' AND ticker IN ({fmt})", tuple(looked_up))
+            if fallback: cursor.executemany(INSERT_SQL, fallback)
+            conn.commit()
+
+    with m.stage("db_write"):
+        upcoming = next_dates(cursor, tickers)
+        cursor.executemany("UPDATE stock_cache SET next_earnings = %s WHERE ticker = %s", [(label(upcoming.get(t)), t) for t in tickers])
+        cursor.execute("INSERT INTO earnings_runs (run_date, events) VALUES (CURDATE(), %s) ON DUPLICATE KEY UPDATE events=VALUES(events), finished_at=NOW()", (len(rows),))
+        conn.commit()
+    m.incr("tickers_with_dates", len(upcoming))
+    cursor.close()
+    return upcoming
+
+# Run from the repo root: python -m worker.earnings [--force]
+if __name__ == "__main__":
+    from worker.alert_worker import get_db, load_universe
+    from worker import blocklist
+    from worker.migrations import migrate
+    ap = argparse.ArgumentParser(description="Bulk earnings-calendar ingestion")
+    ap.add_argument("--force", action="store_true", help="ingest even if it already ran today")
+    args = ap.parse_args()
+    conn = get_db()
+    migrate(conn)
+    m = RunMetrics("earnings_ingest")
+    cursor = conn.cursor(dictionary=True)
+    if not args.force and already_ingested(cursor):
+        print("📅 Earnings calendar already ingested today.")
+    else:
+        tickers, _, _ = load_universe(cursor, m)
+        tickers = blocklist.screen(cursor, tickers, m)[0]
+        upcoming = ingest(conn, tickers, os.environ.get("FINNHUB_API_KEY"), m)
+        print(f"📅 Earnings calendar: {len(upcoming)}/{len(tickers)} universe tickers have an upcoming date.")
+        m.finish()
+    cursor.close()
+    conn.close()
@@ -0,0 +1,89 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+# --- GLOBAL_CONFIG CACHE ---
+# The shared settings blob (user_profiles row 'GLOBAL_CONFIG') is parsed once per
+# process and versioned by its data_hash column (md5 of the JSON, written on save).
+# Readers re-check the hash at most every CHECK_SECONDS; the blob itself is only
+# re-read when the hash moved, i.e. when another process saved. save() updates this
+# process's copy directly, so the saving process never waits for a check.
+CHECK_SECONDS = int(os.environ.get("CONFIG_CHECK_SECONDS") or 10)
+
+DEFAULT = {"portfolio": {}, "openai_key": "", "rss_feeds": ["https://finance.yahoo.com/news/rssindex"], "tape_input": "^DJI, ^IXIC, ^GSPTSE, GC=F"}
+LEGACY = "legacy"   # version of a row saved before data_hash existed
+
+_state = {"version": None, "data": None, "checked": 0.0}
+_lock = threading.Lock()
+
+def config_hash(j_str):
+    return hashlib.md5(j_str.encode()).hexdigest()
+
+def _read_version(cursor):
+    cursor.execute("SELECT data_hash FROM user_profiles WHERE username = 'GLOBAL_CONFIG'")
+    row = cursor.fetchone()
+    if not row: return None
+    return (row["data_hash"] if isinstance(row, dict) else row[0]) or LEGACY
+
+def _read_blob(cursor):
+    cursor.execute("SELECT user_data, data_hash FROM user_profiles WHERE username = 'GLOBAL_CONFIG'")
+    row = cursor.fetchone()
+    if not row: return None, copy.deepcopy(DEFAULT)
+    blob, version = (row["user_data"], row["data_hash"]) if isinstance(row, dict) else row
+    return version or LEGACY, json.loads(blob) if blob else {}
+
+def current(get_connection):
+    """
+    (version, config) for this process. The dict is shared: copy it before mutating
+    (see snapshot()). Costs nothing between checks, one indexed lookup per check.
+    """
+    now = time.monotonic()
+    if _state["data"] is not None and now - _state["checked"] < CHECK_SECONDS:
+        return _state["version"], _state["data"]
+    with _lock:
+        if _state["data"] is not None and now - _state["checked"] < CHECK_SECONDS:
+            return _state["version"], _state["data"]
+        try:
+            conn = get_connection(); cursor = conn.cursor()
+            try:
+                if _state["data"] is None or _read_version(cursor) != _state["version"]:
+                    _state["version"], _state["data"] = _read_blob(cursor)
+            finally: conn.close()
+        except Exception:
+            if _state["data"] is None: return None, {}  # keep serving the last good copy on DB errors
+        _state["checked"] = now
+        return _state["version"], _state["data"]
+
+def snapshot(get_connection):
+    """(version, private deep copy) for callers that edit the config in place."""
+    version, data = current(get_connection)
+    return version, copy.deepcopy(data)
+
+def save(get_connection, data):
+    """Writes the blob and its hash, and updates this process's copy. Returns the new version."""
+    j_str = json.dumps(data)
+    version = config_hash(j_str)
+    conn = get_connection(); cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO user_profiles (username, user_data, data_hash) VALUES ('GLOBAL_CONFIG', %s, %s) ON DUPLICATE KEY UPDATE user_data = VALUES(user_data), data_hash = VALUES(data_hash)",
+            (j_str, version),
+        )
+        conn.commit()
+    finally: conn.close()
+    with _lock:
+        _state.update(version=version, data=json.loads(j_str), checked=time.monotonic())
+    return version
+
+def invalidate():
+    """Forces the next current() to check the version."""
+    _state["checked"] = 0.0
+
+def get_global_picks(get_connection):
+    """Portfolio tickers from the global config (the admin's My Picks)."""
+    port = current(get_connection)[1].get("portfolio") or {}
+    if not isinstance(port, dict): return []
+    return [k.strip().upper() for k in port if k and k.strip()]
@@ -0,0 +1,184 @@
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# --- TRADING CALENDAR ---
+# Session hours and holidays per symbol class, resolved from Yahoo's symbol conventions:
+#   TD.TO / XYZ.V   -> TSX / TSX Venture      09:30-16:00 Toronto, Canadian holidays
+#   ^GSPTSE         -> TSX index              same as TSX
+#   ^DJI, ^IXIC ... -> US index               09:30-16:00 New York, NYSE holidays
+#   NKE             -> US equity              04:00-20:00 New York (pre/post prices are shown)
+#   GC=F            -> CME Globex futures     Sun-Fri 18:00-17:00 New York, closed on NYSE holidays
+#   CADUSD=X        -> FX                     Sun 17:00 - Fri 17:00 New York
+#   BTC-USD         -> crypto                 always open
+#
+# needs_refresh() is the one staleness rule for stock_cache writers: open markets go
+# stale after `ttl` seconds; closed markets are refreshed once, CLOSE_GRACE after the
+# close (so the official close is captured), and then skipped until they reopen.
+#
+# checked_at / last_updated come from MySQL NOW(), i.e. naive values in the *DB server's*
+# time zone, which need not match the host reading them (GitHub runners and the Streamlit
+# host run in UTC). db_timezone() reads the server's current UTC offset so those values
+# are interpreted correctly.
+CLOSE_GRACE = timedelta(minutes=10)
+DB_TZ_SECONDS = 600  # how long a read server offset is reused (DST changes it twice a year)
+
+NY = ZoneInfo("America/New_York")
+TORONTO = ZoneInfo("America/Toronto")
+
+TSX_SUFFIXES = (".TO", ".V", ".CN", ".NE")
+TSX_INDICES = {"^GSPTSE", "^TX60", "^SPTSX"}
+CRYPTO_SUFFIXES = ("-USD", "-CAD", "-USDT", "-EUR")
+
+def venue_for(symbol):
+    s = symbol.upper()
+    if s.endswith(TSX_SUFFIXES) or s in TSX_INDICES: return "TSX"
+    if s.startswith("^"): return "US_INDEX"
+    if s.endswith("=F"): return "FUTURES"
+    if s.endswith("=X"): return "FX"
+    if s.endswith(CRYPTO_SUFFIXES): return "CRYPTO"
+    return "US"
+
+# --- HOLIDAYS ---
+def _easter(year):
+    """Anonymous Gregorian algorithm."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    return date(year, month, (h + l - 7 * m + 114) % 31 + 1)
+
+def _nth_weekday(year, month, weekday, n):
+    """n-th `weekday` (Mon=0) of the month; n=-1 for the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+def _observed(d, saturday_to_friday=True):
+    if d.weekday() == 5: return d - timedelta(days=1) if saturday_to_friday else d + timedelta(days=2)
+    if d.weekday() == 6: return d + timedelta(days=1)
+    return d
+
+@lru_cache(maxsize=None)
+def us_holidays(year):
+    good_friday = _easter(year) - timedelta(days=2)
+    days = {
+        _nth_weekday(year, 1, 0, 3), _nth_weekday(year, 2, 0, 3), good_friday,
+        _nth_weekday(year, 5, 0, -1), _observed(date(year, 7, 4)), _nth_weekday(year, 9, 0, 1),
+        _nth_weekday(year, 11, 3, 4), _observed(date(year, 12, 25)),
+    }
+    if date(year, 1, 1).weekday() != 5: days.add(_observed(date(year, 1, 1)))  # NYSE skips a Saturday New Year
+    if year >= 2022: days.add(_observed(date(year, 6, 19)))
+    return frozenset(days)
+
+@lru_cache(maxsize=None)
+def tsx_holidays(year):
+    victoria = date(year, 5, 24) - timedelta(days=date(year, 5, 24).weekday())  # Monday on or before May 24
+    # Christmas / Boxing Day roll forward past the weekend together
+    christmas, boxing = {5: (27, 28), 6: (26, 27), 4: (25, 28)}.get(date(year, 12, 25).weekday(), (25, 26))
+    christmas, boxing = date(year, 12, christmas), date(year, 12, boxing)
+    return frozenset({
+        _observed(date(year, 1, 1), saturday_to_friday=False), _nth_weekday(year, 2, 0, 3),
+        _easter(year) - timedelta(days=2), victoria, _observed(date(year, 7, 1), saturday_to_friday=False),
+        _nth_weekday(year, 8, 0, 1), _nth_weekday(year, 9, 0, 1), _nth_weekday(year, 10, 0, 2),
+        christmas, boxing,
+    })
+
+# --- SESSIONS ---
+def _day_session(d, tz, start, end, holidays):
+    if d.weekday() > 4 or d in holidays(d.year): return None
+    return datetime.combine(d, start, tz), datetime.combine(d, end, tz)
+
+def session_on(venue, d):
+    """(open, close) of the session that *closes* on local date `d`, or None."""
+    if venue == "TSX": return _day_session(d, TORONTO, dtime(9, 30), dtime(16, 0), tsx_holidays)
+    if venue == "US_INDEX": return _day_session(d, NY, dtime(9, 30), dtime(16, 0), us_holidays)
+    if venue == "US": return _day_session(d, NY, dtime(4, 0), dtime(20, 0), us_holidays)
+    if venue == "FUTURES":
+        if d.weekday() > 4 or d in us_holidays(d.year): return None
+        return datetime.combine(d - timedelta(days=1), dtime(18, 0), NY), datetime.combine(d, dtime(17, 0), NY)
+    if venue == "FX":
+        if d.weekday() > 4: return None
+        start = datetime.combine(d - timedelta(days=3 if d.weekday() == 0 else 1), dtime(17, 0), NY)
+        return start, datetime.combine(d, dtime(17, 0), NY)
+    return None
+
+_DB_TZ = {"tz": None, "at": 0.0}
+
+def db_timezone(cursor):
+    """The DB server's current UTC offset as a tzinfo (for naive NOW() values). None if unreadable."""
+    import time
+    if _DB_TZ["tz"] is not None and time.time() - _DB_TZ["at"] < DB_TZ_SECONDS: return _DB_TZ["tz"]
+    try:
+        cursor.execute("SELECT TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), NOW()) AS tz_offset")
+        row = cursor.fetchone()
+        offset = row["tz_offset"] if isinstance(row, dict) else row[0]
+        # NOW() and UTC_TIMESTAMP() can straddle a second boundary: round to the minute
+        tz = timezone(timedelta(minutes=round(int(offset) / 60)))
+    except Exception:
+        return None
+    _DB_TZ.update(tz=tz, at=time.time())
+    return tz
+
+def _aware(ts, tz=None):
+    """Naive values are in `tz` (the DB server's zone, see db_timezone), else this host's local time."""
+    if ts is None or ts.tzinfo is not None: return ts
+    return ts.replace(tzinfo=tz) if tz else ts.astimezone()
+
+def is_open(symbol, now=None):
+    venue = venue_for(symbol)
+    if venue == "CRYPTO": return True
+    now = _aware(now) or datetime.now().astimezone()
+    tz = TORONTO if venue == "TSX" else NY
+    local = now.astimezone(tz).date()
+    for d in (local, local + timedelta(days=1)):
+        s = session_on(venue, d)
+        if s and s[0] <= now < s[1]: return True
+    return False
+
+def last_close(symbol, now=None):
+    """Most recent session close at or before `now` (None for 24/7 markets)."""
+    venue = venue_for(symbol)
+    if venue == "CRYPTO": return None
+    now = _aware(now) or datetime.now().astimezone()
+    tz = TORONTO if venue == "TSX" else NY
+    local = now.astimezone(tz).date()
+    for back in range(0, 15):
+        s = session_on(venue, local - timedelta(days=back))
+        if s and s[1] <= now: return s[1]
+    return None
+
+def needs_refresh(symbol, checked_at, now=None, ttl=120, db_tz=None):
+    """
+    Staleness for one symbol. `checked_at` is when the row was last fetched (naive
+    values are in `db_tz`, from db_timezone()). Open: stale after `ttl` seconds. Closed:
+    stale only until one fetch has landed CLOSE_GRACE after the last close.
+    """
+    if checked_at is None: return True
+    now = _aware(now) or datetime.now().astimezone()
+    checked = _aware(checked_at, db_tz)
+    if is_open(symbol, now): return (now - checked).total_seconds() > ttl
+    close = last_close(symbol, now)
+    if close is None: return (now - checked).total_seconds() > ttl
+    settled = close + CLOSE_GRACE
+    if now < settled: return (now - checked).total_seconds() > ttl  # still settling after the bell
+    return checked < settled
+
+def stale_tickers(cursor, tickers, ttl=0, m=None):
+    """Filters `tickers` down to the ones needing a fetch, with one stock_cache query."""
+    tickers = list(tickers)
+    if not tickers: return tickers
+    fmt = ",".join(["%s"] * len(tickers))
+    cursor.execute(f"SELECT ticker, last_updated, checked_at FROM stock_cache WHERE ticker IN ({fmt})", tuple(tickers))
+    checked = {r["ticker"]: r.get("checked_at") or r.get("last_updated") for r in cursor.fetchall()}
+    now, db_tz = datetime.now().astimezone(), db_timezone(cursor)
+    out = [t for t in tickers if needs_refresh(t, checked.get(t), now, ttl, db_tz)]
+    if m: m.incr("closed_skipped", len(tickers) - len(out))
+    return out
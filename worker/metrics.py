@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# One JSON line per run is appended here
+METRICS_FILE = os.environ.get("WORKER_METRICS_FILE") or "worker_metrics.jsonl"
+# Optional: Prometheus textfile (point node_exporter's textfile collector at it to scrape)
+METRICS_PROM = os.environ.get("WORKER_METRICS_PROM")
+
+
+class RunMetrics:
+    """
+    Per-run stage timings and counters for a refresh job.
+
+        m = RunMetrics("update_stock_cache")
+        with m.stage("download"): ...
+        m.incr("fetched")
+        m.finish()
+
+    Stages can be entered many times (e.g. once per ticker); their time adds up.
+    Safe to share between threads.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.started = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - t) * 1000
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def gauge(self, key, value):
+        """Point-in-time value (last write wins), e.g. a controller's current batch size."""
+        with self._lock:
+            self.gauges[key] = value
+
+    def track(self, conn):
+        """Wraps a DB connection so every execute/commit counts as a round-trip."""
+        return _TrackedConnection(conn, self)
+
+    def summary(self):
+        s = {
+            "job": self.job,
+            "started_utc": self.started.strftime("%Y-%m-%d %H:%M:%S"),
+            "duration_ms": round((time.perf_counter() - self._t0) * 1000, 1),
+            "stages_ms": {k: round(v, 1) for k, v in self.stages.items()},
+            "counts": dict(self.counts),
+        }
+        if self.gauges: s["gauges"] = dict(self.gauges)
+        return s
+
+    def finish(self, ok=True):
+        """Prints and appends the summary. ok=False (an aborted run) leaves last_success alone."""
+        s = self.summary()
+        slowest = max(s["stages_ms"].items(), key=lambda kv: kv[1])[0] if s["stages_ms"] else "-"
+        print(f"📈 {self.job}: {s['duration_ms']:,.0f}ms (slowest stage: {slowest}) | {s['counts']}")
+        try:
+            with open(METRICS_FILE, "a") as f:
+                f.write(json.dumps(s) + "\n")
+        except Exception as e:
+            print(f"Metrics write error: {e}")
+        if METRICS_PROM:
+            write_prom(s, ok)
+        return s
+
+
+def write_prom(s, ok=True):
+    """Rewrites the Prometheus textfile with the latest run of each job (atomic rename)."""
+    try:
+        existing = {}
+        if os.path.exists(METRICS_PROM):
+            with open(METRICS_PROM) as f:
+                for line in f:
+                    if line.startswith("#") or not line.strip(): continue
+                    existing[line.rsplit(" ", 1)[0]] = line.rsplit(" ", 1)[1].strip()
+
+        job = s["job"]
+        existing[f'pennypulse_run_duration_ms{{job="{job}"}}'] = s["duration_ms"]
+        if ok: existing[f'pennypulse_run_last_success{{job="{job}"}}'] = int(time.time())
+        for k, v in s["stages_ms"].items():
+            existing[f'pennypulse_stage_duration_ms{{job="{job}",stage="{k}"}}'] = v
+        for k, v in s["counts"].items():
+            existing[f'pennypulse_run_count{{job="{job}",counter="{k}"}}'] = v
+        for k, v in s.get("gauges", {}).items():
+            existing[f'pennypulse_gauge{{job="{job}",name="{k}"}}'] = v
+
+        tmp = METRICS_PROM + ".tmp"
+        with open(tmp, "w") as f:
+            for k in sorted(existing):
+                f.write(f"{k} {existing[k]}\n")
+        os.replace(tmp, METRICS_PROM)
+    except Exception as e:
+        print(f"Prometheus write error: {e}")
+
+
+class _TrackedCursor:
+    def __init__(self, cursor, metrics):
+        self._cur = cursor
+        self._m = metrics
+
+    def execute(self, *args, **kwargs):
+        self._m.incr("db_roundtrips")
+        return self._cur.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._m.incr("db_roundtrips")
+        return self._cur.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class _TrackedConnection:
+    def __init__(self, conn, metrics):
+        self.raw = conn
+        self._m = metrics
+
+    def cursor(self, *args, **kwargs):
+        return _TrackedCursor(self.raw.cursor(*args, **kwargs), self._m)
+
+    def commit(self):
+        self._m.incr("db_roundtrips")
+        return self.raw.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
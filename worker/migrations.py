@@ -0,0 +1,149 @@
+from worker.changes import CHANGE_COLUMNS, WRITER_HASH_COLUMNS
+from worker.outbox import OUTBOX_DDL
+from worker.shards import LEASE_DDL
+from worker.scanner import SCAN_RUNS_DDL, BRIEFING_COLUMNS
+from worker.blocklist import BLOCKLIST_DDL
+from worker.earnings import EARNINGS_DDL, EARNINGS_RUNS_DDL
+from worker.screener import DAILY_BARS_DDL
+
+# --- SCHEMA MIGRATIONS ---
+# Ordered, numbered steps recorded in schema_version and applied exactly once, under a
+# MySQL named lock so the app, the worker and a deploy step can all call migrate()
+# at startup without racing. Steps are idempotent (IF NOT EXISTS / information_schema
+# checks) so a database created by the old per-rerun init_db adopts them cleanly.
+# Add new steps at the end; never edit or renumber an applied one.
+#
+#   python -m worker.migrations        # at deploy
+LOCK_NAME = "pennypulse_schema"
+LOCK_TIMEOUT = 60
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+def add_column(cursor, table, column, dtype):
+    cursor.execute("SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+    if not cursor.fetchall(): cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {dtype}")
+
+def add_index(cursor, table, name, columns, unique=False):
+    """Adds `name` unless some index already starts with the same leading column."""
+    cursor.execute("SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND (INDEX_NAME = %s OR (SEQ_IN_INDEX = 1 AND COLUMN_NAME = %s))", (table, name, columns[0]))
+    if not cursor.fetchall(): cursor.execute(f"ALTER TABLE {table} ADD {'UNIQUE ' if unique else ''}INDEX {name} ({', '.join(columns)})")
+
+def _core_tables(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS user_profiles (username VARCHAR(255) PRIMARY KEY, user_data TEXT, pin VARCHAR(50))")
+    cursor.execute("CREATE TABLE IF NOT EXISTS user_sessions (token VARCHAR(255) PRIMARY KEY, username VARCHAR(255), created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_cache (
+            ticker VARCHAR(20) PRIMARY KEY,
+            current_price DECIMAL(20, 4),
+            day_change DECIMAL(10, 2),
+            rsi DECIMAL(10, 2),
+            volume_status VARCHAR(20),
+            trend_status VARCHAR(20),
+            rating VARCHAR(50),
+            next_earnings VARCHAR(20),
+            pre_post_price DECIMAL(20, 4),
+            pre_post_pct DECIMAL(10, 2),
+            price_history JSON,
+            company_name VARCHAR(255),
+            day_high DECIMAL(20, 4),
+            day_low DECIMAL(20, 4),
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE TABLE IF NOT EXISTS daily_briefing (date DATE PRIMARY KEY, picks JSON, sent TINYINT DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alert_log (
+            user_id VARCHAR(255) NOT NULL,
+            ticker VARCHAR(20) NOT NULL,
+            alert_type VARCHAR(64) NOT NULL,
+            last_sent DATETIME,
+            PRIMARY KEY (user_id, ticker, alert_type)
+        )
+    """)
+
+def _late_columns(cursor):
+    """Columns older databases gained one by one through init_db's ALTER loop."""
+    for col, dtype in [("day_high", "DECIMAL(20,4)"), ("day_low", "DECIMAL(20,4)"), ("company_name", "VARCHAR(255)"),
+                       ("pre_post_price", "DECIMAL(20,4)"), ("pre_post_pct", "DECIMAL(10,2)"), ("price_history", "JSON"),
+                       ("rating", "VARCHAR(255)"), ("next_earnings", "VARCHAR(255)")]:
+        add_column(cursor, "stock_cache", col, dtype)
+    add_column(cursor, "daily_briefing", "sent", "TINYINT DEFAULT 0")
+
+def _change_columns(cursor):
+    for col, dtype in CHANGE_COLUMNS: add_column(cursor, "stock_cache", col, dtype)
+
+def _scanner(cursor):
+    cursor.execute(SCAN_RUNS_DDL)
+    for col, dtype in BRIEFING_COLUMNS: add_column(cursor, "daily_briefing", col, dtype)
+
+def _indexes(cursor):
+    add_index(cursor, "alert_log", "idx_alert_user", ["user_id", "ticker", "alert_type"])   # cooldown lookups by user
+    add_index(cursor, "user_sessions", "idx_sessions_user", ["username"])                   # logout / re-login deletes
+    add_index(cursor, "daily_briefing", "idx_briefing_sent", ["sent", "date"])              # unsent-picks lookups
+    add_index(cursor, "stock_cache", "idx_stock_updated", ["last_updated"])                 # mirror delta sync
+
+def _earnings(cursor):
+    cursor.execute(EARNINGS_DDL)
+    cursor.execute(EARNINGS_RUNS_DDL)
+
+MIGRATIONS = [
+    (1, "core tables", _core_tables),
+    (2, "stock_cache / daily_briefing late columns", _late_columns),
+    (3, "stock_cache change detection columns", _change_columns),
+    (4, "alert outbox", lambda c: c.execute(OUTBOX_DDL)),
+    (5, "worker shard leases", lambda c: c.execute(LEASE_DDL)),
+    (6, "scanner runs and briefing results", _scanner),
+    (7, "indexes for alert_log, user_sessions, daily_briefing, stock_cache", _indexes),
+    (8, "symbol blocklist (negative cache)", lambda c: c.execute(BLOCKLIST_DDL)),
+    (9, "user_profiles data_hash (global config version)", lambda c: add_column(c, "user_profiles", "data_hash", "CHAR(32)")),
+    (10, "earnings calendar", _earnings),
+    (11, "daily bars for the universe screener", lambda c: c.execute(DAILY_BARS_DDL)),
+    (12, "stock_cache per-writer change hashes", lambda c: [add_column(c, "stock_cache", col, dtype) for col, dtype in WRITER_HASH_COLUMNS]),
+]
+LATEST = MIGRATIONS[-1][0]
+
+def current_version(cursor):
+    cursor.execute(SCHEMA_VERSION_DDL)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return (row[0] if row else None) or 0
+
+def migrate(conn, verbose=False):
+    """Applies pending migrations once. Cheap (two queries) when the schema is current."""
+    cursor = conn.cursor()
+    if current_version(cursor) >= LATEST:
+        cursor.close()
+        return []
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        raise RuntimeError("Timed out waiting for the schema migration lock")
+    applied = []
+    try:
+        done = current_version(cursor)  # another process may have migrated while we waited
+        for version, description, step in MIGRATIONS:
+            if version <= done: continue
+            step(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description))
+            conn.commit()
+            applied.append(version)
+            if verbose: print(f"🧱 Migration {version}: {description}")
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchall()
+        cursor.close()
+    return applied
+
+# Run from the repo root: python -m worker.migrations
+if __name__ == "__main__":
+    from worker.db import get_connection
+    conn = get_connection()
+    applied = migrate(conn, verbose=True)
+    print(f"🏁 Schema at version {LATEST}" + (f" (applied {applied})" if applied else " (up to date)"))
+    conn.close()
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+# --- LOCAL STOCK_CACHE MIRROR ---
+# Dashboard reads go to an embedded SQLite copy of stock_cache instead of crossing
+# the WAN to MySQL. The mirror pulls only rows changed since its watermark
+# (WHERE last_updated >= :watermark), at most once every SYNC_SECONDS per process.
+# Tickers the mirror has never seen are read through from MySQL once and cached.
+MIRROR_PATH = os.environ.get("MIRROR_PATH") or "stock_cache_mirror.db"
+SYNC_SECONDS = int(os.environ.get("MIRROR_SYNC_SECONDS") or 15)
+
+COLUMNS = [
+    "ticker", "current_price", "day_change", "rsi", "volume_status", "trend_status", "rating",
+    "next_earnings", "pre_post_price", "pre_post_pct", "price_history", "company_name",
+    "day_high", "day_low", "last_updated",
+]
+MIRROR_DDL = f"""
+CREATE TABLE IF NOT EXISTS stock_cache (
+    ticker TEXT PRIMARY KEY,
+    {", ".join(f"{c} {'REAL' if c in ('current_price', 'day_change', 'rsi', 'pre_post_price', 'pre_post_pct', 'day_high', 'day_low') else 'TEXT'}" for c in COLUMNS[1:])}
+)
+"""
+
+_state = {"last_sync": 0.0, "watermark": None, "ready": False, "synced_once": False, "misses": {}}
+_write_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(MIRROR_PATH, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _init():
+    conn = _connect()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(MIRROR_DDL)
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state (k TEXT PRIMARY KEY, v TEXT)")
+    row = conn.execute("SELECT v FROM sync_state WHERE k='watermark'").fetchone()
+    conn.commit(); conn.close()
+    _state["watermark"] = row["v"] if row else None
+    _state["ready"] = True
+
+def _plain(v):
+    if isinstance(v, Decimal): return float(v)
+    if isinstance(v, datetime): return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, (bytes, bytearray)): return v.decode()
+    return v
+
+def _store(rows, watermark=None):
+    if not rows and watermark is None: return
+    with _write_lock:
+        conn = _connect()
+        placeholders = ",".join(["?"] * len(COLUMNS))
+        conn.executemany(
+            f"INSERT OR REPLACE INTO stock_cache ({','.join(COLUMNS)}) VALUES ({placeholders})",
+            [tuple(_plain(r.get(c)) for c in COLUMNS) for r in rows],
+        )
+        if watermark is not None:
+            conn.execute("INSERT OR REPLACE INTO sync_state (k, v) VALUES ('watermark', ?)", (watermark,))
+        conn.commit(); conn.close()
+
+def sync(get_connection):
+    """One delta query against MySQL; returns how many rows changed."""
+    if not _state["ready"]: _init()
+    remote = get_connection(); cursor = remote.cursor(dictionary=True)
+    cols = ",".join(COLUMNS)
+    if _state["watermark"]:
+        # >= so rows written in the same second as the last watermark are not missed
+        cursor.execute(f"SELECT {cols} FROM stock_cache WHERE last_updated >= %s", (_state["watermark"],))
+    else:
+        cursor.execute(f"SELECT {cols} FROM stock_cache")
+    rows = cursor.fetchall(); remote.close()
+    stamps = [_plain(r["last_updated"]) for r in rows if r.get("last_updated")]
+    watermark = max(stamps) if stamps else _state["watermark"]
+    _store(rows, watermark)
+    _state["watermark"] = watermark
+    _state["synced_once"] = True
+    _state["misses"] = {}
+    return len(rows)
+
+def ensure_fresh(get_connection):
+    """Syncs if the interval has passed. Only one thread syncs; the rest read the current mirror."""
+    if time.time() - _state["last_sync"] < SYNC_SECONDS: return
+    if not _sync_lock.acquire(blocking=not _state["synced_once"]): return
+    try:
+        if time.time() - _state["last_sync"] < SYNC_SECONDS: return
+        sync(get_connection)
+    except Exception as e:
+        print(f"Mirror sync error: {e}")
+    finally:
+        _state["last_sync"] = time.time()
+        _sync_lock.release()
+
+def expire():
+    """Next read syncs immediately (call after this process wrote to stock_cache)."""
+    _state["last_sync"] = 0.0
+
+def version():
+    """The mirror's current watermark; pass it back as read_rows(since=...) to get only newer rows."""
+    return _state["watermark"]
+
+def read_rows(tickers, get_connection, columns=None, since=None):
+    """
+    Rows for `tickers` as dicts (same keys as the MySQL columns).
+    Unknown tickers are read through from MySQL once per sync interval.
+    With `since`, only rows with last_updated >= since are returned (local query only).
+    """
+    if not tickers: return []
+    ensure_fresh(get_connection)
+    if not _state["ready"]: _init()
+    cols = columns or COLUMNS
+    fmt = ",".join(["?"] * len(tickers))
+    conn = _connect()
+    if since:
+        rows = [dict(r) for r in conn.execute(f"SELECT {','.join(cols)} FROM stock_cache WHERE ticker IN ({fmt}) AND last_updated >= ?", tuple(tickers) + (since,)).fetchall()]
+        conn.close()
+        return rows
+    rows = [dict(r) for r in conn.execute(f"SELECT {','.join(cols)} FROM stock_cache WHERE ticker IN ({fmt})", tuple(tickers)).fetchall()]
+    conn.close()
+
+    found = {r["ticker"] for r in rows}
+    now = time.time()
+    missing = [t for t in tickers if t not in found and now - _state["misses"].get(t, 0) > SYNC_SECONDS]
+    if missing:
+        try:
+            remote = get_connection(); cursor = remote.cursor(dictionary=True)
+            cursor.execute(f"SELECT {','.join(COLUMNS)} FROM stock_cache WHERE ticker IN ({','.join(['%s'] * len(missing))})", tuple(missing))
+            fetched = cursor.fetchall(); remote.close()
+            _store(fetched)
+            rows += [{c: _plain(r.get(c)) for c in cols} for r in fetched]
+            got = {r["ticker"] for r in fetched}
+            for t in missing:
+                if t not in got: _state["misses"][t] = now
+        except Exception as e:
+            print(f"Mirror read-through error: {e}")
+    return rows
@@ -1,9 +1,10 @@
 
+import os
 import requests
 
 # You will get this Token from the "BotFather" on Telegram (It takes 30 seconds)
 # For now, we can use a placeholder or an Environment Variable
-BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") 
+BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") or os.environ.get("TELEGRAM_TOKEN")
 
 def send_alert(chat_id, message):
     """Sends a push notification to a specific user via Telegram."""
@@ -22,3 +23,23 @@ def send_alert(chat_id, message):
         print(f"Sent to {chat_id}: {message}")
     except Exception as e:
         print(f"Failed to send: {e}")
+
+def send_telegram_html(chat_id, message):
+    """
+    HTML-formatted send used by the outbox dispatcher.
+    Returns (ok, retry_after_seconds, error) so failures can be retried instead of dropped.
+    """
+    if not chat_id or not BOT_TOKEN:
+        return False, None, "No Token/ID"
+    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    try:
+        r = requests.post(url, json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"}, timeout=10)
+        if r.status_code == 200:
+            return True, None, None
+        retry_after = None
+        if r.status_code == 429:
+            try: retry_after = int(r.json().get("parameters", {}).get("retry_after", 30))
+            except Exception: retry_after = 30
+        return False, retry_after, f"HTTP {r.status_code}: {r.text[:200]}"
+    except Exception as e:
+        return False, None, str(e)
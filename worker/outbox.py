@@ -0,0 +1,89 @@
+import hashlib
+import json
+from datetime import datetime
+
+# --- NOTIFICATION OUTBOX ---
+# Alert evaluation only INSERTs here (same transaction as the alert_log cooldown rows),
+# so a refresh never waits on Telegram. worker/dispatcher.py drains it in batches.
+#   PENDING -> SENDING (claimed) -> SENT
+#                               \-> PENDING again with backoff, or FAILED after MAX_ATTEMPTS
+OUTBOX_DDL = """
+CREATE TABLE IF NOT EXISTS alert_outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    dedupe_key CHAR(32) NOT NULL,
+    user_id VARCHAR(255) NOT NULL,
+    chat_id VARCHAR(64) NOT NULL,
+    message TEXT NOT NULL,
+    alert_keys JSON,
+    status VARCHAR(10) NOT NULL DEFAULT 'PENDING',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed_by VARCHAR(128),
+    claimed_at DATETIME,
+    sent_at DATETIME,
+    last_error VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_dedupe (dedupe_key),
+    KEY idx_status_due (status, next_attempt_at)
+)
+"""
+
+def _dedupe_key(user, hits):
+    """Same user + same alerts within the same hour = same message, even if two runs overlap."""
+    keys = sorted(f"{h['ticker']}|{h['alert_type']}" for h in hits)
+    raw = f"{user}|{datetime.now().strftime('%Y-%m-%d %H')}|{','.join(keys)}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+def enqueue(cursor, messages):
+    """
+    messages: [(chat_id, message, hits)] from digest.plan_messages.
+    One executemany; duplicates are ignored via dedupe_key. Caller commits.
+    """
+    rows = []
+    for chat_id, msg, hits in messages:
+        user = hits[0]["user"]
+        keys = [[h["ticker"], h["alert_type"]] for h in hits]
+        rows.append((_dedupe_key(user, hits), user, str(chat_id), msg, json.dumps(keys)))
+    if not rows: return 0
+    cursor.executemany(
+        "INSERT IGNORE INTO alert_outbox (dedupe_key, user_id, chat_id, message, alert_keys) VALUES (%s, %s, %s, %s, %s)",
+        rows,
+    )
+    return len(rows)
+
+def claim_batch(conn, owner, limit, stale_minutes=10):
+    """Atomically claims up to `limit` due messages for `owner` and returns them."""
+    cur = conn.cursor(dictionary=True)
+    # Rows left in SENDING by a dispatcher that died mid-batch go back to the queue
+    cur.execute(
+        "UPDATE alert_outbox SET status='PENDING', claimed_by=NULL WHERE status='SENDING' AND claimed_at < NOW() - INTERVAL %s MINUTE",
+        (stale_minutes,),
+    )
+    cur.execute(
+        "UPDATE alert_outbox SET status='SENDING', claimed_by=%s, claimed_at=NOW() "
+        "WHERE status='PENDING' AND next_attempt_at <= NOW() ORDER BY id LIMIT %s",
+        (owner, limit),
+    )
+    conn.commit()
+    cur.execute("SELECT id, chat_id, message, attempts FROM alert_outbox WHERE status='SENDING' AND claimed_by=%s ORDER BY id", (owner,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+def mark_sent(conn, ids):
+    if not ids: return
+    cur = conn.cursor()
+    fmt = ",".join(["%s"] * len(ids))
+    cur.execute(f"UPDATE alert_outbox SET status='SENT', sent_at=NOW(), claimed_by=NULL WHERE id IN ({fmt})", tuple(ids))
+    conn.commit()
+    cur.close()
+
+def mark_retry(conn, msg_id, attempts, delay_seconds, error, max_attempts):
+    cur = conn.cursor()
+    status = "FAILED" if attempts >= max_attempts else "PENDING"
+    cur.execute(
+        "UPDATE alert_outbox SET status=%s, attempts=%s, next_attempt_at=NOW() + INTERVAL %s SECOND, last_error=%s, claimed_by=NULL WHERE id=%s",
+        (status, attempts, int(delay_seconds), str(error)[:255], msg_id),
+    )
+    conn.commit()
+    cur.close()
@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# --- STAGED REFRESH PIPELINE ---
+# Runs items through a chain of stages joined by bounded asyncio queues, so downloads,
+# indicator math and DB writes overlap instead of taking turns: a cycle costs roughly
+# its slowest stage, not the sum. Each stage has its own worker count, and a full
+# queue pauses the stage feeding it (backpressure), so a slow writer never lets
+# downloaded frames pile up in memory.
+#
+#   records = run_pipeline(tickers, [
+#       Stage("download", fetch, workers=8),
+#       Stage("indicators", compute, workers=2),
+#       Stage("db_write", write, batch=25, linger=0.5),   # lists of up to 25 items
+#   ], m)
+#
+# Stage functions are ordinary blocking callables, run on one thread pool sized to
+# the total worker count; they time themselves with m.stage() as before. `items` may
+# be a generator (e.g. FetchController.run); it is advanced on the pool too. A stage
+# returning None drops the item; an exception drops it, counts "<stage>_errors" and
+# calls on_error(stage_name, item, exc). The last stage's results are returned
+# (a batched last stage's lists are flattened). A batched stage waits up to `linger`
+# seconds after its first item for the batch to fill; with linger=0 it only takes
+# what is already queued.
+
+class Stage:
+    def __init__(self, name, fn, workers=1, queue=None, batch=0, linger=0.0):
+        self.name, self.fn, self.workers, self.batch, self.linger = name, fn, workers, batch, linger
+        self.queue = queue or max(2, workers * 2)
+
+_DONE = object()
+
+async def _run(items, stages, m, on_error):
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=1 + sum(s.workers for s in stages), thread_name_prefix="pipeline")
+    queues = [asyncio.Queue(maxsize=s.queue) for s in stages]
+    results = []
+
+    async def feed():
+        it = iter(items)
+        try:
+            while True:
+                x = await loop.run_in_executor(pool, next, it, _DONE)
+                if x is _DONE: break
+                await queues[0].put(x)
+        except Exception as e:
+            m.incr("source_errors")
+            if on_error: on_error("source", None, e)
+        for _ in range(stages[0].workers): await queues[0].put(_DONE)
+
+    async def worker(i):
+        stage, q = stages[i], queues[i]
+        last = i + 1 == len(stages)
+        done = False
+        while not done:
+            x = await q.get()
+            if x is _DONE: break
+            if stage.batch:  # up to `batch` items, waiting at most `linger` for more
+                x = [x]
+                until = loop.time() + stage.linger
+                while len(x) < stage.batch:
+                    if not q.empty(): y = q.get_nowait()
+                    elif loop.time() >= until: break
+                    else:
+                        try: y = await asyncio.wait_for(q.get(), until - loop.time())
+                        except asyncio.TimeoutError: break
+                    if y is _DONE:
+                        done = True
+                        break
+                    x.append(y)
+            try:
+                y = await loop.run_in_executor(pool, stage.fn, x)
+            except Exception as e:
+                m.incr(f"{stage.name}_errors")
+                if on_error: on_error(stage.name, x, e)
+                continue
+            if y is None: continue
+            if not last: await queues[i + 1].put(y)
+            elif stage.batch: results.extend(y)
+            else: results.append(y)
+
+    async def run_stage(i):
+        await asyncio.gather(*(worker(i) for _ in range(stages[i].workers)))
+        if i + 1 < len(stages):
+            for _ in range(stages[i + 1].workers): await queues[i + 1].put(_DONE)
+
+    try:
+        await asyncio.gather(feed(), *(run_stage(i) for i in range(len(stages))))
+    finally:
+        pool.shutdown(wait=True)
+    return results
+
+def run_pipeline(items, stages, m, on_error=None):
+    """Blocking entry point (cron jobs and Streamlit reruns have no running loop)."""
+    return asyncio.run(_run(items, stages, m, on_error))
@@ -0,0 +1,60 @@
+# --- PORTFOLIO ANALYTICS ---
+# Values every position in one vectorized pass over the cached stock_cache arrays
+# (current price, day change and the price_history closes) - no extra downloads.
+# numpy is imported inside so app.py can import this module on the login page for free.
+
+def value_portfolio(port, quotes):
+    """
+    port:   {ticker: {"e": entry_price, "q": qty}}
+    quotes: {ticker: {"p": price, "hist": [daily closes, oldest first, the last one being the latest session]}}
+    Returns totals, per-position arrays and a daily equity curve (one point per cached close).
+    Positions without a quote are left out of the totals and listed in "missing".
+    """
+    import numpy as np
+    tickers = [t for t in port if t in quotes]
+    missing = [t for t in port if t not in quotes]
+    empty = {"value": 0.0, "cost": 0.0, "day_pl": 0.0, "day_pct": 0.0, "total_pl": 0.0, "total_pct": 0.0,
+             "tickers": [], "missing": missing, "position_value": [], "position_pl": [], "curve": []}
+    if not tickers: return empty
+
+    q = np.array([float(port[t]["q"]) for t in tickers])
+    e = np.array([float(port[t]["e"]) for t in tickers])
+    p = np.array([float(quotes[t]["p"]) for t in tickers])
+    hists = [quotes[t].get("hist") or [quotes[t]["p"]] for t in tickers]
+
+    # Previous close straight from the cached closes; a ticker without one has no day P/L
+    prev = np.array([float(h[-2]) if len(h) > 1 else p[i] for i, h in enumerate(hists)])
+    position_value = p * q
+    position_pl = (p - e) * q
+    value = position_value.sum()
+    cost = (e * q).sum()
+    day_pl = ((p - prev) * q).sum()
+    prev_value = value - day_pl
+
+    # Equity curve: right-align every history on a common session axis; tickers with shorter
+    # histories are back-filled with their oldest close so they don't appear as zero.
+    # price_history stores closes without dates, so this aligns by session count, not by
+    # date: around a holiday one venue observes and the other doesn't (TSX vs US), the
+    # points before it are off by one session for one side. Good enough for a 20-day sketch.
+    length = max(len(h) for h in hists)
+    closes = np.full((len(tickers), length), np.nan)
+    for i, h in enumerate(hists):
+        closes[i, length - len(h):] = h
+    first = np.array([h[0] for h in hists], dtype=float)
+    closes = np.where(np.isnan(closes), first[:, None], closes)
+    curve = (closes * q[:, None]).sum(axis=0)
+    curve[-1] = value  # last point is the live valuation
+
+    return {
+        "value": float(value),
+        "cost": float(cost),
+        "day_pl": float(day_pl),
+        "day_pct": float(day_pl / prev_value * 100) if prev_value > 0 else 0.0,
+        "total_pl": float(value - cost),
+        "total_pct": float((value - cost) / cost * 100) if cost > 0 else 0.0,
+        "tickers": tickers,
+        "missing": missing,
+        "position_value": position_value.tolist(),
+        "position_pl": position_pl.tolist(),
+        "curve": curve.tolist(),
+    }
@@ -1,8 +1,16 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
 
-import yfinance as yf
 from worker.db import get_connection, get_all_users, get_global_picks
+from worker.metrics import RunMetrics
+from worker import blocklist
+from worker.throttle import batch_misses, yf_download
+
+# Symbols per yf.download call, and how many chunks may be submitted at once
+CHUNK_SIZE = int(os.environ.get("PRICES_CHUNK_SIZE") or 100)
+CHUNK_CONCURRENCY = int(os.environ.get("PRICES_CHUNK_CONCURRENCY") or 2)
 
 def _safe_float(x):
     try:
@@ -30,51 +38,41 @@ def build_universe():
     # Optional: filter out weird empty tokens
     return sorted([t for t in tickers if len(t) <= 32])
 
-def upsert_market_cache(rows):
+def upsert_market_cache(rows, metrics=None, conn=None):
     """
     rows: list of dict {symbol, price, change_pct}
+    One bulk executemany per call. Pass `conn` to reuse a connection across chunks.
     """
-    conn = get_connection()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+        if metrics: conn = metrics.track(conn)
     cur = conn.cursor()
 
     now_utc = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     raw = json.dumps({"source": "yfinance", "ts_utc": now_utc})
 
-    for r in rows:
-        cur.execute(
-            """
-            INSERT INTO market_cache(symbol, price, change_pct, raw_json)
-            VALUES (%s,%s,%s,%s)
-            ON DUPLICATE KEY UPDATE
-              price=VALUES(price),
-              change_pct=VALUES(change_pct),
-              raw_json=VALUES(raw_json)
-            """,
-            (r["symbol"], r["price"], r["change_pct"], raw),
-        )
+    cur.executemany(
+        """
+        INSERT INTO market_cache(symbol, price, change_pct, raw_json)
+        VALUES (%s,%s,%s,%s)
+        ON DUPLICATE KEY UPDATE
+          price=VALUES(price),
+          change_pct=VALUES(change_pct),
+          raw_json=VALUES(raw_json)
+        """,
+        [(r["symbol"], r["price"], r["change_pct"], raw) for r in rows],
+    )
 
     conn.commit()
-    conn.close()
-
-def refresh_market_cache():
-    tickers = build_universe()
-    if not tickers:
-        print("No tickers found in user watchlists or global picks.")
-        return {"updated": 0, "skipped": 0, "tickers": 0}
+    cur.close()
+    if own_conn: conn.close()
 
-    # Bulk download (much better than per-symbol calls)
-    # Use 2d to compute % change from previous close
-    data = yf.download(
-        tickers=" ".join(tickers),
-        period="2d",
-        interval="1d",
-        group_by="ticker",
-        threads=True,
-        progress=False,
-    )
-
-    updated_rows = []
+def _extract_rows(data, tickers):
+    """Pulls {symbol, price, change_pct} out of a yf.download frame. Returns (rows, skipped, failed)."""
+    rows = []
     skipped = 0
+    failed = 0
     multiple = len(tickers) > 1
 
     for t in tickers:
@@ -100,15 +98,108 @@ def refresh_market_cache():
             if prev not in (None, 0):
                 chg_pct = ((last - prev) / prev) * 100.0
 
-            updated_rows.append({"symbol": t, "price": last, "change_pct": chg_pct})
+            rows.append({"symbol": t, "price": last, "change_pct": chg_pct})
         except Exception:
-            skipped += 1
+            failed += 1
+    return rows, skipped, failed
 
-    if updated_rows:
-        upsert_market_cache(updated_rows)
+def _fetch_chunk(chunk, m):
+    """Downloads one chunk, extracts its prices and drops the frame. Returns (rows, skipped, failed, errors)."""
+    # Use 2d to compute % change from previous close
+    with m.stage("download"):
+        data, errors = yf_download(
+            " ".join(chunk),
+            period="2d",
+            interval="1d",
+            group_by="ticker",
+            threads=True,
+            progress=False,
+        )
+    with m.stage("indicators"):
+        result = _extract_rows(data, chunk)
+    del data
+    return (*result, errors)
+
+def refresh_market_cache():
+    """
+    Streams the universe through yf.download CHUNK_SIZE symbols at a time, with at most
+    CHUNK_CONCURRENCY chunks submitted at once (downloads themselves run one at a time, see
+    throttle.yf_download; the others extract or wait). Each chunk is written as soon as it
+    lands, so peak memory depends on the chunk size, not the universe, and a bad chunk
+    only loses itself.
+    """
+    m = RunMetrics("refresh_market_cache")
+    with m.stage("universe"):
+        tickers = build_universe()
+    m.incr("tickers", len(tickers))
+    if not tickers:
+        print("No tickers found in user watchlists or global picks.")
+        m.finish()
+        return {"updated": 0, "skipped": 0, "tickers": 0}
+
+    conn = m.track(get_connection())
+    cur = conn.cursor(dictionary=True)
+    with m.stage("universe"):
+        fetchable, known_bad = blocklist.screen(cur, tickers, m)
+
+    chunks = [fetchable[i:i + CHUNK_SIZE] for i in range(0, len(fetchable), CHUNK_SIZE)]
+    updated = 0
+    skipped = 0
+    failed = 0
+    returned, misses = [], []
+
+    def completed(futures):
+        # Bounded window: a new chunk is submitted only when one finishes
+        pending = iter(chunks)
+        for c in pending:
+            futures[ex.submit(_fetch_chunk, c, m)] = c
+            if len(futures) >= CHUNK_CONCURRENCY: break
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut, futures.pop(fut)
+                nxt = next(pending, None)
+                if nxt is not None: futures[ex.submit(_fetch_chunk, nxt, m)] = nxt
+
+    with ThreadPoolExecutor(max_workers=CHUNK_CONCURRENCY) as ex:
+        for fut, chunk in completed({}):
+            try:
+                rows, chunk_skipped, chunk_failed, errors = fut.result()
+            except Exception as e:
+                print(f"Chunk of {len(chunk)} failed ({chunk[0]}..): {e}")
+                m.incr("failed_chunks")
+                failed += len(chunk)
+                continue
+            skipped += chunk_skipped
+            failed += chunk_failed
+            got = {r["symbol"] for r in rows}
+            returned.extend(got)
+            misses.extend(batch_misses(chunk, got, errors))
+            if rows:
+                try:
+                    with m.stage("db_write"):
+                        upsert_market_cache(rows, m, conn)
+                    updated += len(rows)
+                except Exception as e:
+                    print(f"Chunk write failed ({chunk[0]}..): {e}")
+                    m.incr("failed_chunks")
+                    failed += len(rows)
+    try:
+        blocklist.settle(cur, misses, returned, known_bad)
+        conn.commit()
+    except Exception as e:
+        print(f"Blocklist update failed: {e}")
+    cur.close()
+    conn.close()
 
-    print(f"Tickers: {len(tickers)} | Updated: {len(updated_rows)} | Skipped: {skipped}")
-    return {"updated": len(updated_rows), "skipped": skipped, "tickers": len(tickers)}
+    m.incr("chunks", len(chunks))
+    m.incr("fetched", updated)
+    m.incr("skipped", skipped)
+    m.incr("failed", failed)
+    m.finish()
+    skipped += failed
+    print(f"Tickers: {len(tickers)} | Updated: {updated} | Skipped: {skipped}")
+    return {"updated": updated, "skipped": skipped, "tickers": len(tickers)}
 
 if __name__ == "__main__":
     refresh_market_cache()
@@ -0,0 +1,203 @@
+import hashlib
+import re
+from datetime import datetime
+
+# --- ALERT RULES ENGINE ---
+# Every user's alert preferences are compiled into one rules table
+# (one row per user x ticker x rule) and evaluated against a snapshot of the
+# whole refreshed universe with column-wise numpy masks - no per-user loops.
+#
+# Custom rules live in user_data["alert_rules"] as a list of
+#   {"ticker": "NKE" | "*", "field": "price", "op": "crosses_above", "value": 100, "cooldown": 6}
+# "*" means every ticker on the user's watchlist / portfolio.
+#
+# pandas / numpy are imported inside the functions that need them so app.py
+# can use parse_rule_line() without paying for them.
+
+NUM_FIELDS = ["price", "change", "pp", "rsi", "pick"]
+TEXT_FIELDS = ["volume", "trend", "rating"]
+OPS = [">", ">=", "<", "<=", "==", "abs>=", "crosses_above", "crosses_below", "changed"]
+
+RULE_COLUMNS = ["user", "chat_id", "ticker", "field", "op", "value", "text", "kind", "rule_id", "cooldown"]
+
+# Built-in toggles from the Alert Settings panel: (pref key, field, op, value, kind, cooldown hours)
+DEFAULT_RULES = [
+    ("alert_price", "change", "abs>=", 3.0, "PRICE", 6),
+    ("alert_pm", "pp", "abs>=", 1.5, "EXTENDED", 4),
+    ("alert_rating", "rating", "changed", None, "RATING", 24),
+    ("alert_trend", "trend", "changed", None, "TREND", 24),
+]
+
+def user_tickers(prefs):
+    tickers = []
+    if prefs.get("w_input"): tickers += [x.split(":")[0].strip().upper() for x in prefs["w_input"].split(",") if x.strip()]
+    if prefs.get("portfolio"): tickers += [k.strip().upper() for k in prefs["portfolio"].keys()]
+    return list(dict.fromkeys(tickers))
+
+def rule_tickers(user_map):
+    """Explicit (non-wildcard) tickers named in custom rules, so the universe includes them."""
+    out = set()
+    for _, prefs in user_map:
+        for r in prefs.get("alert_rules") or []:
+            t = str(r.get("ticker", "*")).upper()
+            if t != "*": out.add(t)
+    return out
+
+def parse_rule_line(line):
+    """
+    'NKE price crosses_above 100 6h' -> rule dict. Returns None if the line is invalid.
+    Format: TICKER|* FIELD OP VALUE [COOLDOWNh]
+    """
+    parts = line.strip().split()
+    if len(parts) < 3: return None
+    ticker, field, op = parts[0].upper(), parts[1].lower(), parts[2].lower()
+    if field not in NUM_FIELDS + TEXT_FIELDS or op not in OPS: return None
+    rule = {"ticker": ticker, "field": field, "op": op, "value": None, "cooldown": 6}
+    rest = parts[3:]
+    if rest and re.fullmatch(r"\d+h", rest[-1].lower()):
+        rule["cooldown"] = int(rest.pop()[:-1])
+    if op != "changed":
+        if not rest: return None
+        raw = " ".join(rest)
+        if field in NUM_FIELDS:
+            try: rule["value"] = float(raw)
+            except ValueError: return None
+        else:
+            rule["value"] = raw.upper()
+    return rule
+
+def format_rule(rule):
+    s = f"{rule['ticker']} {rule['field']} {rule['op']}"
+    if rule.get("value") is not None: s += f" {rule['value']:g}" if isinstance(rule["value"], float) else f" {rule['value']}"
+    return s + f" {rule.get('cooldown', 6)}h"
+
+def _rule_id(rule):
+    return "R_" + hashlib.md5(format_rule(rule).encode()).hexdigest()[:10]
+
+def compile_rules(user_map, picks=()):
+    """Flattens every user's toggles + custom rules into one columnar table."""
+    import pandas as pd
+    rows = []
+    for username, prefs in user_map:
+        chat_id = prefs.get("telegram_id")
+        if not chat_id: continue
+        tickers = user_tickers(prefs)
+        for key, field, op, value, kind, cooldown in DEFAULT_RULES:
+            if not prefs.get(key, True): continue
+            for t in tickers:
+                rows.append((username, chat_id, t, field, op, value, "", kind, kind, cooldown))
+        if prefs.get("alert_pre", True):
+            for t in picks:
+                rows.append((username, chat_id, t, "pick", "==", 1.0, "", "PICK", "PICK", 24))
+        for rule in prefs.get("alert_rules") or []:
+            try:
+                field, op = rule["field"], rule["op"]
+                if field not in NUM_FIELDS + TEXT_FIELDS or op not in OPS: continue
+                value = rule.get("value")
+                num = float(value) if field in NUM_FIELDS and value is not None else None
+                text = str(value).upper() if field in TEXT_FIELDS and value is not None else ""
+                targets = tickers if str(rule.get("ticker", "*")) == "*" else [str(rule["ticker"]).upper()]
+                for t in targets:
+                    rows.append((username, chat_id, t, field, op, num, text, "CUSTOM", _rule_id(rule), int(rule.get("cooldown", 6))))
+            except Exception:
+                continue
+    df = pd.DataFrame(rows, columns=RULE_COLUMNS)
+    df["value"] = df["value"].astype(float)
+    return df
+
+def _long_snapshot(snapshot):
+    """Snapshot (one row per ticker) -> long table keyed by (ticker, field)."""
+    import pandas as pd
+    snap = snapshot.reset_index()
+    num = snap.melt(id_vars=["ticker"], value_vars=NUM_FIELDS, var_name="field", value_name="num")
+    # Select before renaming: snap already has "price"/"trend"/"rating" columns
+    prev_num = snap[["ticker", "prev_price"]].rename(columns={"prev_price": "price"}).melt(id_vars=["ticker"], value_vars=["price"], var_name="field", value_name="prev_num")
+    num = num.merge(prev_num, on=["ticker", "field"], how="left")
+    txt = snap.melt(id_vars=["ticker"], value_vars=TEXT_FIELDS, var_name="field", value_name="txt")
+    prev_txt = snap[["ticker", "prev_trend", "prev_rating"]].rename(columns={"prev_trend": "trend", "prev_rating": "rating"}).melt(id_vars=["ticker"], value_vars=["trend", "rating"], var_name="field", value_name="prev_txt")
+    txt = txt.merge(prev_txt, on=["ticker", "field"], how="left")
+    return pd.concat([num, txt], ignore_index=True)
+
+def evaluate(rules, snapshot):
+    """
+    rules: compile_rules() output. snapshot: DataFrame indexed by ticker with
+    price, prev_price, change, pp, pp_price, rsi, pick, volume, trend, prev_trend, rating, prev_rating, name.
+    Returns the rule rows that fire, joined with the snapshot values.
+    """
+    import numpy as np
+    if rules.empty or snapshot.empty: return rules.iloc[0:0]
+    j = rules.merge(_long_snapshot(snapshot), on=["ticker", "field"], how="inner")
+    if j.empty: return j
+
+    op = j["op"].to_numpy()
+    num = j["num"].to_numpy(dtype=float)
+    prev = j["prev_num"].to_numpy(dtype=float)
+    val = j["value"].to_numpy(dtype=float)
+    txt = j["txt"].fillna("").astype(str).str.upper().to_numpy()
+    prev_txt = j["prev_txt"].fillna("").astype(str).str.upper().to_numpy()
+    is_text = j["field"].isin(TEXT_FIELDS).to_numpy()
+
+    with np.errstate(invalid="ignore"):
+        hit = (
+            ((op == ">") & (num > val))
+            | ((op == ">=") & (num >= val))
+            | ((op == "<") & (num < val))
+            | ((op == "<=") & (num <= val))
+            | ((op == "abs>=") & (np.abs(num) >= val))
+            | ((op == "crosses_above") & (prev < val) & (num >= val))
+            | ((op == "crosses_below") & (prev > val) & (num <= val))
+            | ((op == "==") & ~is_text & (num == val))
+            | ((op == "==") & is_text & (txt == j["text"].to_numpy()))
+            | ((op == "changed") & (txt != prev_txt) & (txt != "") & (prev_txt != "") & (txt != "N/A") & (prev_txt != "N/A"))
+        )
+    fired = j[hit].copy()
+    if fired.empty: return fired
+
+    snap = snapshot.reset_index()
+    fired = fired.merge(snap[["ticker", "name", "price", "change", "pp", "pp_price", "rsi", "trend", "rating", "prev_rating"]], on="ticker", how="left")
+    fired["alert_type"] = np.where(
+        fired["kind"] == "PRICE", np.where(fired["change"] > 0, "PRICE_SPIKE", "PRICE_DROP"),
+        np.where(fired["kind"] == "EXTENDED", "EXTENDED_MOVE",
+        np.where(fired["kind"] == "RATING", "RATING_CHANGE",
+        np.where(fired["kind"] == "TREND", "TREND_CHANGE",
+        np.where(fired["kind"] == "PICK", "DAILY_PICK", fired["rule_id"])))))
+    return fired
+
+def apply_cooldowns(fired, cursor):
+    """Drops hits still inside their cooldown, with one alert_log query for the whole batch."""
+    import pandas as pd
+    from worker.markets import db_timezone
+    if fired.empty: return fired
+    users = sorted(fired["user"].unique())
+    fmt = ",".join(["%s"] * len(users))
+    cursor.execute(f"SELECT user_id, ticker, alert_type, last_sent FROM alert_log WHERE user_id IN ({fmt})", tuple(users))
+    log = pd.DataFrame(cursor.fetchall(), columns=["user_id", "ticker", "alert_type", "last_sent"])
+    log = log.rename(columns={"user_id": "user"})
+    out = fired.merge(log, on=["user", "ticker", "alert_type"], how="left")
+    until = pd.to_datetime(out["last_sent"]) + pd.to_timedelta(out["cooldown"], unit="h")
+    # last_sent is written with the DB's NOW(): compare against the DB server's clock, not this host's
+    tz = db_timezone(cursor)
+    now = datetime.now(tz).replace(tzinfo=None) if tz else datetime.now()
+    ready = out["last_sent"].isna() | (until <= pd.Timestamp(now))
+    return out[ready.to_numpy()].drop_duplicates(["user", "ticker", "alert_type"])
+
+def render_message(hit):
+    t, name, kind = hit["ticker"], hit["name"] or hit["ticker"], hit["kind"]
+    if kind == "PRICE":
+        emoji = "🚀" if hit["change"] > 0 else "🔻"
+        return f"{emoji} <b>{name} ({t})</b> Alert!\nPrice: ${hit['price']:.2f}\nMove: {hit['change']:+.2f}%"
+    if kind == "EXTENDED":
+        return f"🌙 <b>{name}</b> Extended Hours!\nPrice: ${hit['pp_price']:.2f}\nChange: {hit['pp']:+.2f}%"
+    if kind == "RATING":
+        return f"📢 <b>{name}</b> Analyst Update!\nOld: {hit['prev_rating']}\nNew: <b>{hit['rating']}</b>"
+    if kind == "TREND":
+        return f"📈 <b>{name} ({t})</b> Trend Change!\nNow: <b>{hit['trend']}</b>\nPrice: ${hit['price']:.2f}"
+    if kind == "PICK":
+        return f"🤖 <b>{name} ({t})</b> is in today's AI Daily Picks!\nPrice: ${hit['price']:.2f}\nMove: {hit['change']:+.2f}%"
+    return f"🎯 <b>{name} ({t})</b> Rule Hit: {render_condition(hit)}\nPrice: ${hit['price']:.2f}\nMove: {hit['change']:+.2f}%"
+
+def render_condition(hit):
+    """A custom rule's condition as text, e.g. "rsi < 30" or "trend == UPTREND" (value is NaN for text rules)."""
+    value = hit["value"]
+    if value == value: return f"{hit['field']} {hit['op']} {value:g}"  # NaN != NaN
+    return f"{hit['field']} {hit['op']}" + (f" {hit['text']}" if hit["text"] else "")
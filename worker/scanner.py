@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import re
+from datetime import datetime, time as dtime
+from zoneinfo import ZoneInfo
+
+from worker.metrics import RunMetrics
+from worker import global_config
+
+# --- GAP SCANNER JOB ---
+# Runs out of band (cron step / admin request) instead of inside the Streamlit page.
+# Each run writes ranked candidates, picks and timing metadata into today's
+# daily_briefing row; the app only enqueues runs and reads the stored result.
+#
+#   python -m worker.scanner          # due scheduled slots + queued admin requests
+#   python -m worker.scanner --now    # queue a manual run and process it right away
+#
+# Candidates come from the headline feeds below by default. SCAN_SOURCE=universe opts
+# in to the full-universe screener (worker/screener.py), which falls back to the
+# headlines when no symbol list is available.
+#
+# yfinance / feedparser / openai / requests are imported inside the functions that
+# use them so app.py can import the queue helpers without paying for them.
+MARKET_TZ = ZoneInfo("America/New_York")
+SLOTS = [("premarket", dtime(8, 45)), ("open", dtime(9, 45)), ("postmarket", dtime(16, 15))]
+FEEDS = ["https://finance.yahoo.com/rss/most-active", "https://finance.yahoo.com/news/rssindex"]
+STOPWORDS = {"ETF", "THE", "FOR", "AND", "NEW", "CEO"}
+MIN_GAP_PCT = 0.5
+MIN_AVG_VOLUME = 50000
+STALE_RUN_MINUTES = 15
+SCAN_SOURCE = os.environ.get("SCAN_SOURCE") or "headlines"   # or "universe"
+
+SCAN_RUNS_DDL = """
+CREATE TABLE IF NOT EXISTS scan_runs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    run_date DATE NOT NULL,
+    slot VARCHAR(32) NOT NULL,
+    requested_by VARCHAR(255),
+    status ENUM('PENDING','RUNNING','DONE','FAILED') NOT NULL DEFAULT 'PENDING',
+    requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    duration_ms INT NULL,
+    error TEXT NULL,
+    UNIQUE KEY uq_run_slot (run_date, slot),
+    KEY idx_status (status)
+)
+"""
+BRIEFING_COLUMNS = [("candidates", "JSON"), ("scan_meta", "JSON")]
+
+def request_scan(conn, requested_by):
+    """Queues a manual run (what the admin button does). Returns the new run id."""
+    now = datetime.now(MARKET_TZ)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT IGNORE INTO scan_runs (run_date, slot, requested_by) VALUES (%s, %s, %s)",
+        (now.strftime("%Y-%m-%d"), f"manual-{now:%H%M}", requested_by),
+    )
+    conn.commit()
+    run_id = cursor.lastrowid
+    cursor.close()
+    return run_id
+
+def recent_runs(conn, limit=5):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT id, run_date, slot, requested_by, status, requested_at, finished_at, duration_ms, error FROM scan_runs ORDER BY id DESC LIMIT %s", (limit,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# --- SCAN ---
+def _discover(m):
+    import feedparser
+    import requests
+    tickers = set()
+    for url in FEEDS:
+        try:
+            resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=5)
+            if resp.status_code != 200: continue
+            for entry in feedparser.parse(resp.content).entries[:25]:
+                match = re.search(r"\b[A-Z]{2,5}\b", entry.title)
+                if match and match.group(0) not in STOPWORDS: tickers.add(match.group(0))
+        except Exception:
+            m.incr("feed_errors")
+    return sorted(tickers)
+
+def _rank(scan_list, fh_key, m):
+    import requests
+    import yfinance as yf
+    candidates = []
+    data = yf.download(" ".join(scan_list), period="5d", interval="1d", group_by="ticker", threads=True, progress=False)
+    for t in scan_list:
+        try:
+            if len(scan_list) > 1:
+                if t not in data.columns.levels[0]: continue
+                df = data[t]
+            else: df = data
+            df = df.dropna(subset=["Close"])
+            if df.empty or len(df) < 2: continue
+            prev_close = float(df["Close"].iloc[-2])
+            curr_price = float(df["Close"].iloc[-1])
+            if fh_key:
+                try:
+                    r = requests.get(f"https://finnhub.io/api/v1/quote?symbol={t}&token={fh_key}", timeout=1).json()
+                    if r.get("c"): curr_price = float(r["c"]); m.incr("finnhub_quotes")
+                except Exception: m.incr("finnhub_errors")
+            gap_pct = ((curr_price - prev_close) / prev_close) * 100
+            avg_vol = float(df["Volume"].mean())
+            atr = float((df["High"] - df["Low"]).mean())
+            if abs(gap_pct) >= MIN_GAP_PCT and avg_vol > MIN_AVG_VOLUME:
+                candidates.append({"ticker": t, "gap": round(gap_pct, 2), "atr": round(atr, 4), "avg_vol": int(avg_vol), "price": round(curr_price, 4)})
+        except Exception:
+            m.incr("scan_errors")
+    candidates.sort(key=lambda c: abs(c["gap"]), reverse=True)
+    for i, c in enumerate(candidates, 1): c["rank"] = i
+    return candidates
+
+def _choose(candidates, api_key, m):
+    top_10 = candidates[:10]
+    if api_key and top_10:
+        try:
+            import openai
+            client = openai.OpenAI(api_key=api_key)
+            prompt = f"Pick Top 3 for day trading. Return JSON: {{'picks': ['TICKER', 'TICKER', 'TICKER']}}\nData: {str(top_10)}"
+            resp = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": prompt}], response_format={"type": "json_object"})
+            picks = json.loads(resp.choices[0].message.content).get("picks", [])
+            if picks:
+                m.incr("llm_picks")
+                return picks
+        except Exception:
+            m.incr("llm_errors")
+    return [c["ticker"] for c in top_10[:3]]
+
+def scan(api_key=None, fh_key=None, m=None, conn=None):
+    """Screen (or discover -> download/rank) -> choose. Returns (candidates, picks)."""
+    m = m or RunMetrics("gap_scanner")
+    candidates = None
+    if conn is not None and SCAN_SOURCE == "universe":
+        from worker import screener  # process pool + numpy, only for this mode
+        candidates = screener.run(conn, m)
+    if candidates is None:
+        with m.stage("discover"): scan_list = _discover(m)
+        m.incr("discovered", len(scan_list))
+        if not scan_list: return [], []
+        with m.stage("rank"): candidates = _rank(scan_list, fh_key, m)
+        m.incr("candidates", len(candidates))
+    with m.stage("choose"): picks = _choose(candidates, api_key, m)
+    return candidates, picks
+
+def store_briefing(conn, candidates, picks, meta):
+    """Writes today's briefing. sent=0 so the picks are dispatched again, as the admin reset did."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """INSERT INTO daily_briefing (date, picks, candidates, scan_meta, sent, created_at) VALUES (%s, %s, %s, %s, 0, NOW())
+           ON DUPLICATE KEY UPDATE picks=VALUES(picks), candidates=VALUES(candidates), scan_meta=VALUES(scan_meta), sent=0, created_at=NOW()""",
+        (datetime.now().strftime("%Y-%m-%d"), json.dumps(picks), json.dumps(candidates), json.dumps(meta)),
+    )
+    conn.commit()
+    cursor.close()
+
+# --- JOB RUNNER ---
+def _api_keys():
+    api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_KEY")
+    if not api_key:
+        from worker.db import get_connection
+        api_key = global_config.current(get_connection)[1].get("openai_key")
+    return api_key, os.environ.get("FINNHUB_API_KEY")
+
+def queue_due_slots(conn, now=None):
+    """
+    Queues the latest scheduled slot whose time has passed (once per day, via the unique key).
+    Earlier slots that were missed are not replayed: only the freshest scan matters.
+    """
+    now = now or datetime.now(MARKET_TZ)
+    if now.weekday() > 4: return
+    due = [slot for slot, at in SLOTS if now.time() >= at]
+    if not due: return
+    cursor = conn.cursor()
+    cursor.execute("INSERT IGNORE INTO scan_runs (run_date, slot, requested_by) VALUES (%s, %s, 'schedule')", (now.strftime("%Y-%m-%d"), due[-1]))
+    conn.commit()
+    cursor.close()
+
+def claim_run(conn):
+    """Claims the oldest pending run (or one stuck RUNNING too long). Returns the row or None."""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        f"""SELECT id, slot FROM scan_runs
+            WHERE status='PENDING' OR (status='RUNNING' AND started_at < NOW() - INTERVAL {STALE_RUN_MINUTES} MINUTE)
+            ORDER BY id LIMIT 1 FOR UPDATE"""
+    )
+    row = cursor.fetchone()
+    if row: cursor.execute("UPDATE scan_runs SET status='RUNNING', started_at=NOW() WHERE id=%s", (row["id"],))
+    conn.commit()
+    cursor.close()
+    return row
+
+def run_one(conn, run):
+    m = RunMetrics("gap_scanner")
+    api_key, fh_key = _api_keys()
+    cursor = conn.cursor()
+    try:
+        candidates, picks = scan(api_key, fh_key, m, conn)
+        s = m.summary()
+        meta = {"run_id": run["id"], "slot": run["slot"], "started_utc": s["started_utc"], "duration_ms": s["duration_ms"], "stages_ms": s["stages_ms"], "counts": s["counts"]}
+        if picks: store_briefing(conn, candidates, picks, meta)
+        cursor.execute("UPDATE scan_runs SET status='DONE', finished_at=NOW(), duration_ms=%s, error=%s WHERE id=%s", (int(s["duration_ms"]), None if picks else "no matches", run["id"]))
+        print(f"🔎 Scan #{run['id']} ({run['slot']}): {len(candidates)} candidates, picks {picks}")
+    except Exception as e:
+        cursor.execute("UPDATE scan_runs SET status='FAILED', finished_at=NOW(), error=%s WHERE id=%s", (str(e)[:500], run["id"]))
+        print(f"❌ Scan #{run['id']} failed: {e}")
+    conn.commit()
+    cursor.close()
+    m.finish()
+
+def run_pending(conn):
+    """Queues due slots, then works through every pending run."""
+    from worker.migrations import migrate  # migrations imports this module's DDL
+    migrate(conn)
+    queue_due_slots(conn)
+    done = 0
+    while True:
+        run = claim_run(conn)
+        if not run: return done
+        run_one(conn, run)
+        done += 1
+
+# Run from the repo root: python -m worker.scanner [--now]
+if __name__ == "__main__":
+    from worker.db import get_connection
+    ap = argparse.ArgumentParser(description="Gap scanner job")
+    ap.add_argument("--now", action="store_true", help="queue a manual run and process it immediately")
+    args = ap.parse_args()
+    conn = get_connection()
+    if args.now:
+        from worker.migrations import migrate
+        migrate(conn)
+        request_scan(conn, "cli")
+    print(f"🏁 {run_pending(conn)} scan(s) run.")
+    conn.close()
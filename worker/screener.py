@@ -0,0 +1,238 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+from worker.metrics import RunMetrics
+from worker import blocklist
+from worker.throttle import batch_misses
+from worker.scanner import MIN_GAP_PCT, MIN_AVG_VOLUME
+
+# --- FULL-UNIVERSE GAP SCREENER ---
+# The headline scanner only sees the few symbols it scrapes from RSS. This screener
+# works over a stored universe instead: every listing in a local symbol list
+# (SYMBOLS_FILE, one symbol per line).
+#
+#   1. refresh: daily bars for the whole list, downloaded CHUNK_SIZE symbols per call
+#      in PROCESSES worker processes and upserted into daily_bars. Symbols that already
+#      have a full window only fetch the last few sessions.
+#   2. screen: one query loads the window as a (symbols x sessions) matrix. Gap %, average
+#      volume and ATR are computed as array operations over the whole matrix, then filtered
+#      and ranked like scanner._rank (same candidate dicts).
+#
+# If the list file is missing or older than SYMBOLS_MAX_AGE_HOURS, it is rebuilt from
+# Nasdaq Trader's public symbol directory (NASDAQ + NYSE/AMEX/ARCA, test issues and
+# ETFs dropped).
+#
+#   python -m worker.screener                 # refresh + screen, print the top 25
+#   python -m worker.screener --no-refresh    # screen the stored bars only
+SYMBOLS_FILE = os.environ.get("SCREEN_SYMBOLS_FILE") or "symbols.txt"
+SYMBOLS_MAX_AGE_HOURS = 24
+SYMBOL_DIRECTORY = [
+    ("https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt", "Symbol"),
+    ("https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt", "ACT Symbol"),
+]
+PROCESSES = int(os.environ.get("SCREEN_PROCESSES") or min(8, os.cpu_count() or 2))
+CHUNK_SIZE = int(os.environ.get("SCREEN_CHUNK_SIZE") or 200)
+WINDOW = 20        # sessions behind average volume and ATR
+KEEP_DAYS = 60     # calendar days of bars kept in daily_bars
+
+DAILY_BARS_DDL = """
+CREATE TABLE IF NOT EXISTS daily_bars (
+    ticker VARCHAR(20) NOT NULL,
+    bar_date DATE NOT NULL,
+    open_price DECIMAL(16, 4),
+    high_price DECIMAL(16, 4),
+    low_price DECIMAL(16, 4),
+    close_price DECIMAL(16, 4),
+    volume BIGINT,
+    PRIMARY KEY (ticker, bar_date),
+    KEY idx_bars_date (bar_date)
+)
+"""
+UPSERT_SQL = """INSERT INTO daily_bars (ticker, bar_date, open_price, high_price, low_price, close_price, volume) VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE open_price=VALUES(open_price), high_price=VALUES(high_price), low_price=VALUES(low_price), close_price=VALUES(close_price), volume=VALUES(volume)"""
+
+# --- SYMBOL LIST ---
+def fetch_symbol_directory():
+    """Common-stock symbols from Nasdaq Trader's directory files, Yahoo-style (BRK.B -> BRK-B)."""
+    import requests
+    symbols = set()
+    for url, column in SYMBOL_DIRECTORY:
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        lines = r.text.strip().splitlines()
+        header = lines[0].split("|")
+        sym, test, etf = header.index(column), header.index("Test Issue"), header.index("ETF")
+        for line in lines[1:]:
+            f = line.split("|")
+            if len(f) != len(header) or f[test] == "Y" or f[etf] == "Y": continue  # also skips the "File Creation Time" footer
+            s = f[sym].strip().replace(".", "-")
+            if s and s.replace("-", "").isalnum(): symbols.add(s.upper())
+    return sorted(symbols)
+
+def load_symbols(path=SYMBOLS_FILE, m=None):
+    """The local symbol list, rebuilt from the directory when missing or stale."""
+    stale = not os.path.exists(path) or time.time() - os.path.getmtime(path) > SYMBOLS_MAX_AGE_HOURS * 3600
+    if stale:
+        try:
+            symbols = fetch_symbol_directory()
+            with open(path, "w") as f: f.write("\n".join(symbols) + "\n")
+        except Exception as e:
+            if m: m.incr("symbol_list_errors")
+            print(f"⚠️ Symbol directory download failed: {e}")
+    if not os.path.exists(path): return []
+    with open(path) as f:
+        return sorted({s.strip().upper() for s in f if s.strip() and not s.startswith("#")})
+
+# --- REFRESH (worker processes) ---
+def _download(chunk, period):
+    """
+    Runs in a worker process: one yf.download for the chunk (a process runs one task at a
+    time, so yfinance's shared error dict belongs to this call).
+    Returns (bar rows, symbols that came back, {symbol: error text}), cheap to pickle.
+    """
+    import yfinance as yf
+    data = yf.download(" ".join(chunk), period=period, interval="1d", group_by="ticker", threads=True, progress=False)
+    errors = {t: str(e) for t, e in (getattr(getattr(yf, "shared", None), "_ERRORS", None) or {}).items()}
+    rows, returned = [], []
+    for t in chunk:
+        try:
+            df = data[t] if len(chunk) > 1 else data
+            df = df.dropna(subset=["Close"])
+        except Exception:
+            continue
+        if df.empty: continue
+        returned.append(t)
+        for d, o, h, l, c, v in zip(df.index, df["Open"], df["High"], df["Low"], df["Close"], df["Volume"].fillna(0)):
+            rows.append((t, d.date().isoformat(), float(o), float(h), float(l), float(c), int(v)))
+    return rows, returned, errors
+
+def _periods(cursor, symbols):
+    """Symbols with a full window stored only need the last few sessions."""
+    cursor.execute("SELECT ticker, COUNT(*) AS bars FROM daily_bars WHERE bar_date >= %s GROUP BY ticker", (date.today() - timedelta(days=KEEP_DAYS),))
+    full = {r[0] for r in cursor.fetchall() if r[1] >= WINDOW + 1}
+    return [t for t in symbols if t in full], [t for t in symbols if t not in full]
+
+def refresh(conn, symbols, m, processes=PROCESSES):
+    """Downloads recent daily bars for `symbols` in parallel processes and upserts them."""
+    cursor, dcursor = conn.cursor(), conn.cursor(dictionary=True)
+    with m.stage("universe"):
+        symbols, known_bad = blocklist.screen(dcursor, symbols, m)
+        update, backfill = _periods(cursor, symbols)
+    jobs = [(update[i:i + CHUNK_SIZE], "5d") for i in range(0, len(update), CHUNK_SIZE)]
+    jobs += [(backfill[i:i + CHUNK_SIZE], "3mo") for i in range(0, len(backfill), CHUNK_SIZE)]
+    m.incr("chunks", len(jobs))
+
+    returned, misses = [], []
+    # spawn: children start clean instead of inheriting the parent's DB connection and threads
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as ex:
+        futures = {ex.submit(_download, chunk, period): chunk for chunk, period in jobs}
+        for f in as_completed(futures):
+            try:
+                with m.stage("download"): rows, got, errors = f.result()
+            except Exception:
+                m.incr("download_errors"); continue  # a chunk that raised says nothing about its symbols
+            if not got: m.incr("empty_chunks")
+            returned += got
+            misses += batch_misses(futures[f], got, errors)
+            with m.stage("db_write"):
+                for i in range(0, len(rows), 1000): cursor.executemany(UPSERT_SQL, rows[i:i + 1000])
+                conn.commit()
+            m.incr("bars_written", len(rows))
+
+    with m.stage("db_write"):
+        cursor.execute("DELETE FROM daily_bars WHERE bar_date < %s", (date.today() - timedelta(days=KEEP_DAYS),))
+        misses = sorted(misses)
+        blocklist.settle(dcursor, misses, returned, known_bad)
+        conn.commit()
+    cursor.close(); dcursor.close()
+    m.incr("refreshed", len(returned)); m.incr("missing", len(misses))
+    return returned
+
+# --- SCREEN (vectorized) ---
+def load_bars(conn, symbols=None):
+    """
+    The stored window as a wide frame: one row per ticker, (field, session) columns.
+    Sessions are the last WINDOW + 1 dates in daily_bars.
+    """
+    import pandas as pd
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT ticker, bar_date, open_price, high_price, low_price, close_price, volume FROM daily_bars WHERE bar_date >= %s",
+        (date.today() - timedelta(days=KEEP_DAYS),),
+    )
+    df = pd.DataFrame(cursor.fetchall(), columns=["ticker", "bar_date", "open", "high", "low", "close", "volume"])
+    cursor.close()
+    if symbols is not None: df = df[df["ticker"].isin(set(symbols))]
+    if df.empty: return df
+    wide = df.pivot(index="ticker", columns="bar_date").astype(float)
+    sessions = sorted(df["bar_date"].unique())[-(WINDOW + 1):]
+    return wide.loc[:, (slice(None), sessions)]
+
+def screen_bars(wide, min_gap=MIN_GAP_PCT, min_avg_volume=MIN_AVG_VOLUME):
+    """Gap %, average volume and ATR for every row at once. Returns ranked candidate dicts."""
+    import numpy as np
+    if wide.empty: return []
+    c, h, l, v = (wide[f].to_numpy() for f in ("close", "high", "low", "volume"))
+    n, k = c.shape
+    rows = np.arange(n)
+
+    # Gap: latest close vs the close before it. A ticker must have a bar in the latest session.
+    pos = np.where(~np.isnan(c), np.arange(k), -1)
+    last = pos.max(axis=1)
+    prev = np.where(pos == last[:, None], -1, pos).max(axis=1)
+    curr, prev_close = c[rows, last], c[rows, prev]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gap = (curr - prev_close) / prev_close * 100
+
+    # True range uses the previous session's close; fmax skips gaps in a ticker's history
+    c_prev = np.hstack([np.full((n, 1), np.nan), c[:, :-1]])
+    tr = np.fmax(h - l, np.fmax(np.abs(h - c_prev), np.abs(l - c_prev)))
+
+    def mean(x):
+        seen = (~np.isnan(x)).sum(axis=1)
+        return np.nansum(x, axis=1) / np.maximum(seen, 1)
+    avg_vol, atr = mean(v[:, -WINDOW:]), mean(tr[:, -WINDOW:])
+
+    keep = (last == k - 1) & (prev >= 0) & (prev_close > 0) & (np.abs(gap) >= min_gap) & (avg_vol > min_avg_volume)
+    idx = np.flatnonzero(keep)
+    idx = idx[np.argsort(-np.abs(gap[idx]), kind="stable")]
+    tickers = wide.index.to_numpy()
+    return [
+        {"ticker": tickers[i], "gap": round(float(gap[i]), 2), "atr": round(float(atr[i]), 4), "avg_vol": int(avg_vol[i]), "price": round(float(curr[i]), 4), "rank": r}
+        for r, i in enumerate(idx, 1)
+    ]
+
+def run(conn, m=None, do_refresh=True, path=SYMBOLS_FILE, processes=PROCESSES):
+    """Symbol list -> refresh -> screen. Returns ranked candidates, or None without a symbol list."""
+    m = m or RunMetrics("universe_screen")
+    with m.stage("universe"): symbols = load_symbols(path, m)
+    m.incr("symbols", len(symbols))
+    if not symbols: return None
+    if do_refresh: refresh(conn, symbols, m, processes)
+    with m.stage("db_read"): wide = load_bars(conn, symbols)
+    with m.stage("indicators"): candidates = screen_bars(wide)
+    m.incr("screened", len(wide)); m.incr("candidates", len(candidates))
+    return candidates
+
+# Run from the repo root: python -m worker.screener [--no-refresh] [--top N]
+if __name__ == "__main__":
+    from worker.db import get_connection
+    from worker.migrations import migrate
+    ap = argparse.ArgumentParser(description="Full-universe gap screener")
+    ap.add_argument("--no-refresh", action="store_true", help="screen the stored bars without downloading")
+    ap.add_argument("--symbols", default=SYMBOLS_FILE, help="symbol list, one per line")
+    ap.add_argument("--processes", type=int, default=PROCESSES)
+    ap.add_argument("--top", type=int, default=25)
+    args = ap.parse_args()
+    conn = get_connection()
+    migrate(conn)
+    m = RunMetrics("universe_screen")
+    candidates = run(conn, m, not args.no_refresh, args.symbols, args.processes) or []
+    for c in candidates[:args.top]:
+        print(f"{c['rank']:>3}. {c['ticker']:<8} gap {c['gap']:+7.2f}%  price {c['price']:>10,.4f}  atr {c['atr']:>8.4f}  avg vol {c['avg_vol']:>12,}")
+    m.finish()
+    conn.close()
@@ -0,0 +1,91 @@
+import hashlib
+import time
+
+# Lease rows live in MySQL so any number of hosts can coordinate without extra infra.
+# A shard is owned by whoever holds an unexpired lease; once a shard finishes a
+# cycle it records done_cycle so an overlapping run (cron + manual dispatch)
+# cannot process it again in the same cycle. Cycles are identified by their start
+# epoch (cycle_start), not a cycle count, so runs with different cycle lengths
+# (daemon phases, cron) compare correctly.
+LEASE_DDL = """
+CREATE TABLE IF NOT EXISTS worker_leases (
+    shard_id INT PRIMARY KEY,
+    owner VARCHAR(128) NOT NULL DEFAULT '',
+    expires_at DATETIME NOT NULL,
+    done_cycle BIGINT NOT NULL DEFAULT -1
+)
+"""
+
+def _weight(ticker, shard):
+    return int(hashlib.md5(f"{shard}:{ticker}".encode()).hexdigest()[:16], 16)
+
+def shard_for(ticker, total_shards):
+    """
+    Rendezvous (highest-random-weight) hashing: a ticker always lands on the same
+    shard, and changing the shard count only moves ~1/N of the tickers.
+    """
+    return max(range(total_shards), key=lambda s: _weight(ticker, s))
+
+def partition(tickers, total_shards):
+    shards = {s: [] for s in range(total_shards)}
+    for t in tickers:
+        shards[shard_for(t, total_shards)].append(t)
+    return shards
+
+def cycle_start(cycle_seconds, now=None):
+    """Start epoch of the cycle `now` falls in."""
+    now = time.time() if now is None else now
+    return int(now // cycle_seconds) * cycle_seconds
+
+def acquire_lease(conn, shard, owner, cycle, ttl_seconds):
+    """True if `owner` now holds `shard` for `cycle`. Uses DB time so host clocks don't matter."""
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("INSERT IGNORE INTO worker_leases (shard_id, owner, expires_at) VALUES (%s, '', NOW())", (shard,))
+        conn.commit()
+        cur.execute("SELECT owner, expires_at > NOW() AS live, done_cycle FROM worker_leases WHERE shard_id=%s FOR UPDATE", (shard,))
+        row = cur.fetchone()
+        if row['done_cycle'] >= cycle or (row['live'] and row['owner'] != owner):
+            conn.rollback()
+            return False
+        cur.execute(
+            "UPDATE worker_leases SET owner=%s, expires_at=NOW() + INTERVAL %s SECOND WHERE shard_id=%s",
+            (owner, ttl_seconds, shard),
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Lease error (shard {shard}): {e}")
+        try: conn.rollback()
+        except: pass
+        return False
+    finally:
+        cur.close()
+
+def renew_lease(conn, shard, owner, ttl_seconds):
+    """True if `owner` still holds `shard`. A DB error counts as a lost lease."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "UPDATE worker_leases SET expires_at=NOW() + INTERVAL %s SECOND WHERE shard_id=%s AND owner=%s",
+            (ttl_seconds, shard, owner),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+    except Exception as e:
+        print(f"Lease renew error (shard {shard}): {e}")
+        try: conn.rollback()
+        except: pass
+        return False
+    finally:
+        cur.close()
+
+def complete_lease(conn, shard, owner, cycle):
+    """Marks the shard done for this cycle and releases it."""
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE worker_leases SET done_cycle=%s, expires_at=NOW() WHERE shard_id=%s AND owner=%s",
+        (cycle, shard, owner),
+    )
+    conn.commit()
+    cur.close()
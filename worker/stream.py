@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+
+from worker.metrics import RunMetrics
+
+# --- STREAMING QUOTE INGESTION ---
+# A long-lived consumer of Yahoo's quote stream, or any server speaking the same protocol:
+# {"subscribe": [...]} / {"unsubscribe": [...]} go in, one quote per message comes out.
+# Ticks are coalesced in memory (newest quote per symbol wins) and the quotes that actually
+# changed go to stock_cache in one executemany per flush. Flushes are FLUSH_SECONDS apart
+# while they carry at least FLUSH_MIN_ROWS rows; smaller ones double the gap, up to
+# FLUSH_MAX_SECONDS, so a quiet tape (overnight crypto / FX) costs a few writes a minute.
+# The subscription follows the worker's universe, re-read every UNIVERSE_SECONDS.
+#
+# Polling (app refresh / alert_worker) still owns indicators, history and metadata; the
+# stream moves price, day change and the day's range in between polls. Rows of open
+# venues also get checked_at=NOW(), so pollers skip symbols the stream keeps fresh; closed
+# venues keep their checked_at, so the post-close poll still runs.
+#
+# Each flush costs 2-3 round-trips (one executemany per open/closed group + commit).
+# Measured with streamtest.py (15 symbols, 2000 ticks/s, universe re-read every 30s): a
+# 0.5s flush spent ~360 round-trips/min, the 5s default ~38/min, against ~15/min for the
+# app polling the same symbols every 120s. Tick -> commit lag of the newest quote stays
+# ~10-15ms either way; what the interval buys is how stale a row can get (5s vs 120s).
+# So streaming costs about 2.5x the polling round-trips for ~25x fresher prices, not less I/O.
+#
+#   python -m worker.stream                                  # Yahoo
+#   python -m worker.stream --url ws://localhost:8765        # stand-in server (streamtest.py)
+#
+# websockets is imported in run(). Yahoo's base64 protobuf messages are decoded with the
+# PricingData class yfinance ships (yfinance >= 0.2.54, needs protobuf); plain JSON quotes
+# ({"id", "price", "change_percent", "day_high", "day_low", "time"}) are read as-is.
+STREAM_URL = os.environ.get("STREAM_URL") or "wss://streamer.finance.yahoo.com/?version=2"
+FLUSH_SECONDS = float(os.environ.get("STREAM_FLUSH_SECONDS") or 5)
+FLUSH_MAX_SECONDS = float(os.environ.get("STREAM_FLUSH_MAX_SECONDS") or 30)
+FLUSH_MIN_ROWS = int(os.environ.get("STREAM_FLUSH_MIN_ROWS") or 5)
+UNIVERSE_SECONDS = int(os.environ.get("STREAM_UNIVERSE_SECONDS") or 30)
+REPORT_SECONDS = int(os.environ.get("STREAM_REPORT_SECONDS") or 300)
+RECONNECT_MAX = 60
+
+UPSERT_SQL = """INSERT INTO stock_cache (ticker, current_price, day_change, day_high, day_low, checked_at) VALUES (%s, %s, %s, %s, %s, NOW())
+ON DUPLICATE KEY UPDATE current_price=VALUES(current_price), day_change=VALUES(day_change), day_high=VALUES(day_high), day_low=VALUES(day_low), checked_at=NOW()"""
+# Closed venues: move the price but leave checked_at for the post-close poll
+UPSERT_CLOSED_SQL = """INSERT INTO stock_cache (ticker, current_price, day_change, day_high, day_low) VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE current_price=VALUES(current_price), day_change=VALUES(day_change), day_high=VALUES(day_high), day_low=VALUES(day_low)"""
+
+def _pricing(payload):
+    from yfinance.pricing_pb2 import PricingData
+    p = PricingData()
+    p.ParseFromString(base64.b64decode(payload))
+    return {"id": p.id, "price": p.price, "change_percent": p.change_percent, "day_high": p.day_high, "day_low": p.day_low, "time": p.time}
+
+def decode(raw):
+    """One stream message -> {ticker, price, change_pct, day_high, day_low, ts} or None."""
+    try: msg = json.loads(raw)
+    except ValueError: msg = {"message": raw}  # version 1 sends bare base64
+    if not isinstance(msg, dict): return None
+    q = msg if "id" in msg else _pricing(msg["message"]) if msg.get("message") else None
+    if not q or not q.get("id") or not q.get("price"): return None
+    price = float(q["price"])
+    return {
+        "ticker": q["id"].upper(), "price": price, "change_pct": float(q.get("change_percent") or 0.0),
+        "day_high": float(q.get("day_high") or price), "day_low": float(q.get("day_low") or price),
+        "ts": (q.get("time") or time.time() * 1000) / 1000,
+    }
+
+def load_stream_universe(cursor):
+    """The worker's universe minus blocklisted symbols."""
+    from worker.alert_worker import load_universe
+    from worker import blocklist
+    tickers, _, _ = load_universe(cursor, RunMetrics("quote_stream_universe"))
+    return set(blocklist.screen(cursor, tickers)[0])
+
+def _pct(xs, p):
+    if not xs: return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+class QuoteStream:
+    """
+    stream = QuoteStream(get_connection, url)
+    asyncio.run(stream.run(seconds=None))   # None = until cancelled
+
+    All DB work (flushes, universe reloads) runs one call at a time in a worker thread
+    on a single connection; the socket loop only decodes and coalesces.
+    """
+
+    def __init__(self, get_connection, url=STREAM_URL, universe=load_stream_universe,
+                 flush_seconds=FLUSH_SECONDS, universe_seconds=UNIVERSE_SECONDS, report_seconds=REPORT_SECONDS,
+                 flush_max_seconds=FLUSH_MAX_SECONDS, flush_min_rows=FLUSH_MIN_ROWS):
+        self.get_connection = get_connection
+        self.url = url
+        self.universe = universe
+        self.flush_seconds, self.universe_seconds, self.report_seconds = flush_seconds, universe_seconds, report_seconds
+        self.flush_max_seconds, self.flush_min_rows = max(flush_seconds, flush_max_seconds), flush_min_rows
+        self.pending = {}        # ticker -> newest quote since the last flush
+        self.written = {}        # ticker -> values last written, to drop no-change ticks
+        self.wanted = set()      # current universe
+        self.subscribed = set()  # what the live socket is subscribed to
+        self.lags = []           # tick time -> committed, seconds, this report window
+        self.ws = None
+        self.conn = None
+        self.m = RunMetrics("quote_stream")
+
+    # --- socket side ---
+    def on_message(self, raw):
+        try: q = decode(raw)
+        except Exception:
+            self.m.incr("bad_messages"); return
+        if not q or q["ticker"] not in self.wanted:
+            self.m.incr("ignored"); return
+        self.m.incr("ticks"); self.m.incr("bytes_in", len(raw))
+        self.pending[q["ticker"]] = q
+
+    async def _resubscribe(self):
+        ws = self.ws
+        if ws is None: return
+        add, drop = sorted(self.wanted - self.subscribed), sorted(self.subscribed - self.wanted)
+        if add: await ws.send(json.dumps({"subscribe": add}))
+        if drop: await ws.send(json.dumps({"unsubscribe": drop}))
+        self.subscribed = (self.subscribed | set(add)) - set(drop)
+        for t in drop: self.pending.pop(t, None)
+        self.m.incr("subscribed", len(add)); self.m.incr("unsubscribed", len(drop))
+        self.m.gauge("subscriptions", len(self.subscribed))
+
+    async def _socket_loop(self):
+        import websockets
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=2 ** 20, ping_interval=20, close_timeout=2) as ws:
+                    self.ws, self.subscribed = ws, set()
+                    await self._resubscribe()
+                    delay = 1
+                    async for raw in ws: self.on_message(raw)
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                self.m.incr("reconnects")
+                print(f"⚠️ Stream disconnected: {e} (retry in {delay}s)")
+            finally: self.ws = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    # --- DB side (worker thread) ---
+    def _db(self):
+        if self.conn is None: self.conn = self.get_connection()
+        return self.m.track(self.conn)
+
+    def _drop_db(self):
+        try: self.conn.close()
+        except Exception: pass
+        self.conn = None
+
+    def _load_universe(self):
+        db = self._db()
+        db.commit()  # end the last snapshot so new watchlists are visible
+        cursor = db.cursor(dictionary=True)
+        try:
+            with self.m.stage("universe"): return set(self.universe(cursor))
+        finally: cursor.close()
+
+    def _take(self):
+        batch, self.pending = self.pending, {}
+        return batch
+
+    def _write(self, batch):
+        from worker.markets import is_open
+        rows = []
+        for t, q in batch.items():
+            vals = (round(q["price"], 4), round(q["change_pct"], 2), round(q["day_high"], 4), round(q["day_low"], 4))
+            if self.written.get(t) == vals: self.m.incr("unchanged"); continue
+            rows.append((t,) + vals)
+        if not rows: return 0
+        db = self._db()
+        open_rows = [r for r in rows if is_open(r[0])]
+        closed_rows = [r for r in rows if not is_open(r[0])]
+        with self.m.stage("db_write"):
+            cursor = db.cursor()
+            if open_rows: cursor.executemany(UPSERT_SQL, open_rows)
+            if closed_rows: cursor.executemany(UPSERT_CLOSED_SQL, closed_rows)
+            db.commit()
+            cursor.close()
+        now = time.time()
+        for r in rows: self.written[r[0]] = r[1:]
+        self.lags.extend(now - batch[r[0]]["ts"] for r in rows)
+        self.m.incr("flushes"); self.m.incr("rows_written", len(rows))
+        return len(rows)
+
+    async def _flush(self):
+        """Writes what is pending. Returns the number of rows written."""
+        batch = self._take()
+        if not batch: return 0
+        try: return await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            self.m.incr("flush_errors")
+            print(f"❌ Stream flush failed: {e}")
+            for t, q in batch.items(): self.pending.setdefault(t, q)  # newer ticks win
+            self._drop_db()
+            return 0
+
+    async def _db_loop(self):
+        next_universe = next_report = 0.0
+        delay = self.flush_seconds
+        while True:
+            now = time.monotonic()
+            if now >= next_universe:
+                try:
+                    self.wanted = await asyncio.to_thread(self._load_universe)
+                    await self._resubscribe()
+                except Exception as e:
+                    self.m.incr("universe_errors")
+                    print(f"❌ Stream universe reload failed: {e}")
+                    self._drop_db()
+                next_universe = now + self.universe_seconds
+            # Small flushes back off (up to flush_max_seconds); a busy one resets the gap
+            wrote = await self._flush()
+            delay = self.flush_seconds if wrote >= self.flush_min_rows else min(self.flush_max_seconds, delay * 2)
+            self.m.gauge("flush_interval_s", delay)
+            if not next_report: next_report = now + self.report_seconds
+            elif now >= next_report:
+                self.report()
+                next_report = now + self.report_seconds
+            await asyncio.sleep(delay)
+
+    # --- lifecycle ---
+    def report(self):
+        """Finishes this window's metrics (freshness gauges included) and starts the next."""
+        self.m.gauge("subscriptions", len(self.subscribed))
+        self.m.gauge("lag_p50_ms", round(_pct(self.lags, 50) * 1000, 1))
+        self.m.gauge("lag_p95_ms", round(_pct(self.lags, 95) * 1000, 1))
+        s = self.m.finish()
+        self.m, self.lags = RunMetrics("quote_stream"), []
+        return s
+
+    async def run(self, seconds=None):
+        """Streams until cancelled (or for `seconds`). Returns the last window's summary."""
+        tasks = [asyncio.ensure_future(self._socket_loop()), asyncio.ensure_future(self._db_loop())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=seconds, return_when=asyncio.FIRST_EXCEPTION)
+            for t in done: t.result()
+        finally:
+            for t in tasks: t.cancel()
+            await asyncio.gather(tasks[1], return_exceptions=True)
+            await self._flush()  # before the socket's close handshake, so the last ticks land promptly
+            await asyncio.gather(tasks[0], return_exceptions=True)
+            summary = self.report()
+            if self.conn is not None: self._drop_db()
+        return summary
+
+# Run from the repo root: python -m worker.stream [--url URL] [--seconds N]
+if __name__ == "__main__":
+    from worker.db import get_connection
+    ap = argparse.ArgumentParser(description="Streaming quote ingestion into stock_cache")
+    ap.add_argument("--url", default=STREAM_URL)
+    ap.add_argument("--seconds", type=float, default=None, help="stop after N seconds (default: run forever)")
+    ap.add_argument("--flush", type=float, default=FLUSH_SECONDS, help="seconds between stock_cache flushes (backs off up to STREAM_FLUSH_MAX_SECONDS when quiet)")
+    args = ap.parse_args()
+    print(f"📡 Streaming quotes from {args.url} (flush every {args.flush}s)")
+    try: asyncio.run(QuoteStream(get_connection, args.url, flush_seconds=args.flush).run(args.seconds))
+    except KeyboardInterrupt: pass
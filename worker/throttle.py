@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- ADAPTIVE FETCH CONTROLLER ---
+# Sizes Yahoo download batches from what the upstream is currently allowing:
+#   - healthy, fast batches grow the batch size (+BATCH_STEP) and then concurrency (+1)
+#   - slow batches stop growth; errors halve the batch size and drop to one in flight
+#   - THROTTLE_TRIP throttled/empty batches in a row open the circuit breaker:
+#     nothing is fetched for BACKOFF_BASE seconds (doubling per trip, up to BACKOFF_MAX),
+#     then a single half-size probe batch decides whether to close it again.
+#   - a batch that is empty because Yahoo reported every symbol unknown or delisted is
+#     neither a success nor a throttle: it is passed on (so the caller can blocklist the
+#     symbols) and leaves the controller alone.
+# One controller lives per process so its state survives across refresh runs.
+# Downloads are serialized (yf_download), so waves above one batch only help a
+# download() that does more than call yf.download; CONCURRENCY_MAX defaults to 1.
+BATCH_MIN = int(os.environ.get("FETCH_BATCH_MIN") or 5)
+BATCH_MAX = int(os.environ.get("FETCH_BATCH_MAX") or 60)
+BATCH_START = int(os.environ.get("FETCH_BATCH_START") or 15)
+BATCH_STEP = 5
+CONCURRENCY_MAX = int(os.environ.get("FETCH_CONCURRENCY_MAX") or 1)
+SLOW_SECONDS = float(os.environ.get("FETCH_SLOW_SECONDS") or 8)
+THROTTLE_TRIP = 3
+BACKOFF_BASE = 30
+BACKOFF_MAX = 900
+WINDOW = 20
+
+THROTTLE_MARKERS = ("429", "too many requests", "rate limit", "ratelimit")
+NO_DATA_MARKERS = ("delisted", "no data found", "no price data found", "no timezone found", "symbol not found", "quote not found")
+
+def is_throttle_error(e):
+    text = f"{type(e).__name__} {e}".lower()
+    return any(k in text for k in THROTTLE_MARKERS)
+
+def is_no_data_error(e):
+    """Yahoo answered, and the answer is that the symbol has no data (not a request failure)."""
+    text = str(e).lower()
+    return any(k in text for k in NO_DATA_MARKERS) and not is_throttle_error(e)
+
+def _error(errors, t):
+    return errors.get(t, errors.get(t.upper()))
+
+def all_no_data(batch, errors):
+    """True if yf_download reported every symbol in `batch` as unknown or delisted."""
+    return bool(batch) and all(is_no_data_error(_error(errors, t) or "") for t in batch)
+
+def batch_misses(batch, got, errors):
+    """
+    Symbols of a finished batch worth a blocklist strike. A batch that came back empty was
+    most likely throttled, so it only counts when Yahoo said every symbol is dead; within a
+    batch that did return data, a symbol only counts if it failed with no data (or no error).
+    """
+    if not got: return list(batch) if all_no_data(batch, errors) else []
+    got = set(got)
+    return [t for t in batch if t not in got and (_error(errors, t) is None or is_no_data_error(_error(errors, t)))]
+
+# yf.download collects results in module globals (yfinance.shared._DFS / _ERRORS), so two
+# calls in flight at once can mix up or drop each other's symbols. Every caller in this
+# process goes through yf_download, which runs one download at a time; parallelism comes
+# from yf.download's own per-symbol threads (or from separate processes, worker/screener.py).
+_YF_LOCK = threading.Lock()
+
+def yf_download(tickers, **kwargs):
+    """yf.download, serialized. Returns (frame, {symbol: error text}) for this call."""
+    import yfinance as yf
+    with _YF_LOCK:
+        data = yf.download(tickers, **kwargs)
+        errors = dict(getattr(getattr(yf, "shared", None), "_ERRORS", None) or {})
+    return data, errors
+
+
+class FetchController:
+    """
+        ctl = FetchController()
+        for batch, result in ctl.run(tickers, download, m):
+            ...
+
+    `download(batch)` returns a result or raises; `empty(result)` says whether the
+    upstream returned nothing (treated like a throttle) and `invalid(result)` whether
+    that is because every symbol is unknown (yielded, not counted). Thread-safe.
+    """
+
+    def __init__(self):
+        self.batch_size = BATCH_START
+        self.concurrency = 1
+        self.state = "CLOSED"
+        self.open_until = 0.0
+        self.backoff = BACKOFF_BASE
+        self.throttled_streak = 0
+        self.samples = deque(maxlen=WINDOW)  # (seconds, ok)
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    # --- breaker ---
+    def allow(self):
+        with self._lock:
+            if self.state == "OPEN" and time.time() >= self.open_until:
+                self.state = "HALF_OPEN"
+            return self.state != "OPEN"
+
+    def plan(self):
+        """(batch size, batches in flight) for the next wave."""
+        with self._lock:
+            if self.state == "HALF_OPEN": return max(BATCH_MIN, self.batch_size // 2), 1
+            return self.batch_size, self.concurrency
+
+    def record(self, seconds, ok, throttled=False):
+        with self._lock:
+            self.samples.append((seconds, ok))
+            if ok:
+                self.throttled_streak = 0
+                if self.state == "HALF_OPEN":
+                    self.state = "CLOSED"; self.backoff = BACKOFF_BASE
+                if seconds < SLOW_SECONDS:
+                    if self.batch_size < BATCH_MAX: self.batch_size = min(BATCH_MAX, self.batch_size + BATCH_STEP)
+                    elif self.concurrency < CONCURRENCY_MAX and self.error_rate() == 0: self.concurrency += 1
+                elif self.concurrency > 1:
+                    self.concurrency -= 1
+                return
+            self.batch_size = max(BATCH_MIN, self.batch_size // 2)
+            self.concurrency = 1
+            if throttled: self.throttled_streak += 1
+            if self.state == "HALF_OPEN" or self.throttled_streak >= THROTTLE_TRIP:
+                if self.state == "HALF_OPEN": self.backoff = min(BACKOFF_MAX, self.backoff * 2)
+                self.state = "OPEN"; self.open_until = time.time() + self.backoff
+                self.throttled_streak = 0; self.trips += 1
+
+    def error_rate(self):
+        if not self.samples: return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency_p50(self):
+        if not self.samples: return 0.0
+        xs = sorted(s for s, _ in self.samples)
+        return xs[len(xs) // 2]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "fetch_batch_size": self.batch_size,
+                "fetch_concurrency": self.concurrency,
+                "fetch_breaker_open": int(self.state != "CLOSED"),
+                "fetch_breaker_trips": self.trips,
+                "fetch_backoff_s": self.backoff,
+                "fetch_error_rate": round(self.error_rate(), 3),
+                "fetch_latency_p50_s": round(self.latency_p50(), 2),
+            }
+
+    # --- fetching ---
+    def _fetch(self, batch, download, empty, invalid):
+        t = time.perf_counter()
+        try:
+            result = download(batch)
+        except Exception as e:
+            self.record(time.perf_counter() - t, False, throttled=is_throttle_error(e))
+            return None
+        if empty(result):
+            if invalid(result): return result  # a batch of dead symbols says nothing about the upstream
+            self.record(time.perf_counter() - t, False, throttled=True)
+            return None
+        self.record(time.perf_counter() - t, True)
+        return result
+
+    def run(self, tickers, download, m, empty=lambda r: r is None, invalid=lambda r: False):
+        """
+        Yields (batch, result) for every batch that came back, in waves of `plan()`.
+        Stops early (counting the rest as breaker_skipped) while the breaker is open.
+        """
+        queue = list(tickers)
+        while queue:
+            if not self.allow():
+                m.incr("breaker_skipped", len(queue)); break
+            size, workers = self.plan()
+            wave = [queue[k:k + size] for k in range(0, min(len(queue), size * workers), size)]
+            queue = queue[size * workers:]
+            with m.stage("download"):
+                if len(wave) == 1: results = [self._fetch(wave[0], download, empty, invalid)]
+                else:
+                    with ThreadPoolExecutor(max_workers=len(wave)) as ex:
+                        results = list(ex.map(lambda b: self._fetch(b, download, empty, invalid), wave))
+            for batch, result in zip(wave, results):
+                m.incr("batches")
+                if result is None: m.incr("failed_batches"); continue
+                yield batch, result
+        for k, v in self.snapshot().items(): m.gauge(k, v)